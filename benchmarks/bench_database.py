@@ -0,0 +1,81 @@
+"""Benchmark user writes under a burst of ``/chat`` token accounting.
+
+Every simulated message adds some tokens to a user. "before" replays the old
+access pattern (read and parse the user blob, existence SELECT, UPDATE or
+INSERT, commit per write, on the calling thread); "after" goes through
+:meth:`database.Database.add_usage`, a single atomic statement under group
+commit.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_database --messages 2000 --users 50
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from database import CREATE_USERS, Database, User
+
+
+def before(file: str, messages: list) -> float:
+    connection = sqlite3.connect(file)
+    connection.execute(CREATE_USERS)
+    connection.commit()
+    start = time.perf_counter()
+    for user_id, tokens in messages:
+        cur = connection.cursor()
+        cur.execute('SELECT user FROM users WHERE id=?', (user_id,))
+        data = cur.fetchone()
+        user = User.load(data[0]) if data is not None else User()
+        user.chat_used += tokens
+        cur.execute('SELECT user FROM users WHERE id=?', (user_id,))
+        if cur.fetchone() is not None:
+            sql = 'UPDATE users SET user=? WHERE id=?'
+        else:
+            sql = 'INSERT INTO users(user, id) VALUES(?, ?)'
+        cur.execute(sql, [user.dump(), user_id])
+        connection.commit()
+    elapsed = time.perf_counter() - start
+    connection.close()
+    return elapsed
+
+
+async def after(file: str, messages: list) -> float:
+    database = Database(file)
+
+    reset = time.time() + 86400
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            database.add_usage(user_id, 'chat', tokens, reset)
+            for user_id, tokens in messages
+        )
+    )
+    elapsed = time.perf_counter() - start
+    await database.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=50)
+    args = parser.parse_args()
+    messages = [
+        (random.randint(1, args.users), random.randint(10, 500))
+        for _ in range(args.messages)
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        old = before(os.path.join(tmp, 'before.db'), messages)
+        new = asyncio.run(after(os.path.join(tmp, 'after.db'), messages))
+    print(f'before: {len(messages) / old:10.1f} writes/s ({old:.3f}s)')
+    print(f'after:  {len(messages) / new:10.1f} writes/s ({new:.3f}s)')
+
+
+if __name__ == '__main__':
+    main()
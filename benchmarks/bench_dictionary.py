@@ -0,0 +1,309 @@
+"""Benchmark parsing of ``/define`` responses.
+
+"before" is the previous parser (decode the body to text, ``json.loads``,
+patch subentries in place, then walk everything again into dicts); "after" is
+:func:`dictionary.parse`. Reported are the time and the peak traced memory of
+one lookup (the best of the runs), and the memory taken by the result, which
+is what the definition cache keeps around.
+
+The payloads are the responses recorded from the live endpoint in
+``benchmarks/fixtures`` (the raw body, including the ``)]}\'`` prefix, one
+``<word>.txt`` per word), or the files given with ``--fixture``. ``--record``
+fetches words from Google and saves them there. Without any recorded payload,
+synthetic ones built in the shape of Google's response by
+:func:`make_payload` are used instead, and a warning says so.
+
+Run from the repository root::
+
+    python -m benchmarks.bench_dictionary --record run set cat
+    python -m benchmarks.bench_dictionary --runs 200
+    python -m benchmarks.bench_dictionary --fixture run.txt --fixture set.txt
+    python -m benchmarks.bench_dictionary --synthetic
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import aiohttp
+
+import dictionary
+from dictionary import NotFoundError, UnknownError
+from extensions.define_command import FMT, HEADERS, PARAMS
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def _old_parse_definition(sense, _sub=True):
+    examples = []
+    for example_group in sense.get('example_groups', []):
+        examples.extend(example_group['examples'])
+    subdefinitions = []
+    for subsense in sense.get('subsenses', []):
+        subdefinitions.append(_old_parse_definition(subsense, _sub=False))
+    dsynonyms = []
+    dantonyms = []
+    for thesaurus in sense.get('thesaurus_entries', []):
+        for synonyms in thesaurus.get('synonyms', []):
+            dsynonyms.extend([s['nym'] for s in synonyms['nyms']])
+        for antonyms in thesaurus.get('antonyms', []):
+            dantonyms.extend([s['nym'] for s in antonyms['nyms']])
+    ret = {
+        'definition': sense['definition']['text'],
+        'example': examples[0] if examples else None,
+        'examples': examples,
+        'synonyms': dsynonyms,
+        'antonyms': dantonyms,
+        'labels': sense.get('label_set', {}),
+        'topics': [t['name'] for t in sense.get('relevant_topics', [])],
+    }
+    if _sub:
+        ret['subdefinitions'] = subdefinitions
+    return ret
+
+
+def before(body: bytes, word: str) -> list:
+    text = body.decode()
+    data = json.loads(text[5:])
+    if (
+        'feature-callback' not in data
+        or 'payload' not in data['feature-callback']
+        or 'single_results' not in data['feature-callback']['payload']
+    ):
+        raise UnknownError(data)
+    data = data['feature-callback']['payload']['single_results']
+    if not data:
+        raise NotFoundError('No data returned from Google')
+    entries = []
+    for obj in data:
+        if 'widget' in obj and 'error' in obj['widget']:
+            error = obj['widget']['error']
+            if error == 'TERM_NOT_FOUND_ERROR':
+                raise NotFoundError('No definition found on Google')
+            raise UnknownError(error)
+        if 'entry' in obj:
+            entry = obj['entry']
+            if 'subentries' in entry:
+                for subentry in entry['subentries']:
+                    subentry['headword'] = entry['headword']
+                    subentry['__subentry'] = True
+                    if 'sense_family' in subentry and 'sense_families' not in subentry:
+                        subentry['sense_families'] = [subentry['sense_family']]
+                    if 'phonetics' not in subentry:
+                        subentry['phonetics'] = entry.get('phonetics', [])
+                    if 'etymology' not in subentry:
+                        subentry['etymology'] = entry.get('etymology', {})
+                    if 'parts_of_speech' not in subentry:
+                        subentry['parts_of_speech'] = entry.get('parts_of_speech')
+                    for sense_family in subentry['sense_families']:
+                        if not sense_family.get('parts_of_speech'):
+                            sense_family['parts_of_speech'] = sense_family['senses'][
+                                0
+                            ].get('parts_of_speech', [])
+                    entries.append(subentry)
+            else:
+                entries.append(obj['entry'])
+    result = []
+    for entry in entries:
+        entry_result = []
+        for sense_family in entry['sense_families']:
+            posl = sense_family.get('parts_of_speech')
+            if not posl:
+                posl = sense_family['senses'][0].get('parts_of_speech', [])
+            if entry.get('__subentry'):
+                posl = [{'value': 'phrase of *%s*' % entry['headword']}]
+            if not posl:
+                raise UnknownError('Cannot parse POS: %r' % sense_family)
+            pos = posl[0]['value']
+            definitions = []
+            for sense in sense_family['senses']:
+                definitions.append(_old_parse_definition(sense))
+            forms = []
+            for morph in sense_family.get('morph_units', []):
+                forms.append(
+                    {
+                        'name': morph['form_type']['description'],
+                        'pos': morph['form_type']['pos_tag'],
+                        'form': morph['word_form'],
+                    }
+                )
+            entry_result.append(
+                {
+                    'partOfSpeech': pos,
+                    'definitions': definitions,
+                    'topics': [
+                        t['name'] for t in sense_family.get('relevant_topics', [])
+                    ],
+                    'forms': forms,
+                }
+            )
+        res = {
+            'index': entry.get('homograph_index'),
+            'word': entry.get('lemma') or entry.get('headword') or word,
+            'phonetic': None,
+            'phonetics': [],
+            'origin': entry.get('etymology', {}).get('etymology', {}).get('text'),
+            'originImages': entry.get('etymology', {}).get('images', {}),
+            'meanings': entry_result,
+            'topics': [t['name'] for t in entry.get('term_topics', [])],
+        }
+        for phonetic in entry.get('phonetics', []):
+            if res['phonetic'] is None:
+                res['phonetic'] = phonetic.get('text')
+            res['phonetics'].append(
+                {'text': phonetic.get('text'), 'audio': phonetic.get('oxford_audio')}
+            )
+        result.append(res)
+    return result
+
+
+def make_sense(n: int, subsenses: int = 2) -> dict:
+    return {
+        'definition': {'text': f'meaning number {n} of the word, at some length'},
+        'example_groups': [{'examples': [f'an example of sense {n}', 'another']}],
+        'thesaurus_entries': [
+            {
+                'synonyms': [{'nyms': [{'nym': f'synonym{i}'} for i in range(8)]}],
+                'antonyms': [{'nyms': [{'nym': f'antonym{i}'} for i in range(3)]}],
+            }
+        ],
+        'label_set': {'register': ['Informal'], 'region': ['British']},
+        'relevant_topics': [{'name': 'Topic'}],
+        'subsenses': [make_sense(n * 10 + i, 0) for i in range(subsenses)],
+    }
+
+
+def make_family(pos: str, senses: int) -> dict:
+    return {
+        'parts_of_speech': [{'value': pos}],
+        'senses': [make_sense(i) for i in range(senses)],
+        'morph_units': [
+            {
+                'form_type': {'description': 'plural', 'pos_tag': 'NNS'},
+                'word_form': 'words',
+            }
+        ],
+        'relevant_topics': [],
+    }
+
+
+def make_payload(homographs: int, senses: int, phrases: int) -> bytes:
+    results = []
+    for index in range(1, homographs + 1):
+        results.append(
+            {
+                'entry': {
+                    'headword': 'word',
+                    'homograph_index': index,
+                    'phonetics': [{'text': 'wərd', 'oxford_audio': 'https://a/b.mp3'}],
+                    'etymology': {'etymology': {'text': 'Old English'}},
+                    'sense_families': [
+                        make_family('noun', senses),
+                        make_family('verb', senses),
+                    ],
+                }
+            }
+        )
+    results.append(
+        {
+            'entry': {
+                'headword': 'word',
+                'phonetics': [{'text': 'wərd'}],
+                'subentries': [
+                    {'lemma': f'word phrase {i}', 'sense_family': make_family('', 2)}
+                    for i in range(phrases)
+                ],
+            }
+        }
+    )
+    data = {'feature-callback': {'payload': {'single_results': results}}}
+    return b")]}'\n" + json.dumps(data).encode()
+
+
+async def record(words: list) -> None:
+    os.makedirs(FIXTURES, exist_ok=True)
+    async with aiohttp.ClientSession() as session:
+        for word in words:
+            params = PARAMS.copy()
+            params['async'] = FMT % word
+            async with session.get(
+                'https://www.google.com/async/callback:5493',
+                params=params,
+                headers=HEADERS,
+            ) as resp:
+                body = await resp.read()
+            if resp.status != 200:
+                print(f'{word}: HTTP {resp.status}, not saved', file=sys.stderr)
+                continue
+            with open(os.path.join(FIXTURES, f'{word}.txt'), 'wb') as f:
+                f.write(body)
+            print(f'{word}: saved {len(body) / 1024:.1f} KiB')
+
+
+def load_fixtures(paths: list) -> dict:
+    if not paths and os.path.isdir(FIXTURES):
+        paths = sorted(
+            os.path.join(FIXTURES, name)
+            for name in os.listdir(FIXTURES)
+            if name.endswith('.txt')
+        )
+    payloads = {}
+    for path in paths:
+        with open(path, 'rb') as f:
+            payloads[os.path.basename(path)] = f.read()
+    return payloads
+
+
+def measure(parse, body: bytes, runs: int):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        parse(body, 'word')
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    result = parse(body, 'word')
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return min(timings), peak, retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=100)
+    parser.add_argument('--fixture', action='append', default=[])
+    parser.add_argument('--record', nargs='+', metavar='WORD')
+    parser.add_argument('--synthetic', action='store_true')
+    args = parser.parse_args()
+    if args.record:
+        asyncio.run(record(args.record))
+        return
+    payloads = {} if args.synthetic else load_fixtures(args.fixture)
+    if not payloads:
+        if not args.synthetic:
+            print(
+                f'No recorded payloads in {FIXTURES}, using synthetic ones '
+                '(record some with --record)',
+                file=sys.stderr,
+            )
+        payloads = {
+            'small': make_payload(1, 2, 0),
+            'medium': make_payload(2, 5, 4),
+            'large': make_payload(4, 12, 20),
+        }
+    for name, body in payloads.items():
+        print(f'{name} ({len(body) / 1024:.1f} KiB):')
+        for label, parse in ('before', before), ('after', dictionary.parse):
+            elapsed, peak, retained = measure(parse, body, args.runs)
+            print(
+                f'  {label + ":":7} {elapsed * 1000:8.3f} ms/lookup, '
+                f'peak {peak / 1024:8.1f} KiB, kept {retained / 1024:8.1f} KiB'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,18 @@
+import asyncio
 import logging
 import os
+from typing import Awaitable, Callable, List, Optional, Set
 
 from interactions import Client, listen, logger_name
+from interactions.api.events import Component, MessageCreate, MessageDelete
 
 from database import Database
+from locator import LOCATOR_PERSIST, MessageLocator
+from quota import QuotaManager
+from router import ComponentRouter
+from web import WebClient
+
+FLUSH_INTERVAL = float(os.getenv('DATABASE_FLUSH_INTERVAL', 5))
 
 
 class CustomClient(Client):
@@ -12,6 +21,33 @@ class CustomClient(Client):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.database = Database()
+        self.quota = QuotaManager(self.database)
+        self.web = WebClient()
+        self.locator = MessageLocator(self.database if LOCATOR_PERSIST else None)
+        self.router = ComponentRouter()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._shutdown_hooks: List[Callable[[], Awaitable[None]]] = []
+        # hooks of dropped extensions that are still running
+        self._hook_tasks: Set[asyncio.Task] = set()
+
+    def add_shutdown_hook(self, hook: Callable[[], Awaitable[None]]) -> None:
+        """Await ``hook()`` when the bot stops, before the database and the
+        HTTP session are closed."""
+        self._shutdown_hooks.append(hook)
+
+    def remove_shutdown_hook(self, hook: Callable[[], Awaitable[None]]) -> None:
+        """Remove a hook added with :meth:`add_shutdown_hook` and run it now in
+        the background, for an extension that is being dropped."""
+        self._shutdown_hooks.remove(hook)
+        task = asyncio.create_task(self._run_shutdown_hook(hook))
+        self._hook_tasks.add(task)
+        task.add_done_callback(self._hook_tasks.discard)
+
+    async def _run_shutdown_hook(self, hook: Callable[[], Awaitable[None]]) -> None:
+        try:
+            await hook()
+        except Exception:
+            self.logger.exception(f'Shutdown hook {hook!r} failed')
 
     @listen()
     async def on_startup(self):
@@ -20,3 +56,40 @@ class CustomClient(Client):
             'Note: Discord needs up to an hour to load your global commands / '
             'context menus. They may not appear immediately\n'
         )
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_database())
+
+    @listen()
+    async def on_component(self, event: Component):
+        await self.router.dispatch(event.ctx)
+
+    @listen()
+    async def on_message_create(self, event: MessageCreate):
+        self.locator.add(event.message)
+
+    @listen()
+    async def on_message_delete(self, event: MessageDelete):
+        self.locator.discard(event.message.id)
+
+    async def _flush_database(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                count = await self.database.flush()
+            except Exception:
+                self.logger.exception('Failed to flush guild settings')
+            else:
+                if count:
+                    self.logger.debug(f'Flushed settings of {count} guilds')
+
+    async def stop(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        for hook in self._shutdown_hooks:
+            await self._run_shutdown_hook(hook)
+        await asyncio.gather(*self._hook_tasks)
+        self.logger.debug(f'Component routes: {self.router.stats()}')
+        await self.database.close()
+        await self.web.close()
+        await super().stop()
@@ -1,6 +1,14 @@
+import asyncio
+import csv
 import json
+import os
 import sqlite3
-from typing import List, Optional
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import IO, Callable, Dict, List, Optional, Sequence, Set, Tuple, TypeVar
 
 from graph import TokensResponse
 from util import tomorrow
@@ -11,8 +19,23 @@ CREATE_SETTINGS = '''CREATE TABLE IF NOT EXISTS settings (
 );'''
 CREATE_USERS = '''CREATE TABLE IF NOT EXISTS users (
     id INTEGER PRIMARY KEY UNIQUE,
-    user BLOB
+    user BLOB,
+    chat_reset REAL,
+    chat_used INTEGER NOT NULL DEFAULT 0,
+    images_reset REAL,
+    images_used INTEGER NOT NULL DEFAULT 0,
+    timezone INTEGER,
+    zlib_query TEXT
 );'''
+# added to users by schema version 1; the user blob is only kept for old rows
+USER_COLUMNS = [
+    ('chat_reset', 'REAL'),
+    ('chat_used', 'INTEGER NOT NULL DEFAULT 0'),
+    ('images_reset', 'REAL'),
+    ('images_used', 'INTEGER NOT NULL DEFAULT 0'),
+    ('timezone', 'INTEGER'),
+    ('zlib_query', 'TEXT'),
+]
 CREATE_POLLS = '''CREATE TABLE IF NOT EXISTS polls (
     message_id INTEGER,
     guild_id INTEGER,
@@ -20,12 +43,103 @@ CREATE_POLLS = '''CREATE TABLE IF NOT EXISTS polls (
     user_id INTEGER,
     PRIMARY KEY(message_id, guild_id, channel_id, user_id)
 )'''
+CREATE_POLL_MESSAGES = '''CREATE TABLE IF NOT EXISTS poll_messages (
+    message_id INTEGER PRIMARY KEY,
+    guild_id INTEGER,
+    channel_id INTEGER,
+    question TEXT
+)'''
+CREATE_POLL_OPTIONS = '''CREATE TABLE IF NOT EXISTS poll_options (
+    message_id INTEGER,
+    option INTEGER,
+    label TEXT,
+    votes INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY(message_id, option)
+)'''
+CREATE_POLL_VOTES = '''CREATE TABLE IF NOT EXISTS poll_votes (
+    message_id INTEGER,
+    user_id INTEGER,
+    option INTEGER,
+    voted_at REAL,
+    PRIMARY KEY(message_id, user_id)
+)'''
+CREATE_POLL_VOTES_TIME = '''CREATE INDEX IF NOT EXISTS poll_votes_time
+ON poll_votes(message_id, voted_at)'''
+# keeps poll_options.votes equal to the number of votes for each option
+CREATE_POLL_TALLY = '''CREATE TRIGGER IF NOT EXISTS poll_tally
+AFTER INSERT ON poll_votes BEGIN
+    UPDATE poll_options SET votes=votes+1
+    WHERE message_id=NEW.message_id AND option=NEW.option;
+END'''
+CREATE_USERPOLLS = '''CREATE TABLE IF NOT EXISTS userpolls (
+    message_id INTEGER PRIMARY KEY,
+    voters INTEGER NOT NULL DEFAULT 0
+)'''
+CREATE_USERPOLL_VOTERS = '''CREATE TABLE IF NOT EXISTS userpoll_voters (
+    message_id INTEGER,
+    user_id INTEGER,
+    voted_at REAL,
+    PRIMARY KEY(message_id, user_id)
+)'''
+CREATE_USERPOLL_VOTES = '''CREATE TABLE IF NOT EXISTS userpoll_votes (
+    message_id INTEGER,
+    candidate_id INTEGER,
+    votes INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY(message_id, candidate_id)
+)'''
+CREATE_USERPOLL_RANKING = '''CREATE INDEX IF NOT EXISTS userpoll_ranking
+ON userpoll_votes(message_id, votes DESC, candidate_id)'''
 CREATE_STARBOARD = '''CREATE TABLE IF NOT EXISTS starboard (
     orig_message_id INTEGER,
     guild_id INTEGER,
     message_id INTEGER,
     PRIMARY KEY(orig_message_id, guild_id)
 )'''
+CREATE_STARBOARD_BACKFILL = '''CREATE TABLE IF NOT EXISTS starboard_backfill (
+    guild_id INTEGER,
+    channel_id INTEGER,
+    cursor INTEGER NOT NULL DEFAULT 0,
+    scanned INTEGER NOT NULL DEFAULT 0,
+    posted INTEGER NOT NULL DEFAULT 0,
+    done INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY(guild_id, channel_id)
+)'''
+CREATE_XKCD = '''CREATE TABLE IF NOT EXISTS xkcd (
+    id INTEGER PRIMARY KEY,
+    data BLOB
+)'''
+CREATE_DEFINITIONS = '''CREATE TABLE IF NOT EXISTS definitions (
+    word TEXT PRIMARY KEY,
+    data BLOB,
+    error TEXT,
+    expires REAL
+)'''
+# emojis emojipool.EmojiPool keeps in each guild, by the hash of their image
+CREATE_EMOJI_POOL = '''CREATE TABLE IF NOT EXISTS emoji_pool (
+    guild_id INTEGER,
+    hash TEXT,
+    emoji_id INTEGER,
+    name TEXT,
+    last_used REAL,
+    PRIMARY KEY(guild_id, hash)
+)'''
+CREATE_EMOJI_POOL_LRU = '''CREATE INDEX IF NOT EXISTS emoji_pool_lru
+ON emoji_pool(guild_id, last_used)'''
+# channels of messages found by locator.MessageLocator
+CREATE_MESSAGE_LOCATIONS = '''CREATE TABLE IF NOT EXISTS message_locations (
+    message_id INTEGER PRIMARY KEY,
+    guild_id INTEGER,
+    channel_id INTEGER
+)'''
+
+SETTINGS_CACHE_SIZE = 1024
+DATABASE_READERS = int(os.getenv('DATABASE_READERS', 4))
+COMMIT_WINDOW = float(os.getenv('DATABASE_COMMIT_WINDOW', 0.01))
+MIGRATE_BATCH = 500
+SCHEMA_VERSION = 2
+QUOTA_KINDS = ('chat', 'images')
+
+T = TypeVar('T')
 
 
 class MessageTemplate:
@@ -70,6 +184,9 @@ class Settings:
         'goodbye_msg',
         'greet_channel',
         'starboard_channel',
+        'starboard_threshold',
+        'starboard_emoji',
+        'dirty',
     )
 
     quotes_channel: Optional[int]
@@ -81,6 +198,9 @@ class Settings:
     goodbye_msg: Optional[MessageTemplate]
     greet_channel: Optional[int]
     starboard_channel: Optional[int]
+    starboard_threshold: int  # stars needed to be posted on the starboard
+    starboard_emoji: str  # unicode emoji, or <:name:id> for a custom one
+    dirty: bool  # changed since it was last written to the database
 
     def __init__(
         self,
@@ -93,6 +213,8 @@ class Settings:
         goodbye_msg: Optional[MessageTemplate] = None,
         greet_channel: Optional[int] = None,
         starboard_channel: Optional[int] = None,
+        starboard_threshold: int = 1,
+        starboard_emoji: str = '⭐',
     ) -> None:
         self.quotes_channel = quotes_channel
         self.teams_auth = teams_auth
@@ -103,6 +225,9 @@ class Settings:
         self.goodbye_msg = goodbye_msg
         self.greet_channel = greet_channel
         self.starboard_channel = starboard_channel
+        self.starboard_threshold = starboard_threshold
+        self.starboard_emoji = starboard_emoji
+        self.dirty = False
 
     @classmethod
     def load(cls, data: bytes) -> 'Settings':
@@ -117,6 +242,8 @@ class Settings:
         obj.goodbye_msg = MessageTemplate.load(d.get('goodbye_msg'))
         obj.greet_channel = d.get('greet_channel')
         obj.starboard_channel = d.get('starboard_channel')
+        obj.starboard_threshold = d.get('starboard_threshold', 1)
+        obj.starboard_emoji = d.get('starboard_emoji', '⭐')
         return obj
 
     def dump(self) -> bytes:
@@ -131,6 +258,8 @@ class Settings:
                 'goodbye_msg': self.goodbye_msg and self.goodbye_msg.dump(),
                 'greet_channel': self.greet_channel,
                 'starboard_channel': self.starboard_channel,
+                'starboard_threshold': self.starboard_threshold,
+                'starboard_emoji': self.starboard_emoji,
             }
         ).encode()
 
@@ -193,117 +322,863 @@ class User:
         ).encode()
 
 
+class Poll:
+    """A poll and the number of votes for each of its options."""
+
+    __slots__ = 'question', 'options', 'votes'
+
+    question: str
+    options: List[str]
+    votes: List[int]
+
+    def __init__(
+        self, question: str, options: List[str], votes: Optional[List[int]] = None
+    ) -> None:
+        self.question = question
+        self.options = options
+        self.votes = votes or [0] * len(options)
+
+
+class PollResults:
+    """The results of a poll, computed from its votes."""
+
+    __slots__ = (
+        'question',
+        'guild_id',
+        'channel_id',
+        'options',
+        'votes',
+        'percentages',
+        'total',
+        'first_vote',
+        'last_vote',
+    )
+
+    question: str
+    guild_id: Optional[int]
+    channel_id: int
+    options: List[str]
+    votes: List[int]
+    percentages: List[float]
+    total: int
+    # times of the first and last votes, None if no vote has a time recorded
+    first_vote: Optional[float]
+    last_vote: Optional[float]
+
+    def __init__(
+        self,
+        question: str,
+        guild_id: Optional[int],
+        channel_id: int,
+        options: List[str],
+        votes: List[int],
+        percentages: List[float],
+        first_vote: Optional[float],
+        last_vote: Optional[float],
+    ) -> None:
+        self.question = question
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.options = options
+        self.votes = votes
+        self.percentages = percentages
+        self.total = sum(votes)
+        self.first_vote = first_vote
+        self.last_vote = last_vote
+
+
+class StarboardBackfill:
+    """Progress of a scan of a channel's history for the starboard."""
+
+    __slots__ = 'guild_id', 'channel_id', 'cursor', 'scanned', 'posted', 'done'
+
+    guild_id: int
+    channel_id: int
+    cursor: int  # ID of the last message scanned, 0 before the first one
+    scanned: int
+    posted: int
+    done: bool
+
+    def __init__(
+        self,
+        guild_id: int,
+        channel_id: int,
+        cursor: int = 0,
+        scanned: int = 0,
+        posted: int = 0,
+        done: bool = False,
+    ) -> None:
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.cursor = cursor
+        self.scanned = scanned
+        self.posted = posted
+        self.done = done
+
+
 class Database:
-    def __init__(self, file: str = 'data.db') -> None:
-        self.connection = sqlite3.connect(file)
-        cur = self.cursor
-        cur.execute(CREATE_SETTINGS)
-        cur.execute(CREATE_USERS)
-        cur.execute(CREATE_POLLS)
-        cur.execute(CREATE_STARBOARD)
-        self.connection.commit()
-
-    @property
-    def cursor(self) -> sqlite3.Cursor:
-        return self.connection.cursor()
-
-    def has_guild_settings(self, guild_id: int) -> bool:
-        cur = self.cursor
-        cur.execute('SELECT settings FROM settings WHERE id=?', (guild_id,))
-        return cur.fetchone() is not None
-
-    def get_guild_settings(self, guild_id: int) -> Settings:
-        cur = self.cursor
-        cur.execute('SELECT settings FROM settings WHERE id=?', (guild_id,))
-        data = cur.fetchone()
-        if data is not None:
-            return Settings.load(data[0])
-        return Settings()
-
-    def set_guild_settings(self, guild_id: int, settings: Settings) -> None:
-        data = settings.dump()
-        cur = self.cursor
-        params = [data, guild_id]
-        if self.has_guild_settings(guild_id):
-            sql = 'UPDATE settings SET settings=? WHERE id=?'
+    """The bot database.
+
+    All queries run off the event loop: writes are serialized on a dedicated
+    writer thread, while reads are spread over a small pool of reader threads,
+    each with its own connection. The database is in WAL mode, so readers are
+    never blocked by a commit in progress.
+
+    Writes are committed in groups: a write returns once the transaction it
+    ended up in is committed, and all writes issued within ``commit_window``
+    seconds of each other share that transaction (and its fsync).
+    """
+
+    def __init__(
+        self,
+        file: str = 'data.db',
+        settings_cache_size: int = SETTINGS_CACHE_SIZE,
+        readers: int = DATABASE_READERS,
+        commit_window: float = COMMIT_WINDOW,
+    ) -> None:
+        self.file = file
+        self.commit_window = commit_window
+        self._commit_future: Optional[asyncio.Future] = None
+        self.settings_cache_size = settings_cache_size
+        self._settings: 'OrderedDict[int, Settings]' = OrderedDict()
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix='database-writer')
+        if file == ':memory:':
+            # every connection would get its own private in-memory database
+            self._readers = self._writer
         else:
-            sql = 'INSERT INTO settings(settings, id) VALUES(?, ?)'
-        cur.execute(sql, params)
-        self.connection.commit()
-
-    def has_user(self, id: int) -> bool:
-        cur = self.cursor
-        cur.execute('SELECT user FROM users WHERE id=?', (id,))
-        return cur.fetchone() is not None
-
-    def get_user(self, id: int) -> User:
-        cur = self.cursor
-        cur.execute('SELECT user FROM users WHERE id=?', (id,))
-        data = cur.fetchone()
-        if data is not None:
-            return User.load(data[0])
+            self._readers = ThreadPoolExecutor(
+                readers, thread_name_prefix='database-reader'
+            )
+        self._writer.submit(self._run_write, self._create_tables, ()).result()
+        self._writer.submit(self._run_commit).result()
+        self._writer.submit(self._migrate).result()
+        # (guild_id, orig_message_id) -> message_id of every starred message
+        self._starboard = self._writer.submit(self._load_starboard).result()
+
+    @staticmethod
+    def _create_tables(connection: sqlite3.Connection) -> None:
+        connection.execute(CREATE_SETTINGS)
+        connection.execute(CREATE_USERS)
+        connection.execute(CREATE_POLLS)
+        connection.execute(CREATE_POLL_MESSAGES)
+        connection.execute(CREATE_POLL_OPTIONS)
+        connection.execute(CREATE_POLL_VOTES)
+        connection.execute(CREATE_POLL_VOTES_TIME)
+        connection.execute(CREATE_POLL_TALLY)
+        connection.execute(CREATE_USERPOLLS)
+        connection.execute(CREATE_USERPOLL_VOTERS)
+        connection.execute(CREATE_USERPOLL_VOTES)
+        connection.execute(CREATE_USERPOLL_RANKING)
+        connection.execute(CREATE_STARBOARD)
+        connection.execute(CREATE_STARBOARD_BACKFILL)
+        connection.execute(CREATE_XKCD)
+        connection.execute(CREATE_DEFINITIONS)
+        connection.execute(CREATE_MESSAGE_LOCATIONS)
+        connection.execute(CREATE_EMOJI_POOL)
+        connection.execute(CREATE_EMOJI_POOL_LRU)
+
+    def _migrate(self) -> None:
+        connection = self._connection()
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        if version < 1:
+            self._migrate_users(connection)
+        if version < 2:
+            # cached definitions are saved in the format of dictionary.Entry now
+            connection.execute('DELETE FROM definitions')
+        connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    @staticmethod
+    def _migrate_users(connection: sqlite3.Connection) -> None:
+        """Move users from JSON blobs to columns.
+
+        Rows are converted in batches, each in its own transaction, so an
+        interrupted migration picks up where it stopped on the next start.
+        """
+        columns = {row[1] for row in connection.execute('PRAGMA table_info(users)')}
+        for name, type in USER_COLUMNS:
+            if name not in columns:
+                connection.execute(f'ALTER TABLE users ADD COLUMN {name} {type}')
+        while True:
+            rows = connection.execute(
+                'SELECT id, user FROM users WHERE user IS NOT NULL LIMIT ?',
+                (MIGRATE_BATCH,),
+            ).fetchall()
+            if not rows:
+                break
+            params = []
+            for id, data in rows:
+                user = User.load(data)
+                params.append(
+                    [
+                        user.chat_reset,
+                        user.chat_used,
+                        user.images_reset,
+                        user.images_used,
+                        user.timezone,
+                        user.zlib_query,
+                        id,
+                    ]
+                )
+            connection.execute('BEGIN')
+            connection.executemany(
+                'UPDATE users SET chat_reset=?, chat_used=?, images_reset=?, '
+                'images_used=?, timezone=?, zlib_query=?, user=NULL WHERE id=?',
+                params,
+            )
+            connection.execute('COMMIT')
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.file, isolation_level=None, check_same_thread=False
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def _run_read(self, func: Callable[..., T], args: tuple) -> T:
+        return func(self._connection(), *args)
+
+    def _run_write(self, func: Callable[..., T], args: tuple) -> T:
+        connection = self._connection()
+        if not connection.in_transaction:
+            connection.execute('BEGIN')
+        # a failing write must not take the rest of its group down with it
+        connection.execute('SAVEPOINT write')
+        try:
+            result = func(connection, *args)
+        except BaseException:
+            connection.execute('ROLLBACK TO write')
+            connection.execute('RELEASE write')
+            raise
+        connection.execute('RELEASE write')
+        return result
+
+    def _run_commit(self) -> None:
+        connection = self._connection()
+        if connection.in_transaction:
+            connection.execute('COMMIT')
+
+    async def _read(self, func: Callable[..., T], *args) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._run_read, func, args)
+
+    async def _write(self, func: Callable[..., T], *args) -> T:
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            self._writer, self._run_write, func, args
+        )
+        await self._commit()
+        return result
+
+    async def _commit(self) -> None:
+        """Wait until the next group commit is done."""
+        future = self._commit_future
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._commit_future = loop.create_future()
+            loop.call_later(self.commit_window, self._start_commit)
+        await asyncio.shield(future)
+
+    def _start_commit(self) -> None:
+        future = self._commit_future
+        assert future is not None
+        self._commit_future = None
+        # the writer runs jobs in order, so this commits every write before it
+        commit = asyncio.get_running_loop().run_in_executor(
+            self._writer, self._run_commit
+        )
+
+        def done(commit: asyncio.Future):
+            if commit.cancelled():
+                future.cancel()
+            elif commit.exception() is not None:
+                future.set_exception(commit.exception())  # type: ignore
+            else:
+                future.set_result(None)
+
+        commit.add_done_callback(done)
+
+    async def _fetchone(self, sql: str, params: Sequence = ()) -> Optional[tuple]:
+        return await self._read(lambda c: c.execute(sql, params).fetchone())
+
+    async def _execute(self, sql: str, params: Sequence = ()) -> None:
+        await self._write(lambda c: c.execute(sql, params))
+
+    async def close(self) -> None:
+        """Flush pending changes and close all connections."""
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._shutdown)
+
+    def _shutdown(self) -> None:
+        self._writer.submit(self._run_commit).result()
+        self._readers.shutdown()
+        self._writer.shutdown()
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+    async def has_guild_settings(self, guild_id: int) -> bool:
+        if guild_id in self._settings:
+            return True
+        row = await self._fetchone(
+            'SELECT settings FROM settings WHERE id=?', (guild_id,)
+        )
+        return row is not None
+
+    async def get_guild_settings(self, guild_id: int) -> Settings:
+        settings = self._settings.get(guild_id)
+        if settings is not None:
+            self._settings.move_to_end(guild_id)
+            return settings
+        data = await self._fetchone(
+            'SELECT settings FROM settings WHERE id=?', (guild_id,)
+        )
+        # someone else may have loaded (and changed) it while we were waiting
+        settings = self._settings.get(guild_id)
+        if settings is not None:
+            return settings
+        settings = Settings.load(data[0]) if data is not None else Settings()
+        await self._cache_settings(guild_id, settings)
+        return settings
+
+    async def set_guild_settings(self, guild_id: int, settings: Settings) -> None:
+        """Update the settings of a guild.
+
+        The change is only made in memory; it is written to the database by the
+        next :meth:`flush`, or when the settings are evicted from the cache.
+        """
+        settings.dirty = True
+        await self._cache_settings(guild_id, settings)
+
+    async def _cache_settings(self, guild_id: int, settings: Settings) -> None:
+        self._settings[guild_id] = settings
+        self._settings.move_to_end(guild_id)
+        overflow = len(self._settings) - self.settings_cache_size
+        if overflow <= 0:
+            return
+        evicted = list(islice(self._settings.items(), overflow))
+        await self._write_settings([(id, s) for id, s in evicted if s.dirty])
+        for id, s in evicted:
+            if self._settings.get(id) is s and not s.dirty:
+                del self._settings[id]
+
+    async def _write_settings(self, items: List[Tuple[int, Settings]]) -> None:
+        if not items:
+            return
+        # serialize now, so changes made while writing are kept dirty
+        rows = [(guild_id, settings.dump()) for guild_id, settings in items]
+        for _, settings in items:
+            settings.dirty = False
+        try:
+            await self._write(
+                lambda c: c.executemany(
+                    'INSERT INTO settings(id, settings) VALUES(?, ?) '
+                    'ON CONFLICT(id) DO UPDATE SET settings=excluded.settings',
+                    rows,
+                )
+            )
+        except BaseException:
+            for _, settings in items:
+                settings.dirty = True
+            raise
+
+    async def flush(self) -> int:
+        """Write all changed guild settings in a single transaction.
+
+        Returns the number of guilds written.
+        """
+        items = [(id, s) for id, s in self._settings.items() if s.dirty]
+        await self._write_settings(items)
+        return len(items)
+
+    async def has_user(self, id: int) -> bool:
+        row = await self._fetchone('SELECT 1 FROM users WHERE id=?', (id,))
+        return row is not None
+
+    async def get_user(self, id: int) -> User:
+        row = await self._fetchone(
+            'SELECT chat_reset, chat_used, images_reset, images_used, timezone, '
+            'zlib_query FROM users WHERE id=?',
+            (id,),
+        )
+        if row is not None:
+            return User(*row)
         return User()
 
-    def set_user(self, id: int, user: User) -> None:
-        data = user.dump()
-        cur = self.cursor
-        params = [data, id]
-        if self.has_user(id):
-            sql = 'UPDATE users SET user=? WHERE id=?'
-        else:
-            sql = 'INSERT INTO users(user, id) VALUES(?, ?)'
-        cur.execute(sql, params)
-        self.connection.commit()
-
-    def has_poll(
-        self, message_id: int, guild_id: int, channel_id: int, user_id: int
-    ) -> bool:
-        cur = self.cursor
-        cur.execute(
-            "SELECT '1' FROM polls WHERE message_id=? "
-            'AND guild_id=? AND channel_id=? AND user_id=?',
-            [message_id, guild_id, channel_id, user_id],
+    async def set_user(self, id: int, user: User) -> None:
+        await self._execute(
+            'INSERT INTO users(id, chat_reset, chat_used, images_reset, '
+            'images_used, timezone, zlib_query) VALUES(?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(id) DO UPDATE SET chat_reset=excluded.chat_reset, '
+            'chat_used=excluded.chat_used, images_reset=excluded.images_reset, '
+            'images_used=excluded.images_used, timezone=excluded.timezone, '
+            'zlib_query=excluded.zlib_query',
+            [
+                id,
+                user.chat_reset,
+                user.chat_used,
+                user.images_reset,
+                user.images_used,
+                user.timezone,
+                user.zlib_query,
+            ],
+        )
+
+    async def add_usage(
+        self, id: int, kind: str, amount: int, reset: float
+    ) -> None:
+        """Add to the ``chat`` tokens or ``images`` used by a user.
+
+        ``reset`` is the end of the day the usage belongs to. If the user's
+        stored day is older it is replaced; usage for an older day is dropped.
+        """
+        if kind not in QUOTA_KINDS:
+            raise ValueError(f'Unknown quota kind: {kind}')
+        used = f'{kind}_used'
+        until = f'{kind}_reset'
+        await self._execute(
+            f'INSERT INTO users(id, {used}, {until}) VALUES(?, ?, ?) '
+            f'ON CONFLICT(id) DO UPDATE SET {used}=CASE '
+            f'WHEN {until}=excluded.{until} THEN {used}+excluded.{used} '
+            f'WHEN IFNULL({until}, 0)<excluded.{until} THEN excluded.{used} '
+            f'ELSE {used} END, {until}=MAX(IFNULL({until}, 0), excluded.{until})',
+            [id, amount, reset],
+        )
+
+    async def add_poll(
+        self,
+        message_id: int,
+        guild_id: Optional[int],
+        channel_id: int,
+        poll: Poll,
+    ) -> None:
+        """Save a poll. Users who voted on it before votes were counted in the
+        database are copied from the old polls table, so they cannot vote
+        again."""
+
+        def add(connection: sqlite3.Connection) -> None:
+            connection.execute(
+                'INSERT OR IGNORE INTO poll_messages(message_id, guild_id, '
+                'channel_id, question) VALUES(?, ?, ?, ?)',
+                [message_id, guild_id, channel_id, poll.question],
+            )
+            connection.executemany(
+                'INSERT OR IGNORE INTO poll_options(message_id, option, label, '
+                'votes) VALUES(?, ?, ?, ?)',
+                [
+                    [message_id, i, label, votes]
+                    for i, (label, votes) in enumerate(zip(poll.options, poll.votes))
+                ],
+            )
+            connection.execute(
+                'INSERT OR IGNORE INTO poll_votes(message_id, user_id) '
+                'SELECT message_id, user_id FROM polls WHERE message_id=? '
+                'AND channel_id=?',
+                [message_id, channel_id],
+            )
+
+        await self._write(add)
+
+    async def get_poll(self, message_id: int) -> Optional[Poll]:
+        def get(connection: sqlite3.Connection) -> Optional[Poll]:
+            row = connection.execute(
+                'SELECT question FROM poll_messages WHERE message_id=?',
+                [message_id],
+            ).fetchone()
+            if row is None:
+                return None
+            options = connection.execute(
+                'SELECT label, votes FROM poll_options WHERE message_id=? '
+                'ORDER BY option',
+                [message_id],
+            ).fetchall()
+            return Poll(row[0], [o[0] for o in options], [o[1] for o in options])
+
+        return await self._read(get)
+
+    async def get_poll_results(self, message_id: int) -> Optional[PollResults]:
+        def get(connection: sqlite3.Connection) -> Optional[PollResults]:
+            row = connection.execute(
+                'SELECT question, guild_id, channel_id, '
+                '(SELECT MIN(voted_at) FROM poll_votes WHERE message_id=m.message_id), '
+                '(SELECT MAX(voted_at) FROM poll_votes WHERE message_id=m.message_id) '
+                'FROM poll_messages AS m WHERE message_id=?',
+                [message_id],
+            ).fetchone()
+            if row is None:
+                return None
+            question, guild_id, channel_id, first_vote, last_vote = row
+            options = connection.execute(
+                'SELECT label, votes, '
+                'IFNULL(votes * 100.0 / NULLIF(SUM(votes) OVER (), 0), 0) '
+                'FROM poll_options WHERE message_id=? ORDER BY option',
+                [message_id],
+            ).fetchall()
+            return PollResults(
+                question,
+                guild_id,
+                channel_id,
+                [o[0] for o in options],
+                [o[1] for o in options],
+                [o[2] for o in options],
+                first_vote,
+                last_vote,
+            )
+
+        return await self._read(get)
+
+    async def get_poll_timeline(
+        self, message_id: int, interval: float
+    ) -> List[Tuple[float, int]]:
+        """Count the votes of a poll in each ``interval`` seconds, returning the
+        start of each interval that has votes and the number of votes."""
+        return await self._read(
+            lambda c: c.execute(
+                'SELECT CAST(voted_at / ? AS INTEGER) * ? AS start, COUNT(*) '
+                'FROM poll_votes WHERE message_id=? AND voted_at IS NOT NULL '
+                'GROUP BY start ORDER BY start',
+                [interval, interval, message_id],
+            ).fetchall()
         )
-        return cur.fetchone() is not None
 
-    def add_poll(
-        self, message_id: int, guild_id: int, channel_id: int, user_id: int
+    async def export_poll_votes(self, message_id: int, file: IO[str]) -> int:
+        """Write the votes of a poll to ``file`` as CSV, oldest first, and return
+        the number of votes written. Rows are written as they are read from the
+        database, so they are never all in memory. Voters are not included, to
+        keep polls anonymous."""
+
+        def export(connection: sqlite3.Connection) -> int:
+            cursor = connection.execute(
+                "SELECT datetime(v.voted_at, 'unixepoch'), v.option + 1, o.label "
+                'FROM poll_votes AS v JOIN poll_options AS o '
+                'ON o.message_id=v.message_id AND o.option=v.option '
+                'WHERE v.message_id=? AND v.voted_at IS NOT NULL ORDER BY v.voted_at',
+                [message_id],
+            )
+            writer = csv.writer(file)
+            writer.writerow(['voted_at', 'option', 'label'])
+            count = 0
+            for row in cursor:
+                writer.writerow(row)
+                count += 1
+            return count
+
+        return await self._read(export)
+
+    async def vote(
+        self, message_id: int, user_id: int, option: int
+    ) -> Optional[Tuple[Poll, bool]]:
+        """Vote on a poll, unless the user already voted on it. Returns the
+        poll with the new tally and whether the vote was counted, or None if
+        the poll is not saved."""
+
+        def vote(connection: sqlite3.Connection) -> Optional[Tuple[Poll, bool]]:
+            row = connection.execute(
+                'SELECT question FROM poll_messages WHERE message_id=?',
+                [message_id],
+            ).fetchone()
+            if row is None:
+                return None
+            cursor = connection.execute(
+                'INSERT OR IGNORE INTO poll_votes(message_id, user_id, option, '
+                'voted_at) VALUES(?, ?, ?, ?)',
+                [message_id, user_id, option, time.time()],
+            )
+            options = connection.execute(
+                'SELECT label, votes FROM poll_options WHERE message_id=? '
+                'ORDER BY option',
+                [message_id],
+            ).fetchall()
+            poll = Poll(row[0], [o[0] for o in options], [o[1] for o in options])
+            return poll, cursor.rowcount == 1
+
+        return await self._write(vote)
+
+    async def add_userpoll(
+        self,
+        message_id: int,
+        voters: Sequence[int] = (),
+        votes: Optional[Dict[int, int]] = None,
     ) -> None:
-        cur = self.cursor
-        cur.execute(
-            'INSERT INTO polls(message_id, guild_id, '
-            'channel_id, user_id) VALUES(?, ?, ?, ?)',
-            [message_id, guild_id, channel_id, user_id],
+        """Save a user poll, optionally with the voters and the votes of each
+        candidate it already has."""
+
+        def add(connection: sqlite3.Connection) -> None:
+            connection.execute(
+                'INSERT OR IGNORE INTO userpolls(message_id, voters) VALUES(?, ?)',
+                [message_id, len(voters)],
+            )
+            connection.executemany(
+                'INSERT OR IGNORE INTO userpoll_voters(message_id, user_id) '
+                'VALUES(?, ?)',
+                [[message_id, user_id] for user_id in voters],
+            )
+            connection.executemany(
+                'INSERT OR IGNORE INTO userpoll_votes(message_id, candidate_id, '
+                'votes) VALUES(?, ?, ?)',
+                [[message_id, id, count] for id, count in (votes or {}).items()],
+            )
+
+        await self._write(add)
+
+    async def userpoll_vote(
+        self, message_id: int, user_id: int, candidates: Sequence[int]
+    ) -> Optional[bool]:
+        """Vote for some candidates on a user poll. Returns whether the vote was
+        counted (False if the user already voted), or None if the poll is not
+        saved."""
+
+        def vote(connection: sqlite3.Connection) -> Optional[bool]:
+            row = connection.execute(
+                'SELECT 1 FROM userpolls WHERE message_id=?', [message_id]
+            ).fetchone()
+            if row is None:
+                return None
+            cursor = connection.execute(
+                'INSERT OR IGNORE INTO userpoll_voters(message_id, user_id, '
+                'voted_at) VALUES(?, ?, ?)',
+                [message_id, user_id, time.time()],
+            )
+            if cursor.rowcount == 0:
+                return False
+            connection.execute(
+                'UPDATE userpolls SET voters=voters+1 WHERE message_id=?',
+                [message_id],
+            )
+            connection.executemany(
+                'INSERT INTO userpoll_votes(message_id, candidate_id, votes) '
+                'VALUES(?, ?, 1) ON CONFLICT(message_id, candidate_id) '
+                'DO UPDATE SET votes=votes+1',
+                [[message_id, id] for id in set(candidates)],
+            )
+            return True
+
+        return await self._write(vote)
+
+    async def get_userpoll_results(
+        self, message_id: int, limit: int
+    ) -> Tuple[int, int, List[Tuple[int, int]]]:
+        """Return the number of voters, the number of candidates and the
+        ``limit`` candidates with the most votes as ``(candidate_id, votes)``."""
+
+        def get(connection: sqlite3.Connection):
+            row = connection.execute(
+                'SELECT voters FROM userpolls WHERE message_id=?', [message_id]
+            ).fetchone()
+            candidates = connection.execute(
+                'SELECT COUNT(*) FROM userpoll_votes WHERE message_id=?',
+                [message_id],
+            ).fetchone()[0]
+            top = connection.execute(
+                'SELECT candidate_id, votes FROM userpoll_votes WHERE message_id=? '
+                'ORDER BY votes DESC, candidate_id LIMIT ?',
+                [message_id, limit],
+            ).fetchall()
+            return (row[0] if row else 0), candidates, top
+
+        return await self._read(get)
+
+    def _load_starboard(self) -> Dict[Tuple[int, int], int]:
+        rows = self._connection().execute(
+            'SELECT guild_id, orig_message_id, message_id FROM starboard'
         )
-        self.connection.commit()
+        return {(guild_id, orig): message_id for guild_id, orig, message_id in rows}
 
     def get_starboard_message(
         self, guild_id: int, orig_message_id: int
     ) -> Optional[int]:
-        cur = self.cursor
-        cur.execute(
-            'SELECT message_id FROM starboard WHERE orig_message_id=? AND guild_id=?',
-            [orig_message_id, guild_id],
-        )
-        data = cur.fetchone()
-        if data:
-            return data[0]
+        """Look up the starboard message of a message. The starboard is kept in
+        memory, so this does not query the database."""
+        return self._starboard.get((guild_id, orig_message_id))
 
-    def add_starboard_message(
+    async def add_starboard_message(
         self, guild_id: int, orig_message_id: int, message_id: int
     ) -> None:
-        cur = self.cursor
-        cur.execute(
-            'INSERT INTO starboard(orig_message_id, guild_id, '
-            'message_id) VALUES(?, ?, ?)',
+        await self._execute(
+            'INSERT INTO starboard(orig_message_id, guild_id, message_id) '
+            'VALUES(?, ?, ?) ON CONFLICT(orig_message_id, guild_id) '
+            'DO UPDATE SET message_id=excluded.message_id',
             [orig_message_id, guild_id, message_id],
         )
-        self.connection.commit()
+        self._starboard[guild_id, orig_message_id] = message_id
 
-    def delete_starboard_message(self, guild_id: int, orig_message_id: int):
-        cur = self.cursor
-        cur.execute(
+    async def delete_starboard_message(self, guild_id: int, orig_message_id: int):
+        await self._execute(
             'DELETE FROM starboard WHERE orig_message_id=? AND guild_id=?',
             [orig_message_id, guild_id],
         )
-        self.connection.commit()
+        self._starboard.pop((guild_id, orig_message_id), None)
+
+    async def start_starboard_backfill(
+        self, guild_id: int, channel_id: int
+    ) -> StarboardBackfill:
+        """Start a backfill of a channel, or resume the last one from where it
+        stopped, so a channel that was backfilled before is only scanned for
+        newer messages."""
+
+        def start(connection: sqlite3.Connection) -> tuple:
+            connection.execute(
+                'INSERT INTO starboard_backfill(guild_id, channel_id) VALUES(?, ?) '
+                'ON CONFLICT(guild_id, channel_id) DO UPDATE SET done=0',
+                [guild_id, channel_id],
+            )
+            return connection.execute(
+                'SELECT cursor, scanned, posted FROM starboard_backfill '
+                'WHERE guild_id=? AND channel_id=?',
+                [guild_id, channel_id],
+            ).fetchone()
+
+        return StarboardBackfill(guild_id, channel_id, *await self._write(start))
+
+    async def get_starboard_backfills(
+        self, guild_id: Optional[int] = None
+    ) -> List[StarboardBackfill]:
+        """Return all backfills of a guild, or the unfinished backfills of all
+        guilds if ``guild_id`` is None."""
+        sql = 'SELECT * FROM starboard_backfill WHERE '
+        if guild_id is None:
+            sql, params = sql + 'done=0', ()
+        else:
+            sql, params = sql + 'guild_id=?', (guild_id,)
+        rows = await self._read(lambda c: c.execute(sql, params).fetchall())
+        return [
+            StarboardBackfill(guild_id, channel_id, cursor, scanned, posted, bool(done))
+            for guild_id, channel_id, cursor, scanned, posted, done in rows
+        ]
+
+    async def save_starboard_backfill(
+        self, backfill: StarboardBackfill, posts: List[Tuple[int, int]]
+    ) -> None:
+        """Save the progress of a backfill together with the
+        ``(orig_message_id, message_id)`` pairs it posted since the last save,
+        in one transaction."""
+        guild_id = backfill.guild_id
+
+        def save(connection: sqlite3.Connection) -> None:
+            connection.executemany(
+                'INSERT INTO starboard(orig_message_id, guild_id, message_id) '
+                'VALUES(?, ?, ?) ON CONFLICT(orig_message_id, guild_id) '
+                'DO UPDATE SET message_id=excluded.message_id',
+                [[orig, guild_id, message_id] for orig, message_id in posts],
+            )
+            connection.execute(
+                'UPDATE starboard_backfill SET cursor=?, scanned=?, posted=?, done=? '
+                'WHERE guild_id=? AND channel_id=?',
+                [
+                    backfill.cursor,
+                    backfill.scanned,
+                    backfill.posted,
+                    int(backfill.done),
+                    guild_id,
+                    backfill.channel_id,
+                ],
+            )
+
+        await self._write(save)
+        for orig, message_id in posts:
+            self._starboard[guild_id, orig] = message_id
+
+    async def get_xkcd(self, id: int) -> Optional[dict]:
+        data = await self._fetchone('SELECT data FROM xkcd WHERE id=?', (id,))
+        if data is not None:
+            return json.loads(data[0])
+
+    async def get_xkcd_ids(self) -> Set[int]:
+        rows = await self._read(lambda c: c.execute('SELECT id FROM xkcd').fetchall())
+        return {row[0] for row in rows}
+
+    async def add_xkcd(self, id: int, data: dict) -> None:
+        await self._execute(
+            'INSERT OR REPLACE INTO xkcd(id, data) VALUES(?, ?)',
+            [id, json.dumps(data).encode()],
+        )
+
+    async def get_definition(
+        self, word: str
+    ) -> Optional[Tuple[Optional[list], Optional[str], float]]:
+        """Return the unexpired ``(definitions, error, expires)`` saved for a
+        word. ``definitions`` is None if the word was not found."""
+        row = await self._fetchone(
+            'SELECT data, error, expires FROM definitions WHERE word=? AND expires>?',
+            (word, time.time()),
+        )
+        if row is not None:
+            data, error, expires = row
+            return (json.loads(data) if data is not None else None), error, expires
+
+    async def set_definition(
+        self,
+        word: str,
+        definitions: Optional[list],
+        error: Optional[str],
+        expires: float,
+    ) -> None:
+        data = json.dumps(definitions).encode() if definitions is not None else None
+        await self._execute(
+            'INSERT OR REPLACE INTO definitions(word, data, error, expires) '
+            'VALUES(?, ?, ?, ?)',
+            [word, data, error, expires],
+        )
+
+    async def get_message_location(self, message_id: int) -> Optional[Tuple[int, int]]:
+        """Return the ``(guild_id, channel_id)`` a message was found in."""
+        row = await self._fetchone(
+            'SELECT guild_id, channel_id FROM message_locations WHERE message_id=?',
+            (message_id,),
+        )
+        return (row[0], row[1]) if row is not None else None
+
+    async def set_message_location(
+        self, message_id: int, guild_id: int, channel_id: int
+    ) -> None:
+        await self._execute(
+            'INSERT OR REPLACE INTO message_locations(message_id, guild_id, '
+            'channel_id) VALUES(?, ?, ?)',
+            [message_id, guild_id, channel_id],
+        )
+
+    async def get_pool_emoji(
+        self, guild_id: int, hash: str
+    ) -> Optional[Tuple[int, str]]:
+        """Return the ``(emoji_id, name)`` of the pool emoji of an image."""
+        row = await self._fetchone(
+            'SELECT emoji_id, name FROM emoji_pool WHERE guild_id=? AND hash=?',
+            (guild_id, hash),
+        )
+        return (row[0], row[1]) if row is not None else None
+
+    async def get_pool_emojis(self, guild_id: int) -> List[int]:
+        """Return the IDs of the pool emojis of a guild, least recently used
+        first."""
+        rows = await self._read(
+            lambda c: c.execute(
+                'SELECT emoji_id FROM emoji_pool WHERE guild_id=? ORDER BY last_used',
+                (guild_id,),
+            ).fetchall()
+        )
+        return [row[0] for row in rows]
+
+    async def set_pool_emoji(
+        self, guild_id: int, hash: str, emoji_id: int, name: str, last_used: float
+    ) -> None:
+        await self._execute(
+            'INSERT OR REPLACE INTO emoji_pool(guild_id, hash, emoji_id, name, '
+            'last_used) VALUES(?, ?, ?, ?, ?)',
+            [guild_id, hash, emoji_id, name, last_used],
+        )
+
+    async def delete_pool_emoji(self, guild_id: int, emoji_id: int) -> None:
+        await self._execute(
+            'DELETE FROM emoji_pool WHERE guild_id=? AND emoji_id=?',
+            [guild_id, emoji_id],
+        )
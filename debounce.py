@@ -0,0 +1,75 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Generic, Hashable, Set, TypeVar
+
+from interactions import logger_name
+
+T = TypeVar('T')
+
+logger = logging.getLogger(logger_name)
+
+
+class Debouncer(Generic[T]):
+    """Collapse bursts of updates to the same key into one call.
+
+    The first update of a key starts a timer of ``window`` seconds; updates
+    arriving meanwhile only replace the value, and when the timer fires
+    ``callback(key, value)`` is called once with the latest one. Updates that
+    come in while the callback runs are handled in another call after it.
+    """
+
+    def __init__(
+        self, window: float, callback: Callable[[Hashable, T], Awaitable[None]]
+    ) -> None:
+        self.window = window
+        self.callback = callback
+        self._pending: Dict[Hashable, T] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._running: Dict[Hashable, asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def schedule(self, key: Hashable, value: T) -> None:
+        self._pending[key] = value
+        if key not in self._timers and key not in self._running:
+            loop = asyncio.get_running_loop()
+            self._timers[key] = loop.call_later(self.window, self._fire, key)
+
+    def cancel(self, key: Hashable) -> None:
+        """Drop the pending update of a key. A call already running is not
+        interrupted."""
+        self._pending.pop(key, None)
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _fire(self, key: Hashable) -> None:
+        self._timers.pop(key, None)
+        if key not in self._pending:
+            return
+        task = asyncio.create_task(self._run(key))
+        self._running[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: Hashable) -> None:
+        try:
+            value = self._pending.pop(key)
+            try:
+                await self.callback(key, value)
+            except Exception:
+                logger.exception(f'Debounced update of {key!r} failed')
+        finally:
+            del self._running[key]
+        if key in self._pending and key not in self._timers:
+            loop = asyncio.get_running_loop()
+            self._timers[key] = loop.call_later(self.window, self._fire, key)
+
+    async def flush(self) -> None:
+        """Run all pending updates now and wait for them to finish."""
+        while self._pending or self._tasks:
+            for key in list(self._timers):
+                if key not in self._running:
+                    self._timers.pop(key).cancel()
+                    self._fire(key)
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
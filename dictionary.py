@@ -0,0 +1,371 @@
+"""Parser for the Google dictionary payload used by ``/define``."""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import msgspec
+from msgspec import Struct, field
+
+# the body starts with )]}' and a newline to prevent JSON hijacking
+PREFIX = 5
+
+# (category, label) -> 'category:label'; there are few distinct labels, so
+# every definition shares the same strings instead of formatting new ones
+_labels: Dict[Tuple[str, str], str] = {}
+LABELS_SIZE = 1024
+
+
+class DefinitionError(Exception):
+    pass
+
+
+class NotFoundError(DefinitionError):
+    pass
+
+
+class RateLimitError(DefinitionError):
+    def __init__(self, retry_after: Optional[float] = None, *args) -> None:
+        self.retry_after = retry_after
+        super().__init__(*args)
+
+
+class UnknownError(DefinitionError):
+    pass
+
+
+# the fields have no defaults: default factories make every instance slower to
+# create, and parse creates thousands of them
+@dataclass(slots=True)
+class Definition:
+    text: str
+    examples: List[str]
+    synonyms: List[str]
+    antonyms: List[str]
+    labels: List[str]  # category:label
+    topics: List[str]
+    subdefinitions: List['Definition']
+
+    @property
+    def example(self) -> Optional[str]:
+        return self.examples[0] if self.examples else None
+
+    @classmethod
+    def load(cls, data: dict) -> 'Definition':
+        return cls(
+            data['text'],
+            data['examples'],
+            data['synonyms'],
+            data['antonyms'],
+            data['labels'],
+            data['topics'],
+            [cls.load(sub) for sub in data['subdefinitions']],
+        )
+
+    def dump(self) -> dict:
+        return {
+            'text': self.text,
+            'examples': self.examples,
+            'synonyms': self.synonyms,
+            'antonyms': self.antonyms,
+            'labels': self.labels,
+            'topics': self.topics,
+            'subdefinitions': [sub.dump() for sub in self.subdefinitions],
+        }
+
+
+@dataclass(slots=True)
+class Form:
+    name: str  # e.g. "plural"
+    form: str
+
+    @classmethod
+    def load(cls, data: dict) -> 'Form':
+        return cls(data['name'], data['form'])
+
+    def dump(self) -> dict:
+        return {'name': self.name, 'form': self.form}
+
+
+@dataclass(slots=True)
+class Meaning:
+    part_of_speech: str
+    definitions: List[Definition]
+    topics: List[str]
+    forms: List[Form]
+
+    @classmethod
+    def load(cls, data: dict) -> 'Meaning':
+        return cls(
+            data['part_of_speech'],
+            [Definition.load(d) for d in data['definitions']],
+            data['topics'],
+            [Form.load(f) for f in data['forms']],
+        )
+
+    def dump(self) -> dict:
+        return {
+            'part_of_speech': self.part_of_speech,
+            'definitions': [d.dump() for d in self.definitions],
+            'topics': self.topics,
+            'forms': [f.dump() for f in self.forms],
+        }
+
+
+@dataclass(slots=True)
+class Entry:
+    word: str
+    index: Optional[int]  # homograph index
+    phonetic: Optional[str]
+    audio: Optional[str]
+    origin: Optional[str]
+    topics: List[str]
+    meanings: List[Meaning]
+
+    @classmethod
+    def load(cls, data: dict) -> 'Entry':
+        return cls(
+            data['word'],
+            data['index'],
+            data['phonetic'],
+            data['audio'],
+            data['origin'],
+            data['topics'],
+            [Meaning.load(m) for m in data['meanings']],
+        )
+
+    def dump(self) -> dict:
+        return {
+            'word': self.word,
+            'index': self.index,
+            'phonetic': self.phonetic,
+            'audio': self.audio,
+            'origin': self.origin,
+            'topics': self.topics,
+            'meanings': [m.dump() for m in self.meanings],
+        }
+
+
+# The parts of the response that are used. msgspec decodes the body straight
+# into these in one pass and skips everything else without building it, so no
+# dict of the whole response is ever made. None of them can be in a reference
+# cycle, hence gc=False.
+
+
+class _Text(Struct, gc=False):
+    text: str = ''
+
+
+class _Name(Struct, gc=False):
+    name: str
+
+
+class _Value(Struct, gc=False):
+    value: str
+
+
+class _Nym(Struct, gc=False):
+    nym: str
+
+
+class _Nyms(Struct, gc=False):
+    nyms: List[_Nym]
+
+
+class _Thesaurus(Struct, gc=False):
+    synonyms: List[_Nyms] = []
+    antonyms: List[_Nyms] = []
+
+
+class _Examples(Struct, gc=False):
+    examples: List[str]
+
+
+class _Sense(Struct, gc=False):
+    definition: _Text
+    example_groups: List[_Examples] = []
+    thesaurus_entries: List[_Thesaurus] = []
+    label_set: Dict[str, List[str]] = {}
+    relevant_topics: List[_Name] = []
+    subsenses: List['_Sense'] = []
+    parts_of_speech: List[_Value] = []
+
+
+class _FormType(Struct, gc=False):
+    description: str
+
+
+class _Morph(Struct, gc=False):
+    form_type: _FormType
+    word_form: str
+
+
+class _Family(Struct, gc=False):
+    senses: List[_Sense]
+    parts_of_speech: List[_Value] = []
+    relevant_topics: List[_Name] = []
+    morph_units: List[_Morph] = []
+
+
+class _Phonetic(Struct, gc=False):
+    text: Optional[str] = None
+    oxford_audio: Optional[str] = None
+
+
+class _Etymology(Struct, gc=False):
+    etymology: Optional[_Text] = None
+
+
+class _Entry(Struct, gc=False):
+    lemma: Optional[str] = None
+    headword: Optional[str] = None
+    homograph_index: Optional[int] = None
+    # None if missing, a subentry then takes them from its entry
+    phonetics: Optional[List[_Phonetic]] = None
+    etymology: Optional[_Etymology] = None
+    term_topics: List[_Name] = []
+    sense_families: Optional[List[_Family]] = None
+    sense_family: Optional[_Family] = None
+    subentries: Optional[List['_Entry']] = None
+
+
+class _Widget(Struct, gc=False):
+    error: Optional[str] = None
+
+
+class _Result(Struct, gc=False):
+    widget: Optional[_Widget] = None
+    entry: Optional[_Entry] = None
+
+
+class _Payload(Struct, gc=False):
+    single_results: Optional[List[_Result]] = None
+
+
+class _Callback(Struct, gc=False):
+    payload: Optional[_Payload] = None
+
+
+class _Response(Struct, gc=False):
+    callback: Optional[_Callback] = field(default=None, name='feature-callback')
+
+
+_decoder = msgspec.json.Decoder(_Response)
+
+
+def _parse_definition(sense: _Sense, sub: bool = True) -> Definition:
+    # plain loops into local lists, then one constructor call: this runs for
+    # every sense of every entry and dominates the walk
+    groups = sense.example_groups
+    if len(groups) == 1:
+        examples = groups[0].examples
+    else:
+        examples = []
+        for group in groups:
+            examples += group.examples
+    synonyms: List[str] = []
+    antonyms: List[str] = []
+    for thesaurus in sense.thesaurus_entries:
+        for group in thesaurus.synonyms:
+            for nym in group.nyms:
+                synonyms.append(nym.nym)
+        for group in thesaurus.antonyms:
+            for nym in group.nyms:
+                antonyms.append(nym.nym)
+    labels: List[str] = []
+    for category, names in sense.label_set.items():
+        for name in names:
+            label = _labels.get((category, name))
+            if label is None:
+                label = '%s:%s' % (category, name.lower())
+                if len(_labels) < LABELS_SIZE:
+                    _labels[category, name] = label
+            labels.append(label)
+    return Definition(
+        sense.definition.text,
+        examples,
+        synonyms,
+        antonyms,
+        labels,
+        [topic.name for topic in sense.relevant_topics],
+        [_parse_definition(s, False) for s in sense.subsenses] if sub else [],
+    )
+
+
+def _parse_entry(entry: _Entry, word: str, parent: Optional[_Entry] = None) -> Entry:
+    """Parse an entry, or a subentry (a phrase) of ``parent``, which lends it
+    the fields it does not have."""
+    headword = (parent and parent.headword) or entry.headword
+    families = entry.sense_families
+    if families is None:
+        families = [entry.sense_family] if entry.sense_family is not None else []
+    meanings = []
+    for family in families:
+        if parent is not None:
+            pos = 'phrase of *%s*' % headword
+        else:
+            posl = family.parts_of_speech or (
+                family.senses[0].parts_of_speech if family.senses else None
+            )
+            if not posl:
+                raise UnknownError('Cannot parse POS: %r' % family)
+            pos = posl[0].value
+        meanings.append(
+            Meaning(
+                pos,
+                [_parse_definition(sense) for sense in family.senses],
+                [topic.name for topic in family.relevant_topics],
+                [
+                    Form(morph.form_type.description, morph.word_form)
+                    for morph in family.morph_units
+                ],
+            )
+        )
+    phonetics = entry.phonetics
+    if phonetics is None:
+        phonetics = (parent and parent.phonetics) or []
+    etymology = entry.etymology
+    if etymology is None and parent is not None:
+        etymology = parent.etymology
+    origin = etymology and etymology.etymology and etymology.etymology.text
+    return Entry(
+        entry.lemma or headword or word,
+        entry.homograph_index,
+        next((p.text for p in phonetics if p.text), None),
+        next((p.oxford_audio for p in phonetics if p.oxford_audio), None),
+        origin or None,
+        [topic.name for topic in entry.term_topics],
+        meanings,
+    )
+
+
+def parse(body: bytes, word: str) -> List[Entry]:
+    """Parse the body of a dictionary response in one pass over the bytes."""
+    try:
+        # a view skips the prefix without copying the body
+        data = _decoder.decode(memoryview(body)[PREFIX:])
+    except msgspec.DecodeError as exc:
+        raise UnknownError('Cannot decode the response: %s' % exc)
+    payload = data.callback and data.callback.payload
+    if payload is None or payload.single_results is None:
+        raise UnknownError('No payload in the response')
+    results = payload.single_results
+    if not results:
+        raise NotFoundError('No data returned from Google')
+    entries = []
+    for result in results:
+        error = result.widget and result.widget.error
+        if error == 'TERM_NOT_FOUND_ERROR':
+            raise NotFoundError('No definition found on Google')
+        if error is not None:
+            raise UnknownError(error)
+        entry = result.entry
+        if entry is None:
+            continue
+        if entry.subentries is not None:
+            for subentry in entry.subentries:
+                entries.append(_parse_entry(subentry, word, entry))
+        else:
+            entries.append(_parse_entry(entry, word))
+    if not entries:
+        raise NotFoundError('No entries returned from Google')
+    return entries
@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import os
+import time
+from io import BytesIO
+from typing import Dict, Optional, Set
+
+from interactions import Guild, Message, PartialEmoji
+from interactions.client.errors import HTTPException
+
+from client import CustomClient
+from debounce import Debouncer
+
+# emojis kept in each guild for /customreact
+POOL_SIZE = int(os.getenv('EMOJI_POOL_SIZE', 5))
+# evicted emojis are deleted together this many seconds after the first one
+DELETE_WINDOW = float(os.getenv('EMOJI_POOL_DELETE_WINDOW', 60))
+REASON = 'Custom reaction'
+
+# Discord error codes
+UNKNOWN_EMOJI = 10014
+MAX_EMOJIS = 30008
+
+
+class NoEmojiSlots(Exception):
+    pass
+
+
+class EmojiPool:
+    """Custom emojis kept in guilds to react with images.
+
+    An emoji is made for each image the first time it is used, and reused
+    for the same image after that; the image hash -> emoji mapping is saved
+    in the database. At most ``size`` emojis are kept in a guild, or fewer
+    if the guild runs out of emoji slots, and the least recently used ones
+    make room for new ones. Evicted emojis are deleted in the background,
+    all the evictions of a guild within ``delete_window`` seconds at once.
+    """
+
+    def __init__(
+        self,
+        bot: CustomClient,
+        size: int = POOL_SIZE,
+        delete_window: float = DELETE_WINDOW,
+    ) -> None:
+        self.bot = bot
+        self.size = size
+        self._locks: Dict[int, asyncio.Lock] = {}
+        # guild_id -> emojis evicted but not deleted yet
+        self._evicted: Dict[int, Set[int]] = {}
+        self._deletes: Debouncer[None] = Debouncer(delete_window, self._delete)
+
+    async def react(
+        self, guild: Guild, message: Message, name: str, data: bytes
+    ) -> None:
+        """React to a message of ``guild`` with the image in ``data``."""
+        hash = hashlib.sha256(data).hexdigest()
+        emoji = await self.acquire(guild, name, data, hash)
+        try:
+            await message.add_reaction(emoji)
+        except HTTPException as exc:
+            if exc.code != UNKNOWN_EMOJI:
+                raise
+            # someone deleted the emoji from the guild
+            await self.bot.database.delete_pool_emoji(guild.id, emoji.id)
+            emoji = await self.acquire(guild, name, data, hash)
+            await message.add_reaction(emoji)
+
+    async def acquire(
+        self, guild: Guild, name: str, data: bytes, hash: str
+    ) -> PartialEmoji:
+        lock = self._locks.setdefault(guild.id, asyncio.Lock())
+        async with lock:
+            emoji = await self._reuse(guild, name, hash)
+            if emoji is None:
+                emoji = await self._create(guild, name, data, hash)
+            return emoji
+
+    async def _reuse(
+        self, guild: Guild, name: str, hash: str
+    ) -> Optional[PartialEmoji]:
+        database = self.bot.database
+        row = await database.get_pool_emoji(guild.id, hash)
+        if row is None:
+            return None
+        emoji_id, old_name = row
+        if name != old_name:
+            try:
+                await self.bot.http.modify_guild_emoji(
+                    {'name': name}, guild.id, emoji_id, reason=REASON
+                )
+            except HTTPException as exc:
+                if exc.code != UNKNOWN_EMOJI:
+                    raise
+                await database.delete_pool_emoji(guild.id, emoji_id)
+                return None
+        await database.set_pool_emoji(guild.id, hash, emoji_id, name, time.time())
+        return PartialEmoji(id=emoji_id, name=name)
+
+    async def _create(
+        self, guild: Guild, name: str, data: bytes, hash: str
+    ) -> PartialEmoji:
+        database = self.bot.database
+        emojis = await database.get_pool_emojis(guild.id)
+        for emoji_id in emojis[: max(0, len(emojis) - self.size + 1)]:
+            await self._evict(guild.id, emoji_id)
+        while True:
+            try:
+                emoji = await guild.create_custom_emoji(
+                    name, BytesIO(data), reason=REASON
+                )
+                break
+            except HTTPException as exc:
+                if exc.code != MAX_EMOJIS:
+                    raise
+            # the guild is full, free a slot now instead of in the background
+            evicted = self._evicted.get(guild.id)
+            if evicted:
+                emoji_id = evicted.pop()
+            else:
+                emojis = await database.get_pool_emojis(guild.id)
+                if not emojis:
+                    raise NoEmojiSlots()
+                emoji_id = emojis[0]
+                await database.delete_pool_emoji(guild.id, emoji_id)
+            await self._delete_emoji(guild.id, emoji_id)
+        await database.set_pool_emoji(guild.id, hash, emoji.id, name, time.time())
+        return PartialEmoji(id=emoji.id, name=name)
+
+    async def _evict(self, guild_id: int, emoji_id: int) -> None:
+        await self.bot.database.delete_pool_emoji(guild_id, emoji_id)
+        self._evicted.setdefault(guild_id, set()).add(emoji_id)
+        self._deletes.schedule(guild_id, None)
+
+    async def _delete(self, guild_id: int, _: None) -> None:
+        for emoji_id in self._evicted.pop(guild_id, ()):
+            try:
+                await self._delete_emoji(guild_id, emoji_id)
+            except Exception:
+                self.bot.logger.exception(
+                    f'Failed to delete emoji {emoji_id} from guild {guild_id}'
+                )
+
+    async def _delete_emoji(self, guild_id: int, emoji_id: int) -> None:
+        try:
+            await self.bot.http.delete_guild_emoji(guild_id, emoji_id, reason=REASON)
+        except HTTPException as exc:
+            if exc.code != UNKNOWN_EMOJI:
+                raise
+
+    async def flush(self) -> None:
+        """Delete the evicted emojis now."""
+        await self._deletes.flush()
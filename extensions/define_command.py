@@ -1,8 +1,13 @@
-import json
+import asyncio
+import logging
+import os
 import string
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
 
-from aiohttp.client import request
 from interactions import (
+    ActionRow,
     Button,
     ButtonStyle,
     component_callback,
@@ -15,11 +20,21 @@ from interactions import (
     InteractionContext,
     OptionType,
     SlashCommandOption,
-    listen,
+    logger_name,
     slash_command,
 )
-from interactions.api.events import Component
+import dictionary
 from client import CustomClient
+from database import Database
+from dictionary import (
+    DefinitionError,
+    Entry,
+    NotFoundError,
+    RateLimitError,
+    UnknownError,
+)
+from ratelimit import QueueFull, RateLimiter
+from web import WebClient
 
 # region constants
 FC = 'EswBCowBQUVzN2pOUjJsRGNYaWdOZm9HN19ocUVQdFdjMjVTVGtMbTdEV1V5aTZqOUNHQ1JPRDhzTDF5cVhCbkpVc1dyMGNBcFVfeE5LNjFUNnJVQ2RlUlpzMThZLWktSk14NjlPWTh6ZEo4NWVuODUtZGduU2FwekJUaFRkcmNTNUdlRWVodFZoa3pUNWdia0cSF0hhR0ZaSW5wTHRDT3VyOFByT2k1NEFFGiJBTy0wcmw1ZkJlVjlCbm5NVklRcTRTWDJiYmZydUpUTUxn'
@@ -35,56 +50,27 @@ HEADERS = {
     'Referer': 'https://www.google.com/',
 }
 
+CACHE_SIZE = 256
+PAGE_CACHE_SIZE = 512
+CACHE_TTL = 7 * 24 * 60 * 60
+NOT_FOUND_TTL = 24 * 60 * 60
 
-class DefinitionError(Exception):
-    pass
-
-
-class NotFoundError(DefinitionError):
-    pass
-
-
-class RateLimitError(DefinitionError):
-    pass
+# Google starts answering 429 when it gets more than about one request a second
+RATE = float(os.getenv('DEFINE_RATE', 1))
+BURST = int(os.getenv('DEFINE_BURST', 5))
+MAX_QUEUE = int(os.getenv('DEFINE_MAX_QUEUE', 50))
+RETRIES = 3  # after the first attempt
+BACKOFF = 2
 
+logger = logging.getLogger(logger_name)
 
-class UnknownError(DefinitionError):
-    pass
+CachedEntry = Tuple[Optional[List[Entry]], Optional[str], float]
 
 
-def _parse_definition(sense, _sub=True):
-    examples = []
-    for example_group in sense.get('example_groups', []):
-        examples.extend(example_group['examples'])
-    subdefinitions = []
-    for subsense in sense.get('subsenses', []):
-        subdefinitions.append(_parse_definition(subsense, _sub=False))
-    dsynonyms = []
-    dantonyms = []
-    for thesaurus in sense.get('thesaurus_entries', []):
-        for synonyms in thesaurus.get('synonyms', []):
-            dsynonyms.extend([s['nym'] for s in synonyms['nyms']])
-        for antonyms in thesaurus.get('antonyms', []):
-            dantonyms.extend([s['nym'] for s in antonyms['nyms']])
-    ret = {
-        'definition': sense['definition']['text'],
-        'example': examples[0] if examples else None,
-        'examples': examples,
-        'synonyms': dsynonyms,
-        'antonyms': dantonyms,
-        'labels': sense.get('label_set', {}),
-        'topics': [t['name'] for t in sense.get('relevant_topics', [])],
-    }
-    if _sub:
-        ret['subdefinitions'] = subdefinitions
-    return ret
-
-
-async def fetch_definitions(word: str):
+async def fetch_definitions(web: WebClient, word: str) -> List[Entry]:
     params = PARAMS.copy()
     params['async'] = FMT % word
-    async with request(
-        'GET',
+    async with web.get(
         'https://www.google.com/async/callback:5493',
         params=params,
         headers=HEADERS,
@@ -92,109 +78,130 @@ async def fetch_definitions(word: str):
         if resp.status == 404:
             raise NotFoundError('Google returned 404 Not Found')
         if resp.status == 429:
-            raise RateLimitError()
+            retry_after = resp.headers.get('Retry-After', '')
+            raise RateLimitError(
+                float(retry_after) if retry_after.isdigit() else None
+            )
         if resp.status != 200:
-            raise NotFoundError('Google returned error status %d' % resp.status)
-        text = await resp.text()
-    data = json.loads(text[5:])
-    if (
-        'feature-callback' not in data
-        or 'payload' not in data['feature-callback']
-        or 'single_results' not in data['feature-callback']['payload']
-    ):
-        raise UnknownError(data)
-    data = data['feature-callback']['payload']['single_results']
-    if not data:
-        raise NotFoundError('No data returned from Google')
-    entries = []
-    for obj in data:
-        if 'widget' in obj and 'error' in obj['widget']:
-            error = obj['widget']['error']
-            if error == 'TERM_NOT_FOUND_ERROR':
-                raise NotFoundError('No definition found on Google')
-            raise UnknownError(error)
-        if 'entry' in obj:
-            entry = obj['entry']
-            if 'subentries' in entry:
-                for subentry in entry['subentries']:
-                    subentry['headword'] = entry['headword']
-                    subentry['__subentry'] = True
-                    if 'sense_family' in subentry and 'sense_families' not in subentry:
-                        subentry['sense_families'] = [subentry['sense_family']]
-                    if 'phonetics' not in subentry:
-                        subentry['phonetics'] = entry.get('phonetics', [])
-                    if 'etymology' not in subentry:
-                        subentry['etymology'] = entry.get('etymology', {})
-                    if 'parts_of_speech' not in subentry:
-                        subentry['parts_of_speech'] = entry.get('parts_of_speech')
-                    for sense_family in subentry['sense_families']:
-                        if not sense_family.get('parts_of_speech'):
-                            sense_family['parts_of_speech'] = sense_family['senses'][
-                                0
-                            ].get('parts_of_speech', [])
-                    entries.append(subentry)
+            # most likely temporary, so it must not be cached as not found
+            raise UnknownError('Google returned error status %d' % resp.status)
+        body = await resp.read()
+    return dictionary.parse(body, word)
+
+
+class DefinitionCache:
+    """Parsed definitions by normalized word.
+
+    Recently used words are kept in memory, and everything is saved in the
+    database until it expires. Words that were not found are cached as well,
+    for a shorter time. Concurrent lookups of the same word share one fetch.
+    """
+
+    def __init__(
+        self,
+        web: WebClient,
+        database: Database,
+        size: int = CACHE_SIZE,
+        limiter: Optional[RateLimiter] = None,
+    ) -> None:
+        self.web = web
+        self.database = database
+        self.size = size
+        self.limiter = limiter or RateLimiter(RATE, BURST, MAX_QUEUE)
+        # word -> (definitions, or None if not found; error; expiry time)
+        self._entries: 'OrderedDict[str, CachedEntry]' = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def normalize(word: str) -> str:
+        return ' '.join(word.lower().split())
+
+    async def get(self, word: str, key: Hashable = None) -> List[Entry]:
+        """Return the definitions of a word, raising :class:`NotFoundError`
+        if it has none. If it has to be fetched, the request is queued for the
+        rate limiter under ``key``."""
+        word = self.normalize(word)
+        entry = self._entries.get(word)
+        if entry is None or entry[2] <= time.time():
+            loading = self._loading.get(word)
+            if loading is None:
+                loading = asyncio.ensure_future(self._load(word, key))
+                self._loading[word] = loading
+                loading.add_done_callback(lambda _: self._loading.pop(word, None))
+            entry = await asyncio.shield(loading)
+        # other loads may have evicted the word in the meantime
+        if word in self._entries:
+            self._entries.move_to_end(word)
+        definitions, error, _ = entry
+        if definitions is None:
+            raise NotFoundError(error)
+        return definitions
+
+    async def _load(self, word: str, key: Hashable) -> CachedEntry:
+        saved = await self.database.get_definition(word)
+        if saved is not None:
+            data, error, expires = saved
+            definitions = None if data is None else [Entry.load(d) for d in data]
+            entry = definitions, error, expires
+        else:
+            try:
+                definitions = await self._fetch(word, key)
+            except NotFoundError as exc:
+                entry = None, exc.args[0], time.time() + NOT_FOUND_TTL
+                await self.database.set_definition(word, None, *entry[1:])
             else:
-                entries.append(obj['entry'])
-    result = []
-    for entry in entries:
-        entry_result = []
-        for sense_family in entry['sense_families']:
-            posl = sense_family.get('parts_of_speech')
-            if not posl:
-                posl = sense_family['senses'][0].get('parts_of_speech', [])
-            if entry.get('__subentry'):
-                posl = [{'value': 'phrase of *%s*' % entry['headword']}]
-            if not posl:
-                raise UnknownError('Cannot parse POS: %r' % sense_family)
-            pos = posl[0]['value']
-            definitions = []
-            for sense in sense_family['senses']:
-                definitions.append(_parse_definition(sense))
-            forms = []
-            for morph in sense_family.get('morph_units', []):
-                forms.append(
-                    {
-                        'name': morph['form_type']['description'],
-                        'pos': morph['form_type']['pos_tag'],
-                        'form': morph['word_form'],
-                    }
+                entry = definitions, None, time.time() + CACHE_TTL
+                await self.database.set_definition(
+                    word, [e.dump() for e in definitions], *entry[1:]
                 )
-            entry_result.append(
-                {
-                    'partOfSpeech': pos,
-                    'definitions': definitions,
-                    'topics': [
-                        t['name'] for t in sense_family.get('relevant_topics', [])
-                    ],
-                    'forms': forms,
-                }
-            )
-        res = {
-            'index': entry.get('homograph_index'),
-            'word': entry.get('lemma') or entry.get('headword') or word,
-            'phonetic': None,
-            'phonetics': [],
-            'origin': entry.get('etymology', {}).get('etymology', {}).get('text'),
-            'originImages': entry.get('etymology', {}).get('images', {}),
-            'meanings': entry_result,
-            'topics': [t['name'] for t in entry.get('term_topics', [])],
-        }
-        for phonetic in entry.get('phonetics', []):
-            if res['phonetic'] is None:
-                res['phonetic'] = phonetic.get('text')
-            res['phonetics'].append(
-                {'text': phonetic.get('text'), 'audio': phonetic.get('oxford_audio')}
-            )
-        result.append(res)
-    return result
+        self._entries[word] = entry
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+        return entry
+
+    async def _fetch(self, word: str, key: Hashable) -> List[Entry]:
+        for attempt in range(RETRIES):
+            await self._acquire(word, key)
+            try:
+                return await fetch_definitions(self.web, word)
+            except RateLimitError as exc:
+                self.limiter.backoff(exc.retry_after or BACKOFF * 2**attempt)
+        await self._acquire(word, key)
+        return await fetch_definitions(self.web, word)
+
+    async def _acquire(self, word: str, key: Hashable) -> None:
+        await self.limiter.acquire(key)
+        # queue depth and waits, to tune the limiter before the queue overflows
+        logger.debug(f'/define fetching {word!r}: {self.limiter.stats()}')
 
 
 class DefineCommandExtension(Extension):
     bot: CustomClient
 
-    async def get_definition_elements(self, word: str, page: int = 1) -> dict:
+    def __init__(self, bot: CustomClient) -> None:
+        self.cache = DefinitionCache(bot.web, bot.database)
+        # (word, page) -> (entries the page was rendered from, message payload)
+        self._pages: 'OrderedDict[Tuple[str, int], Tuple[List[Entry], dict]]'
+        self._pages = OrderedDict()
+        bot.router.add('def_p', self.on_page_component)
+
+    def drop(self) -> None:
+        self.bot.router.remove('def_p')
+        super().drop()
+
+    async def get_definition_elements(
+        self, word: str, page: int = 1, key: Hashable = None
+    ) -> dict:
         try:
-            entries = await fetch_definitions(word)
+            entries = await self.cache.get(word, key)
+        except QueueFull:
+            self.bot.logger.warning(
+                f'/define queue is full: {self.cache.limiter.stats()}'
+            )
+            return {
+                'content': 'Definition: **%s**\nToo many lookups right now, please '
+                'try again later!' % word
+            }
         except NotFoundError as exc:
             return {
                 'content': 'Definition: **%s**\nWord not found: %s'
@@ -205,16 +212,40 @@ class DefineCommandExtension(Extension):
                 'content': 'Definition: **%s**\nError occurred:\n```\n%r\n```'
                 % (word, exc)
             }
+        if not 1 <= page <= len(entries):
+            return {
+                'content': 'Definition: **%s**\nThere is no page %d, it only has %d!'
+                % (word, page, len(entries))
+            }
+        key = self.cache.normalize(word), page
+        cached = self._pages.get(key)
+        # the entries are replaced when the cached definitions expire
+        if cached is not None and cached[0] is entries:
+            self._pages.move_to_end(key)
+            elements = cached[1]
+        else:
+            elements = self.render_page(word, entries, page)
+            self._pages[key] = entries, elements
+            while len(self._pages) > PAGE_CACHE_SIZE:
+                self._pages.popitem(last=False)
+        # the page is shared by all spellings of the word, but shows the one
+        # that was asked for
+        return {**elements, 'content': self.page_content(word, page, len(entries))}
+
+    def page_content(self, word: str, page: int, pages: int) -> str:
+        return 'Definition: **%s**\nPage **%d** of **%d**' % (word, page, pages)
+
+    def render_page(self, word: str, entries: List[Entry], page: int) -> dict:
         pages = len(entries)
         data = entries[page - 1]
         embed = Embed()
-        embed.title = data['word']
+        embed.title = data.word
         desc = ''
-        if data.get('phonetic'):
-            desc += 'Pronounciation: *%s*\n' % data['phonetic']
-        # if data.get('origin'):
+        if data.phonetic:
+            desc += 'Pronounciation: *%s*\n' % data.phonetic
+        # if data.origin:
         #     desc += 'Word origin: %s' % (
-        #         data['origin']
+        #         data.origin
         #         .replace('<i>', '*')
         #         .replace('</i>', '*')
         #         .replace('<b>', '**')
@@ -222,46 +253,40 @@ class DefineCommandExtension(Extension):
         #     )
         embed.description = desc.strip()
         fields = []
-        for meaning in data['meanings']:
-            pos = meaning['partOfSpeech']
+        for meaning in data.meanings:
             text = ''
-            if meaning.get('forms'):
-                forms = []
-                for form in meaning['forms']:
-                    forms.append('%s: **%s**' % (form['name'], form['form']))
+            if meaning.forms:
                 text += '*'
-                text += '; '.join(forms)
+                text += '; '.join(
+                    '%s: **%s**' % (form.name, form.form) for form in meaning.forms
+                )
                 text += '*\n'
-            if meaning.get('topics'):
+            if meaning.topics:
                 text += '*Topics: '
-                text += ', '.join(meaning['topics'])
+                text += ', '.join(meaning.topics)
                 text += '*\n'
-            fields.append(EmbedField(pos, text.strip() or ' '))
-            for i, definition in enumerate(meaning['definitions']):
+            fields.append(EmbedField(meaning.part_of_speech, text.strip() or ' '))
+            for i, definition in enumerate(meaning.definitions):
                 title = ''
-                if len(meaning['definitions']) > 1:
+                if len(meaning.definitions) > 1:
                     title += '%d. ' % (i + 1)
-                if definition.get('labels'):
+                if definition.labels:
                     title += '*('
-                    lst = []
-                    for category, labels in definition['labels'].items():
-                        for label in labels:
-                            lst.append('%s:%s' % (category, label.lower()))
-                    title += ', '.join(lst)
+                    title += ', '.join(definition.labels)
                     title += ')* '
-                title += definition['definition']
+                title += definition.text
                 text = ''
-                if definition.get('example'):
+                if definition.example:
                     text += '> *'
-                    text += definition['example']
+                    text += definition.example
                     text += '*\n'
-                if definition.get('synonyms'):
+                if definition.synonyms:
                     text += '**Synonyms**: '
-                    text += ', '.join(definition['synonyms'][:5])
+                    text += ', '.join(definition.synonyms[:5])
                     text += '\n'
-                if definition.get('antonyms'):
+                if definition.antonyms:
                     text += '**Antonyms**: '
-                    text += ', '.join(definition['antonyms'][:5])
+                    text += ', '.join(definition.antonyms[:5])
                     text += '\n'
                 fields.append(EmbedField(title, text.strip() or ' '))
         embed.fields = fields
@@ -287,11 +312,13 @@ class DefineCommandExtension(Extension):
             placeholder='Go to page...',
             custom_id='def_goto'
         )
-        content = 'Definition: **%s**\nPage **%d** of **%d**' % (word, page, pages)
         return {
-            'content': content,
-            'embeds': embed,
-            'components': [[last_page, next_page], [goto_page]],
+            'content': self.page_content(word, page, pages),
+            'embeds': embed.to_dict(),
+            'components': [
+                ActionRow(last_page, next_page).to_dict(),
+                ActionRow(goto_page).to_dict(),
+            ],
         }
 
     @slash_command(
@@ -315,6 +342,7 @@ class DefineCommandExtension(Extension):
                 type=OptionType.INTEGER,
                 description='The page to open',
                 required=False,
+                min_value=1,
             ),
         ],
     )
@@ -327,23 +355,21 @@ class DefineCommandExtension(Extension):
                 'Invalid characters, please only send words or phrases!', ephemeral=True
             )
         await ctx.defer(ephemeral=ephemeral)
-        await ctx.send(**await self.get_definition_elements(word, page=page))
+        await ctx.send(
+            **await self.get_definition_elements(word, page, ctx.guild_id)
+        )
 
-    @listen()
-    async def on_define_component(self, event: Component):
-        ctx = event.ctx
-        if not ctx.custom_id.startswith('def_'):
-            return
+    async def on_page_component(self, ctx: ComponentContext, page: str):
         message = ctx.message
         assert message
-        if ctx.custom_id.startswith('def_p'):
-            page = int(ctx.custom_id[5:])
-            content = message.content
-            assert content.startswith('Definition: **')
-            fragment = content[14:]
-            word = fragment[: fragment.index('**')]
-            await ctx.defer(edit_origin=True)
-            await ctx.edit_origin(**await self.get_definition_elements(word, page=page))
+        content = message.content
+        assert content.startswith('Definition: **')
+        fragment = content[14:]
+        word = fragment[: fragment.index('**')]
+        await ctx.defer(edit_origin=True)
+        await ctx.edit_origin(
+            **await self.get_definition_elements(word, int(page), ctx.guild_id)
+        )
 
     @component_callback('def_goto')
     async def on_goto_component(self, ctx: ComponentContext):
@@ -355,7 +381,9 @@ class DefineCommandExtension(Extension):
         fragment = content[14:]
         word = fragment[: fragment.index('**')]
         await ctx.defer(edit_origin=True)
-        await ctx.edit_origin(**await self.get_definition_elements(word, page=page))
+        await ctx.edit_origin(
+            **await self.get_definition_elements(word, page, ctx.guild_id)
+        )
 
 
 def setup(bot: CustomClient):
@@ -17,7 +17,7 @@ from interactions import (
     listen,
     slash_command,
 )
-from interactions.api.events import Component, MemberAdd
+from interactions.api.events import MemberAdd
 
 from client import CustomClient
 
@@ -27,8 +27,15 @@ MAX_AUTOROLES = 24
 class AutorolesExtension(Extension):
     bot: CustomClient
 
+    def __init__(self, bot: CustomClient) -> None:
+        bot.router.add('ar_@', self.on_autorole_component)
+
+    def drop(self) -> None:
+        self.bot.router.remove('ar_@')
+        super().drop()
+
     async def get_embed_and_components(self, guild: Guild):
-        settings = self.bot.database.get_guild_settings(guild.id)
+        settings = await self.bot.database.get_guild_settings(guild.id)
         autoroles = settings.autoroles
         roles: List[Role] = []
         delete_roles: List[int] = []
@@ -41,7 +48,7 @@ class AutorolesExtension(Extension):
         if delete_roles:
             for role_id in delete_roles:
                 autoroles.remove(role_id)
-            self.bot.database.set_guild_settings(guild.id, settings)
+            await self.bot.database.set_guild_settings(guild.id, settings)
         embed = Embed(
             title='Autoroles setup',
             description=f'There are currently {len(roles)} roles added when a new '
@@ -82,7 +89,7 @@ class AutorolesExtension(Extension):
         member = ctx.member
         if member is None:
             return await ctx.send('Wait, who was that?')
-        settings = self.bot.database.get_guild_settings(guild.id)
+        settings = await self.bot.database.get_guild_settings(guild.id)
         if add_role.id in settings.autoroles:
             return await ctx.send('That role is already in autoroles!', ephemeral=True)
         if len(settings.autoroles) >= MAX_AUTOROLES:
@@ -90,28 +97,24 @@ class AutorolesExtension(Extension):
                 'Maximum number of autoroles reached!', ephemeral=True
             )
         settings.autoroles.append(add_role.id)
-        self.bot.database.set_guild_settings(guild.id, settings)
+        await self.bot.database.set_guild_settings(guild.id, settings)
         embed, components = await self.get_embed_and_components(guild)
         await ctx.edit_origin(embeds=embed, components=components)
 
-    @listen()
-    async def on_autorole_component(self, event: Component):
-        ctx = event.ctx
-        if not ctx.custom_id.startswith('ar_@'):
-            return
-        del_role_id = int(ctx.custom_id[4:])
+    async def on_autorole_component(self, ctx: ComponentContext, role: str):
+        del_role_id = int(role)
         guild = ctx.guild
         assert guild
         member = ctx.member
         if member is None:
             return await ctx.send('Wait, who was that?')
-        settings = self.bot.database.get_guild_settings(guild.id)
+        settings = await self.bot.database.get_guild_settings(guild.id)
         if del_role_id not in settings.autoroles:
             return await ctx.send(
                 'This role, somehow, is not in autoroles!', ephemeral=True
             )
         settings.autoroles.remove(del_role_id)
-        self.bot.database.set_guild_settings(guild.id, settings)
+        await self.bot.database.set_guild_settings(guild.id, settings)
         embed, components = await self.get_embed_and_components(guild)
         await ctx.edit_origin(embeds=embed, components=components)
 
@@ -119,7 +122,7 @@ class AutorolesExtension(Extension):
     async def on_member_add(self, event: MemberAdd):
         member = event.member
         guild = event.guild
-        settings = self.bot.database.get_guild_settings(guild.id)
+        settings = await self.bot.database.get_guild_settings(guild.id)
         print('memberadd', member, guild, settings.autoroles)
         await member.add_roles(settings.autoroles, 'Quill autoroles')
 
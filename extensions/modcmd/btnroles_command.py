@@ -4,6 +4,7 @@ from typing import Dict, List, Optional, Tuple, cast
 from interactions import (
     TYPE_MESSAGEABLE_CHANNEL,
     ActionRow,
+    AutocompleteContext,
     Button,
     ButtonStyle,
     ChannelSelectMenu,
@@ -12,7 +13,6 @@ from interactions import (
     Embed,
     EmbedFooter,
     Extension,
-    Guild,
     InteractionContext,
     Message,
     OptionType,
@@ -20,12 +20,11 @@ from interactions import (
     Role,
     RoleSelectMenu,
     SlashCommandOption,
-    Snowflake_Type,
     component_callback,
     listen,
     slash_command,
 )
-from interactions.api.events import Component, MessageCreate
+from interactions.api.events import MessageCreate
 from interactions.client.errors import HTTPException
 
 from client import CustomClient
@@ -80,8 +79,13 @@ class Pending:
 class ButtonRolesCommandExtension(Extension):
     bot: CustomClient
 
-    def __init__(self, _) -> None:
+    def __init__(self, bot: CustomClient) -> None:
         self.pending: Dict[Tuple[int, int], Pending] = {}
+        bot.router.add('br_@', self.on_roles_component)
+
+    def drop(self) -> None:
+        self.bot.router.remove('br_@')
+        super().drop()
 
     async def _prune(self, keep=None):
         threshold = time.time() - 60 * 10
@@ -278,12 +282,8 @@ class ButtonRolesCommandExtension(Extension):
         await self.send_roles(send_channel, pending)
         await ctx.send('Success! Check out the message now!')
 
-    @listen()
-    async def on_roles_component(self, event: Component):
-        ctx = event.ctx
-        if not ctx.custom_id.startswith('br_@'):
-            return
-        role_id = int(ctx.custom_id[4:])
+    async def on_roles_component(self, ctx: ComponentContext, role: str):
+        role_id = int(role)
         member = ctx.member
         if member is None:
             self.bot.logger.warn(f'Member is None for {ctx.custom_id}!')
@@ -306,27 +306,6 @@ class ButtonRolesCommandExtension(Extension):
         action = 'removed' if is_removing else 'added'
         await ctx.send(f'Role <@&{role_id}> {action}!', ephemeral=True)
 
-    async def find_message(self, guild: Guild, message_id: Snowflake_Type):
-        for channel in guild.channels:
-            if not isinstance(channel, TYPE_MESSAGEABLE_CHANNEL):
-                continue
-            message = channel.get_message(message_id)
-            if message is not None:
-                return message
-        fetched = await guild.fetch_channels()
-        for channel in fetched:
-            if not isinstance(channel, TYPE_MESSAGEABLE_CHANNEL):
-                continue
-            message = channel.get_message(message_id)
-            if message is not None:
-                return message
-        for channel in fetched:
-            if not isinstance(channel, TYPE_MESSAGEABLE_CHANNEL):
-                continue
-            message = await channel.fetch_message(message_id)
-            if message is not None:
-                return message
-
     @slash_command(
         'btnroles',
         description=DESC,
@@ -338,7 +317,7 @@ class ButtonRolesCommandExtension(Extension):
             SlashCommandOption(
                 name='message',
                 type=OptionType.STRING,
-                description='The message ID to update',
+                description='Link or ID of the message to update',
             ),
             SlashCommandOption(
                 name='role',
@@ -361,7 +340,7 @@ class ButtonRolesCommandExtension(Extension):
     )
     async def roles_add_command(self, ctx: InteractionContext):
         args = ctx.kwargs
-        message_id: str = args['message']
+        reference: str = args['message']
         role: Role = args['role']
         label: str = args['label']
         index: int = args.get('index', -1)
@@ -371,10 +350,10 @@ class ButtonRolesCommandExtension(Extension):
                 'You can only use this command in a server!', ephemeral=True
             )
         await ctx.defer(ephemeral=True)
-        message = await self.find_message(guild, message_id)
+        message = await self.bot.locator.resolve(guild, reference)
         if message is None:
             return await ctx.send(
-                'The message is not found; please double check the message ID!', ephemeral=True
+                'The message is not found; please double check the message link or ID!', ephemeral=True
             )
         if not message.embeds:
             return await ctx.send('The message doesn\'t have an embed, did I send it?', ephemeral=True)
@@ -406,7 +385,7 @@ class ButtonRolesCommandExtension(Extension):
             SlashCommandOption(
                 name='message',
                 type=OptionType.STRING,
-                description='The message ID to update',
+                description='Link or ID of the message to update',
             ),
             SlashCommandOption(
                 name='title',
@@ -424,7 +403,7 @@ class ButtonRolesCommandExtension(Extension):
     )
     async def roles_edit_command(self, ctx: InteractionContext):
         args = ctx.kwargs
-        message_id: str = args['message']
+        reference: str = args['message']
         title: Optional[str] = args.get('title')
         content: Optional[str] = args.get('content')
         if title is None and content is None:
@@ -435,10 +414,10 @@ class ButtonRolesCommandExtension(Extension):
                 'You can only use this command in a server!', ephemeral=True
             )
         await ctx.defer(ephemeral=True)
-        message = await self.find_message(guild, message_id)
+        message = await self.bot.locator.resolve(guild, reference)
         if message is None:
             return await ctx.send(
-                'The message is not found; please double check the message ID!'
+                'The message is not found; please double check the message link or ID!'
             )
         if not message.embeds:
             return await ctx.send('The message doesn\'t have an embed, did I send it?')
@@ -462,7 +441,7 @@ class ButtonRolesCommandExtension(Extension):
             SlashCommandOption(
                 name='message',
                 type=OptionType.STRING,
-                description='The message ID to update',
+                description='Link or ID of the message to update',
             ),
             SlashCommandOption(
                 name='index',
@@ -492,7 +471,7 @@ class ButtonRolesCommandExtension(Extension):
     )
     async def roles_editrole_command(self, ctx: InteractionContext):
         args = ctx.kwargs
-        message_id: str = args['message']
+        reference: str = args['message']
         index: int = args['index']
         role: Optional[Role] = args.get('role')
         label: Optional[str] = args.get('label')
@@ -505,10 +484,10 @@ class ButtonRolesCommandExtension(Extension):
                 'You can only use this command in a server!', ephemeral=True
             )
         await ctx.defer(ephemeral=True)
-        message = await self.find_message(guild, message_id)
+        message = await self.bot.locator.resolve(guild, reference)
         if message is None:
             return await ctx.send(
-                'The message is not found; please double check the message ID!'
+                'The message is not found; please double check the message link or ID!'
             )
         if not message.embeds:
             return await ctx.send('The message doesn\'t have an embed, did I send it?')
@@ -532,6 +511,18 @@ class ButtonRolesCommandExtension(Extension):
         await message.edit(embeds=embed, components=split_rows(*components))
         await ctx.send('Edited message!')
 
+    @roles_add_command.autocomplete('message')
+    @roles_edit_command.autocomplete('message')
+    @roles_editrole_command.autocomplete('message')
+    async def message_autocomplete(self, ctx: AutocompleteContext):
+        channel = ctx.channel
+        if channel is None:
+            return await ctx.send([])
+        # only the messages sent by the bot can have role buttons
+        await ctx.send(
+            await self.bot.locator.suggest(channel, ctx.input_text, self.bot.user.id)
+        )
+
 
 def setup(bot: CustomClient):
     ButtonRolesCommandExtension(bot)
@@ -102,7 +102,7 @@ class GreetExtension(Extension):
         guild = ctx.guild
         if guild is None:
             return await ctx.send('You can only use this in a server!', ephemeral=True)
-        settings = self.bot.database.get_guild_settings(guild.id)
+        settings = await self.bot.database.get_guild_settings(guild.id)
         if channel is not None:
             settings.greet_channel = channel.id
         if any(x is not None for x in [welcome_text, welcome_title, welcome_body]):
@@ -148,14 +148,14 @@ class GreetExtension(Extension):
             description=f'Greet messages are now sent to {greet_channel}\n',
         )
 
-        self.bot.database.set_guild_settings(guild.id, settings)
+        await self.bot.database.set_guild_settings(guild.id, settings)
         await ctx.send(embeds=embed)
 
     @listen()
     async def on_member_add(self, event: MemberAdd):
         guild = event.guild
         member = event.member
-        settings = self.bot.database.get_guild_settings(guild.id)
+        settings = await self.bot.database.get_guild_settings(guild.id)
         if settings.welcome_msg and settings.greet_channel:
             channel = await guild.fetch_channel(settings.greet_channel)
             if isinstance(channel, TYPE_MESSAGEABLE_CHANNEL):
@@ -165,7 +165,7 @@ class GreetExtension(Extension):
     async def on_member_remove(self, event: MemberRemove):
         guild = event.guild
         member = event.member
-        settings = self.bot.database.get_guild_settings(guild.id)
+        settings = await self.bot.database.get_guild_settings(guild.id)
         if settings.goodbye_msg and settings.greet_channel:
             channel = await guild.fetch_channel(settings.greet_channel)
             if isinstance(channel, TYPE_MESSAGEABLE_CHANNEL):
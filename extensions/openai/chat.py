@@ -1,6 +1,5 @@
 import asyncio
 import os
-import time
 
 import openai
 from interactions import (
@@ -16,10 +15,11 @@ from interactions.api.events import MessageCreate
 from openai.error import APIConnectionError, OpenAIError
 
 from client import CustomClient
-from util import tomorrow
+from quota import QuotaExceeded
 
 PROMPT = 'You are Quill, a concise and friendly language model.'
-USER_LIMIT = 10000
+# tokens held back while waiting for a completion, or what is left of the quota
+RESERVE = 1000
 
 
 class ChatError(RuntimeError):
@@ -62,33 +62,33 @@ class ChatExtension(Extension):
         # )
         message = ctx.kwargs.get('message', 'Hello!')
         user_id = ctx.user.id
-        user = self.bot.database.get_user(user_id)
         self.bot.logger.info(f'/chat user:{user_id}')
-        if time.time() > user.chat_reset:
-            user.chat_reset = tomorrow().timestamp()
-            user.chat_used = 0
-            self.bot.database.set_user(user_id, user)
-        if user.chat_used > USER_LIMIT:
+        try:
+            reservation = await self.bot.quota.reserve(
+                user_id, 'chat', RESERVE, partial=True
+            )
+        except QuotaExceeded as exc:
             return await ctx.send(
-                f'Sorry, you exceeded {USER_LIMIT} tokens today. Try again tomorrow!',
+                f'Sorry, you exceeded {exc.limit} tokens today. Try again tomorrow!',
                 ephemeral=True,
             )
-        await ctx.defer()
         try:
-            chat: dict = await create_chat_completion(
-                model='gpt-3.5-turbo',
-                messages=[
-                    {'role': 'system', 'content': PROMPT},
-                    {'role': 'user', 'content': message},
-                ],
-                user=f'quill-{user_id}',
-            )  # type: ignore
-        except ChatError as exc:
-            return await ctx.send('**Error**: %s' % exc.args[0])
-        tokens: int = chat['usage']['total_tokens']
-        user = self.bot.database.get_user(user_id)
-        user.chat_used += tokens
-        self.bot.database.set_user(user_id, user)
+            await ctx.defer()
+            try:
+                chat: dict = await create_chat_completion(
+                    model='gpt-3.5-turbo',
+                    messages=[
+                        {'role': 'system', 'content': PROMPT},
+                        {'role': 'user', 'content': message},
+                    ],
+                    user=f'quill-{user_id}',
+                )  # type: ignore
+            except ChatError as exc:
+                return await ctx.send('**Error**: %s' % exc.args[0])
+            tokens: int = chat['usage']['total_tokens']
+            await self.bot.quota.commit(reservation, tokens)
+        finally:
+            self.bot.quota.refund(reservation)
         await ctx.send(chat['choices'][0]['message']['content'])
 
     async def chain(self, message: Message) -> list[dict]:
@@ -127,27 +127,27 @@ class ChatExtension(Extension):
         ):
             return
         user_id = message.author.id
-        user = self.bot.database.get_user(user_id)
-        if time.time() > user.chat_reset:
-            user.chat_reset = tomorrow().timestamp()
-            user.chat_used = 0
-            self.bot.database.set_user(user_id, user)
-        if user.chat_used > USER_LIMIT:
+        try:
+            reservation = await self.bot.quota.reserve(
+                user_id, 'chat', RESERVE, partial=True
+            )
+        except QuotaExceeded as exc:
             return await message.channel.send(
-                f'Sorry {message.author.mention}, you exceeded {USER_LIMIT} tokens '
+                f'Sorry {message.author.mention}, you exceeded {exc.limit} tokens '
                 'today. Try again tomorrow!'
             )
         self.bot.logger.debug(f'triggered message {message.id}: {message.content}')
-        messages = await self.chain(message)
-        chat: dict = await create_chat_completion(
-            model='gpt-3.5-turbo',
-            messages=[{'role': 'system', 'content': PROMPT}] + messages,
-            user=f'quill-{message.author.id}',
-        )  # type: ignore
-        tokens: int = chat['usage']['total_tokens']
-        user = self.bot.database.get_user(user_id)
-        user.chat_used += tokens
-        self.bot.database.set_user(user_id, user)
+        try:
+            messages = await self.chain(message)
+            chat: dict = await create_chat_completion(
+                model='gpt-3.5-turbo',
+                messages=[{'role': 'system', 'content': PROMPT}] + messages,
+                user=f'quill-{message.author.id}',
+            )  # type: ignore
+            tokens: int = chat['usage']['total_tokens']
+            await self.bot.quota.commit(reservation, tokens)
+        finally:
+            self.bot.quota.refund(reservation)
         await message.reply(chat['choices'][0]['message']['content'])
 
 
@@ -1,10 +1,8 @@
 import asyncio
 import io
-import time
 from typing import cast
 
 import openai
-import requests
 from interactions import (
     Extension,
     File,
@@ -16,9 +14,8 @@ from interactions import (
 from openai.error import APIConnectionError, InvalidRequestError, OpenAIError
 
 from client import CustomClient
-from util import tomorrow
-
-USER_LIMIT = 5
+from quota import QuotaExceeded
+from web import DownloadError
 
 
 class ImagegenError(RuntimeError):
@@ -55,28 +52,31 @@ class ImagegenCommandExtension(Extension):
         args = ctx.kwargs
         prompt: str = args['prompt']
         user_id = ctx.user.id
-        user = self.bot.database.get_user(user_id)
-        if time.time() > user.images_reset:
-            user.images_reset = tomorrow().timestamp()
-            user.images_used = 0
-            self.bot.database.set_user(user_id, user)
-        if user.images_used > USER_LIMIT:
+        try:
+            reservation = await self.bot.quota.reserve(user_id, 'images')
+        except QuotaExceeded as exc:
             return await ctx.send(
-                f'Sorry, you exceeded {USER_LIMIT} images today. Try again tomorrow!',
+                f'Sorry, you exceeded {exc.limit} images today. Try again tomorrow!',
                 ephemeral=True,
             )
-        await ctx.defer()
         try:
-            image = cast(dict, await create_image(prompt=prompt, n=1, size='512x512'))
-        except ImagegenError as exc:
-            return await ctx.send('**Error**: %s' % exc.args[0])
-        image_url: str = image['data'][0]['url']
-        print(image_url)
-        user = self.bot.database.get_user(user_id)
-        user.images_used += 1
-        self.bot.database.set_user(user_id, user)
-        r = requests.get(image_url)
-        buf = io.BytesIO(r.content)
+            await ctx.defer()
+            try:
+                image = cast(
+                    dict, await create_image(prompt=prompt, n=1, size='512x512')
+                )
+            except ImagegenError as exc:
+                return await ctx.send('**Error**: %s' % exc.args[0])
+            image_url: str = image['data'][0]['url']
+            print(image_url)
+            await self.bot.quota.commit(reservation)
+        finally:
+            self.bot.quota.refund(reservation)
+        try:
+            data = await self.bot.web.download(image_url)
+        except DownloadError as exc:
+            return await ctx.send('**Error**: %s' % exc.msg)
+        buf = io.BytesIO(data)
         await ctx.send(f'Here is the generated image!', files=File(buf, 'image.png'))
 
 
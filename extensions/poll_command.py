@@ -1,5 +1,13 @@
+import io
+import os
+import tempfile
+
 from interactions import (
+    Embed,
+    EmbedField,
     Extension,
+    File,
+    Message,
     InteractionContext,
     slash_command,
     Button,
@@ -10,17 +18,63 @@ from interactions import (
     component_callback,
     ComponentContext,
 )
-from typing import List
+from typing import List, Optional
 
 from client import CustomClient
+from database import Poll, PollResults
+from debounce import Debouncer
+
+# the poll message is edited at most once every this many seconds
+UPDATE_WINDOW = float(os.getenv('POLL_UPDATE_WINDOW', 1))
+TIMELINE_BARS = 12
+
+
+def render_poll(poll: Poll) -> str:
+    content = '%s\n' % poll.question
+    for i, (option, votes) in enumerate(zip(poll.options, poll.votes)):
+        content += '%d. %s `(Voters: %d)`\n' % (i + 1, option, votes)
+    return content.strip()
+
+
+def parse_poll(content: str) -> Optional[Poll]:
+    """Read a poll back from its message, for polls created before they were
+    saved in the database."""
+    question, *lines = content.splitlines() or ['']
+    options = []
+    votes = []
+    for line in lines:
+        option, _, count = line.rpartition(' `(Voters: ')
+        number, _, option = option.partition('. ')
+        if not number.isdigit() or not count[:-2].isdigit():
+            return None
+        options.append(option)
+        votes.append(int(count[:-2]))
+    return Poll(question, options, votes)
 
 
 class PollCommandExtension(Extension):
     bot: CustomClient
 
+    def __init__(self, bot: CustomClient) -> None:
+        self.updates: Debouncer[Message] = Debouncer(UPDATE_WINDOW, self.update)
+        bot.add_shutdown_hook(self.updates.flush)
+
+    def drop(self) -> None:
+        self.bot.remove_shutdown_hook(self.updates.flush)
+        super().drop()
+
+    async def update(self, message_id: int, message: Message):
+        # the tally is read when the edit is made, so it includes every vote
+        # counted until then
+        poll = await self.bot.database.get_poll(message_id)
+        if poll is not None:
+            await message.edit(content=render_poll(poll))
+
     @slash_command(
         'poll',
-        description='Create a poll',
+        description='Poll commands',
+        sub_cmd_name='create',
+        sub_cmd_description='Create a poll',
         options=[
             SlashCommandOption(
                 'question',
@@ -40,7 +94,6 @@ class PollCommandExtension(Extension):
         if len(options) > 25:
             return await ctx.send('Cannot send more than 25 options!', ephemeral=True)
         components = []
-        content = '%s\n' % question
         for i, option in enumerate(options):
             components.append(
                 Button(
@@ -49,9 +102,84 @@ class PollCommandExtension(Extension):
                     custom_id='poll_%d' % i,
                 )
             )
-            content += '%d. %s `(Voters: 0)`\n' % (i + 1, option)
-        return await ctx.send(
-            content.strip(), components=ActionRow.split_components(*components)
+        poll = Poll(question, options)
+        message = await ctx.send(
+            render_poll(poll), components=ActionRow.split_components(*components)
+        )
+        await self.bot.database.add_poll(
+            message.id, ctx.guild_id, ctx.channel_id, poll
+        )
+
+    @slash_command(
+        'poll',
+        description='Poll commands',
+        sub_cmd_name='results',
+        sub_cmd_description='Show the results of a poll',
+        options=[
+            SlashCommandOption(
+                'message',
+                type=OptionType.STRING,
+                description='Message ID of the poll',
+            ),
+            SlashCommandOption(
+                'export',
+                type=OptionType.BOOLEAN,
+                description='Attach every vote as a CSV file (default no)',
+                required=False,
+            ),
+        ],
+    )
+    async def results_command(self, ctx: InteractionContext):
+        message_id: str = ctx.kwargs['message'].strip()
+        export: bool = ctx.kwargs.get('export', False)
+        database = self.bot.database
+        results = None
+        if message_id.isdigit():
+            results = await database.get_poll_results(int(message_id))
+        if (
+            results is None
+            or results.guild_id != ctx.guild_id
+            or (ctx.guild_id is None and results.channel_id != ctx.channel_id)
+        ):
+            return await ctx.send('Poll not found!', ephemeral=True)
+        await ctx.defer(ephemeral=True)
+        embed = await self.render_results(int(message_id), results)
+        if not export:
+            return await ctx.send(embeds=embed, ephemeral=True)
+        with tempfile.TemporaryFile() as fp:
+            text = io.TextIOWrapper(fp, encoding='utf-8', newline='')
+            await database.export_poll_votes(int(message_id), text)
+            text.detach()  # flushes, and leaves fp open
+            fp.seek(0)
+            await ctx.send(
+                embeds=embed,
+                files=File(fp, file_name=f'poll-{message_id}.csv'),
+                ephemeral=True,
+            )
+
+    async def render_results(self, message_id: int, results: PollResults) -> Embed:
+        lines = []
+        for i, (option, votes, percentage) in enumerate(
+            zip(results.options, results.votes, results.percentages)
+        ):
+            lines.append(f'{i + 1}. {option}: **{votes}** ({percentage:.1f}%)')
+        fields = []
+        if results.first_vote is not None and results.last_vote is not None:
+            # split the voting period into at most TIMELINE_BARS whole minutes
+            span = results.last_vote - results.first_vote
+            interval = max(60, -(-span // TIMELINE_BARS // 60) * 60)
+            timeline = await self.bot.database.get_poll_timeline(message_id, interval)
+            most = max(count for _, count in timeline)
+            text = ''
+            for start, count in timeline:
+                bar = '█' * max(1, round(count / most * 10))
+                text += f'<t:{int(start)}:t> {bar} {count}\n'
+            fields.append(EmbedField('Votes over time', text.strip()))
+        return Embed(
+            title=results.question,
+            description='\n'.join(lines),
+            fields=fields,
+            footer=f'{results.total} votes',
         )
 
     @component_callback(*('poll_%d' % i for i in range(25)))
@@ -61,17 +189,20 @@ class PollCommandExtension(Extension):
         guild_id = ctx.guild_id
         channel_id = ctx.channel_id
         user_id = ctx.user.id
-        if self.bot.database.has_poll(message_id, guild_id, channel_id, user_id):
+        result = await self.bot.database.vote(message_id, user_id, index)
+        if result is None:
+            poll = parse_poll(ctx.message.content) if ctx.message else None
+            if poll is None:
+                return await ctx.send('This poll is broken, sorry!', ephemeral=True)
+            await self.bot.database.add_poll(message_id, guild_id, channel_id, poll)
+            result = await self.bot.database.vote(message_id, user_id, index)
+            assert result
+        poll, counted = result
+        if not counted:
             return await ctx.send('You already voted on the poll!', ephemeral=True)
-        self.bot.database.add_poll(message_id, guild_id, channel_id, user_id)
-        message = await ctx.channel.fetch_message(message_id)
-        assert message
-        lines = message.content.splitlines()
-        line = lines[index + 1]
-        option, _, count = line.rpartition(' `(Voters: ')
-        lines[index + 1] = '%s `(Voters: %d)`' % (option, int(count[:-2]) + 1)
-        content = '\n'.join(lines)
-        await ctx.edit_origin(content=content)
+        await ctx.send('You voted for **%s**!' % poll.options[index], ephemeral=True)
+        if ctx.message is not None:
+            self.updates.schedule(message_id, ctx.message)
 
 
 def setup(bot: CustomClient):
@@ -62,7 +62,7 @@ class QuoteCommandExtension(Extension):
         quote: str = args['quote']
         if 'time' in args:
             timestr: str = args['time']
-            user = self.bot.database.get_user(ctx.user.id)
+            user = await self.bot.database.get_user(ctx.user.id)
             if user.timezone is None:
                 return await ctx.send(
                     'You need to set your timezone with /usersettings first!',
@@ -81,7 +81,7 @@ class QuoteCommandExtension(Extension):
             if guild is None:
                 channel = ctx.channel
             else:
-                settings = self.bot.database.get_guild_settings(guild.id)
+                settings = await self.bot.database.get_guild_settings(guild.id)
                 if settings is None or settings.quotes_channel is None:
                     channel = ctx.channel
                 else:
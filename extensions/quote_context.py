@@ -31,7 +31,7 @@ class QuoteContextExtension(Extension):
         if guild is None:
             channel = ctx.channel
         else:
-            settings = self.bot.database.get_guild_settings(guild.id)
+            settings = await self.bot.database.get_guild_settings(guild.id)
             if settings is None or settings.quotes_channel is None:
                 channel = ctx.channel
             else:
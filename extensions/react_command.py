@@ -1,46 +1,37 @@
-import requests
-from io import BytesIO
 from interactions import (
-    TYPE_MESSAGEABLE_CHANNEL,
     Attachment,
+    AutocompleteContext,
     Extension,
-    Guild,
     InteractionContext,
     OptionType,
     PartialEmoji,
     Permissions,
     SlashCommandOption,
-    Snowflake_Type,
     slash_command,
 )
 from interactions.client.errors import HTTPException
 
 from client import CustomClient
+from emojipool import EmojiPool, NoEmojiSlots
+from imaging import IMAGE_MAX_SIZE, ImageError, ImageProcessor
+from web import DownloadError, DownloadTooLarge
+
+TOO_LARGE = f'File must not be larger than {IMAGE_MAX_SIZE / 1024 / 1024:g}M!'
 
 
 class ReactCommandExtension(Extension):
     bot: CustomClient
 
-    async def find_message(self, guild: Guild, message_id: Snowflake_Type):
-        for channel in guild.channels:
-            if not isinstance(channel, TYPE_MESSAGEABLE_CHANNEL):
-                continue
-            message = channel.get_message(message_id)
-            if message is not None:
-                return message
-        fetched = await guild.fetch_channels()
-        for channel in fetched:
-            if not isinstance(channel, TYPE_MESSAGEABLE_CHANNEL):
-                continue
-            message = channel.get_message(message_id)
-            if message is not None:
-                return message
-        for channel in fetched:
-            if not isinstance(channel, TYPE_MESSAGEABLE_CHANNEL):
-                continue
-            message = await channel.fetch_message(message_id)
-            if message is not None:
-                return message
+    def __init__(self, bot: CustomClient) -> None:
+        self.pool = EmojiPool(bot)
+        self.images = ImageProcessor()
+        bot.add_shutdown_hook(self.pool.flush)
+        bot.add_shutdown_hook(self.images.close)
+
+    def drop(self) -> None:
+        self.bot.remove_shutdown_hook(self.pool.flush)
+        self.bot.remove_shutdown_hook(self.images.close)
+        super().drop()
 
     @slash_command(
         'react',
@@ -50,7 +41,7 @@ class ReactCommandExtension(Extension):
             SlashCommandOption(
                 name='message',
                 type=OptionType.STRING,
-                description='Message ID to react to',
+                description='Message link or ID to react to',
             ),
             SlashCommandOption(
                 name='emoji',
@@ -60,7 +51,7 @@ class ReactCommandExtension(Extension):
         ],
     )
     async def react_command(self, ctx: InteractionContext):
-        message_id: str = ctx.kwargs['message'].strip()
+        reference: str = ctx.kwargs['message']
         emoji: str = ctx.kwargs['emoji'].strip()
         partial_emoji = PartialEmoji.from_str(emoji)
         if partial_emoji is None:
@@ -69,7 +60,7 @@ class ReactCommandExtension(Extension):
         if guild is None:
             return await ctx.send('This must be used in a server!', ephemeral=True)
         await ctx.defer(ephemeral=True)
-        message = await self.find_message(guild, message_id)
+        message = await self.bot.locator.resolve(guild, reference)
         if message is None:
             return await ctx.send('Message not found!', ephemeral=True)
         for reaction in message.reactions:
@@ -87,7 +78,7 @@ class ReactCommandExtension(Extension):
             SlashCommandOption(
                 name='message',
                 type=OptionType.STRING,
-                description='The message to add the reaction to',
+                description='Link or ID of the message to add the reaction to',
             ),
             SlashCommandOption(
                 name='image',
@@ -102,34 +93,51 @@ class ReactCommandExtension(Extension):
         ],
     )
     async def customreact_command(self, ctx: InteractionContext):
-        message_id: str = ctx.kwargs['message'].strip()
+        reference: str = ctx.kwargs['message']
         image: Attachment = ctx.kwargs['image']
         name: str = ctx.kwargs['name']
         if (ctx.app_permissions & Permissions.MANAGE_EMOJIS_AND_STICKERS) == 0:
             return await ctx.send('I cannot add emojis... :(', ephemeral=True)
-        if image.size >= 256 * 1024:
-            return await ctx.send('File must not be larger than 256K!', ephemeral=True)
+        if image.size > IMAGE_MAX_SIZE:
+            return await ctx.send(TOO_LARGE, ephemeral=True)
         guild = ctx.guild
         assert guild
         await ctx.defer(ephemeral=True)
-        message = await self.find_message(guild, message_id)
+        message = await self.bot.locator.resolve(guild, reference)
         if message is None:
             return await ctx.send('Message not found!', ephemeral=True)
-        response = requests.get(image.url)
-        file = BytesIO(response.content)
         try:
-            emoji = await guild.create_custom_emoji(name, file, reason='Custom reaction')
-            assert emoji is not None
+            data = await self.bot.web.download(image.url, max_size=IMAGE_MAX_SIZE)
+        except DownloadTooLarge:
+            return await ctx.send(TOO_LARGE, ephemeral=True)
+        except DownloadError as exc:
+            return await ctx.send(
+                f'Failed to download image: {exc.msg}', ephemeral=True
+            )
+        try:
+            data = await self.images.emoji(data)
+        except ImageError as exc:
+            return await ctx.send(str(exc), ephemeral=True)
+        try:
+            await self.pool.react(guild, message, name, data)
+        except NoEmojiSlots:
+            return await ctx.send('There are no free emoji slots in this server!')
         except HTTPException as e:
             self.bot.logger.error(f'HTTP Error: {await e.response.json()}')
             raise
         except:
             self.bot.logger.exception(f'Failed to create emoji in {guild.id}')
             return await ctx.send('Failed to create emoji!')
-        await message.add_reaction(PartialEmoji(id=emoji.id))
-        await emoji.delete(reason='Custom reaction')
         return await ctx.send('Custom reaction added!', ephemeral=True)
 
+    @react_command.autocomplete('message')
+    @customreact_command.autocomplete('message')
+    async def message_autocomplete(self, ctx: AutocompleteContext):
+        channel = ctx.channel
+        if channel is None:
+            return await ctx.send([])
+        await ctx.send(await self.bot.locator.suggest(channel, ctx.input_text))
+
 
 def setup(bot: CustomClient):
     ReactCommandExtension(bot)
@@ -30,7 +30,7 @@ class SettingsCommandExtension(Extension):
 
     async def get_embed_and_components(self, guild: Guild):
         guild_id = guild.id
-        settings = self.bot.database.get_guild_settings(guild_id)
+        settings = await self.bot.database.get_guild_settings(guild_id)
         quote_channel = (
             f'<#{settings.quotes_channel}>'
             if settings.quotes_channel
@@ -120,9 +120,9 @@ class SettingsCommandExtension(Extension):
         guild_id = guild.id
         channels = ctx.values
         channel: GuildText = channels[0]  # type: ignore
-        settings = self.bot.database.get_guild_settings(guild_id)
+        settings = await self.bot.database.get_guild_settings(guild_id)
         settings.quotes_channel = channel.id
-        self.bot.database.set_guild_settings(guild_id, settings)
+        await self.bot.database.set_guild_settings(guild_id, settings)
         embed, components = await self.get_embed_and_components(guild)
         await ctx.edit_origin(embeds=embed, components=components)
 
@@ -131,9 +131,9 @@ class SettingsCommandExtension(Extension):
         guild = ctx.guild
         assert guild
         guild_id = guild.id
-        settings = self.bot.database.get_guild_settings(guild_id)
+        settings = await self.bot.database.get_guild_settings(guild_id)
         settings.quotes_channel = None
-        self.bot.database.set_guild_settings(guild_id, settings)
+        await self.bot.database.set_guild_settings(guild_id, settings)
         embed, components = await self.get_embed_and_components(guild)
         await ctx.edit_origin(embeds=embed, components=components)
 
@@ -144,9 +144,9 @@ class SettingsCommandExtension(Extension):
         guild_id = guild.id
         channels = ctx.values
         channel: GuildText = channels[0]  # type: ignore
-        settings = self.bot.database.get_guild_settings(guild_id)
+        settings = await self.bot.database.get_guild_settings(guild_id)
         settings.starboard_channel = channel.id
-        self.bot.database.set_guild_settings(guild_id, settings)
+        await self.bot.database.set_guild_settings(guild_id, settings)
         embed, components = await self.get_embed_and_components(guild)
         await ctx.edit_origin(embeds=embed, components=components)
 
@@ -155,9 +155,9 @@ class SettingsCommandExtension(Extension):
         guild = ctx.guild
         assert guild
         guild_id = guild.id
-        settings = self.bot.database.get_guild_settings(guild_id)
+        settings = await self.bot.database.get_guild_settings(guild_id)
         settings.starboard_channel = None
-        self.bot.database.set_guild_settings(guild_id, settings)
+        await self.bot.database.set_guild_settings(guild_id, settings)
         embed, components = await self.get_embed_and_components(guild)
         await ctx.edit_origin(embeds=embed, components=components)
 
@@ -1,6 +1,24 @@
-from typing import cast
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, cast
 
-from interactions import Embed, EmbedAuthor, Extension, GuildText, Message, listen
+from interactions import (
+    ChannelType,
+    Embed,
+    EmbedAuthor,
+    Extension,
+    GuildText,
+    InteractionContext,
+    Message,
+    OptionType,
+    PartialEmoji,
+    Permissions,
+    SlashCommandOption,
+    listen,
+    slash_command,
+)
 from interactions.api.events import (
     MessageDelete,
     MessageReactionAdd,
@@ -8,13 +26,85 @@ from interactions.api.events import (
 )
 
 from client import CustomClient
+from database import Settings, StarboardBackfill
+from debounce import Debouncer
+from ratelimit import RateLimiter
+from util import error_embed
+
+# star reactions within this many seconds are collapsed into one edit
+UPDATE_WINDOW = float(os.getenv('STARBOARD_UPDATE_WINDOW', 2))
+# requests per second the backfills make to Discord, shared by all of them
+BACKFILL_RATE = float(os.getenv('STARBOARD_BACKFILL_RATE', 1))
+BACKFILL_PAGE = 100
+DEFAULT_STAR = '⭐'
+
+
+# emojis of guilds whose star is looked up, each parsed once
+STAR_CACHE_SIZE = 256
+
+
+def parse_emoji(emoji: str) -> Optional[PartialEmoji]:
+    return PartialEmoji.from_str(emoji)
+
+
+@lru_cache(maxsize=STAR_CACHE_SIZE)
+def star_key(emoji: str) -> Optional[Tuple[Optional[int], Optional[str]]]:
+    """The ``(id, name)`` of a star emoji setting, immutable so that the cached
+    value can be shared."""
+    star = parse_emoji(emoji)
+    if star is None:
+        return None
+    return (int(star.id) if star.id is not None else None), star.name
+
 
-LIMIT = 1
+def is_star(emoji: PartialEmoji, settings: Settings) -> bool:
+    star = star_key(settings.starboard_emoji)
+    if star is None:
+        return False
+    star_id, star_name = star
+    if star_id is not None:
+        return emoji.id == star_id
+    if emoji.id is not None:
+        return False
+    # the default star is also matched by its name, as it always was
+    return emoji.name == star_name or (
+        star_name == DEFAULT_STAR and emoji.name == 'star'
+    )
+
+
+def count_stars(message: Message, settings: Settings) -> int:
+    for reaction in message.reactions:
+        if is_star(reaction.emoji, settings):
+            return reaction.count
+    return 0
+
+
+def get_content(message: Message, count: int, settings: Settings) -> str:
+    return '%s **%d** | %s' % (settings.starboard_emoji, count, message.jump_url)
 
 
 class StarboardExtension(Extension):
     bot: CustomClient
 
+    def __init__(self, bot: CustomClient) -> None:
+        self.updates: Debouncer[Tuple[Message, int]] = Debouncer(
+            UPDATE_WINDOW, self.update
+        )
+        self.limiter = RateLimiter(BACKFILL_RATE, max_queue=1000)
+        self.backfills: Dict[Tuple[int, int], asyncio.Task] = {}
+        # message_id -> (lock, number of tasks holding or waiting for it)
+        self.locks: Dict[int, Tuple[asyncio.Lock, int]] = {}
+        # (guild_id, message_id) -> starboard message posted by a backfill
+        # that is not saved to the database yet
+        self.unsaved: Dict[Tuple[int, int], int] = {}
+        bot.add_shutdown_hook(self.updates.flush)
+        bot.add_shutdown_hook(self.stop_backfills)
+
+    def drop(self) -> None:
+        self.bot.remove_shutdown_hook(self.updates.flush)
+        self.bot.remove_shutdown_hook(self.stop_backfills)
+        super().drop()
+
     async def get_embed_from_message(self, message: Message):
         return Embed(
             description=message.content,
@@ -25,69 +115,91 @@ class StarboardExtension(Extension):
             ),
         )
 
-    @listen()
-    async def on_reaction_add(self, event: MessageReactionAdd):
-        message = event.message
-        guild = message.guild
-        count = event.reaction_count
-        if (
-            guild is None
-            or event.emoji.id is not None
-            or (event.emoji.name != 'star' and event.emoji.name != '⭐')
-            or count < LIMIT
-        ):
-            return
-        settings = self.bot.database.get_guild_settings(guild.id)
+    async def get_channel(self, guild_id: int) -> Optional[GuildText]:
+        """Return the starboard channel of a guild, forgetting it if it was
+        deleted."""
+        settings = await self.bot.database.get_guild_settings(guild_id)
         if settings.starboard_channel is None:
-            return
-        channel = cast(GuildText, await guild.fetch_channel(settings.starboard_channel))
+            return None
+        channel = cast(
+            GuildText, await self.bot.fetch_channel(settings.starboard_channel)
+        )
         if channel is None:
             settings.starboard_channel = None
-            self.bot.database.set_guild_settings(guild.id, settings)
-            return
-        star_message_id = self.bot.database.get_starboard_message(guild.id, message.id)
-        content = ':star: **%d** | %s' % (count, message.jump_url)
-        if star_message_id is not None:
-            star_message = await channel.fetch_message(star_message_id)
-            if star_message is None:
-                star_message_id = None
+            await self.bot.database.set_guild_settings(guild_id, settings)
+        return channel
+
+    @asynccontextmanager
+    async def posting(self, message_id: int):
+        """Hold the lock of a message while deciding whether to post it, so a
+        backfill and a star reaction do not both post it."""
+        lock, users = self.locks.get(message_id, (asyncio.Lock(), 0))
+        self.locks[message_id] = lock, users + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self.locks[message_id]
+            if users == 1:
+                del self.locks[message_id]
             else:
-                await star_message.edit(content=content)
+                self.locks[message_id] = lock, users - 1
+
+    def get_star_message_id(self, guild_id: int, message_id: int) -> Optional[int]:
+        star_message_id = self.unsaved.get((guild_id, message_id))
         if star_message_id is None:
-            send = await channel.send(
-                content, embeds=await self.get_embed_from_message(message)
+            star_message_id = self.bot.database.get_starboard_message(
+                guild_id, message_id
             )
-            self.bot.database.add_starboard_message(guild.id, message.id, send.id)
+        return star_message_id
+
+    @listen()
+    async def on_reaction_add(self, event: MessageReactionAdd):
+        await self.schedule_update(event)
 
     @listen()
     async def on_reaction_remove(self, event: MessageReactionRemove):
+        await self.schedule_update(event)
+
+    async def schedule_update(self, event: MessageReactionAdd):
         message = event.message
-        guild = message.guild
+        if message.guild is None:
+            return
+        guild_id = message.guild.id
+        settings = await self.bot.database.get_guild_settings(guild_id)
+        if not is_star(event.emoji, settings):
+            return
         count = event.reaction_count
-        if (
-            guild is None
-            or event.emoji.id is not None
-            or (event.emoji.name != 'star' and event.emoji.name != '⭐')
+        if count < settings.starboard_threshold and (
+            self.get_star_message_id(guild_id, message.id) is None
         ):
             return
-        settings = self.bot.database.get_guild_settings(guild.id)
-        if settings.starboard_channel is None:
-            return
-        channel = cast(GuildText, await guild.fetch_channel(settings.starboard_channel))
+        # the count of the last event in the window is the current one
+        self.updates.schedule(message.id, (message, count))
+
+    async def update(self, message_id: int, state: Tuple[Message, int]):
+        message, count = state
+        guild = message.guild
+        channel = await self.get_channel(guild.id)
         if channel is None:
-            settings.starboard_channel = None
-            self.bot.database.set_guild_settings(guild.id, settings)
-            return
-        star_message_id = self.bot.database.get_starboard_message(guild.id, message.id)
-        if star_message_id is None:
-            return
-        star_message = await channel.fetch_message(star_message_id)
-        if star_message is None:
-            self.bot.database.delete_starboard_message(guild.id, message.id)
             return
-        await star_message.edit(
-            content=':star: **%d** | %s' % (count, message.jump_url)
-        )
+        settings = await self.bot.database.get_guild_settings(guild.id)
+        content = get_content(message, count, settings)
+        async with self.posting(message.id):
+            star_message_id = self.get_star_message_id(guild.id, message.id)
+            if star_message_id is not None:
+                star_message = await channel.fetch_message(star_message_id)
+                # a starboard post that someone deleted stays deleted
+                if star_message is not None:
+                    await star_message.edit(content=content)
+                return
+            if count >= settings.starboard_threshold:
+                send = await channel.send(
+                    content, embeds=await self.get_embed_from_message(message)
+                )
+                await self.bot.database.add_starboard_message(
+                    guild.id, message.id, send.id
+                )
 
     @listen()
     async def on_delete(self, event: MessageDelete):
@@ -95,23 +207,221 @@ class StarboardExtension(Extension):
         guild = message.guild
         if guild is None:
             return
-        settings = self.bot.database.get_guild_settings(guild.id)
-        if settings.starboard_channel is None:
+        self.updates.cancel(message.id)
+        star_message_id = self.get_star_message_id(guild.id, message.id)
+        if star_message_id is None:
             return
-        channel = cast(GuildText, await guild.fetch_channel(settings.starboard_channel))
+        channel = await self.get_channel(guild.id)
         if channel is None:
-            settings.starboard_channel = None
-            self.bot.database.set_guild_settings(guild.id, settings)
-            return
-        star_message_id = self.bot.database.get_starboard_message(guild.id, message.id)
-        if star_message_id is None:
             return
         star_message = await channel.fetch_message(star_message_id)
         if star_message is None:
-            self.bot.database.delete_starboard_message(guild.id, message.id)
+            await self.bot.database.delete_starboard_message(guild.id, message.id)
             return
         await star_message.delete()
-        self.bot.database.delete_starboard_message(guild.id, message.id)
+        await self.bot.database.delete_starboard_message(guild.id, message.id)
+
+    @slash_command(
+        'starboard',
+        description='Starboard settings',
+        default_member_permissions=Permissions.MANAGE_GUILD,
+        dm_permission=False,
+        sub_cmd_name='threshold',
+        sub_cmd_description='Set the number of stars needed to get on the starboard',
+        options=[
+            SlashCommandOption(
+                'stars',
+                type=OptionType.INTEGER,
+                description='The number of stars (default 1)',
+                min_value=1,
+            )
+        ],
+    )
+    async def threshold_command(self, ctx: InteractionContext):
+        stars: int = ctx.kwargs['stars']
+        settings = await self.bot.database.get_guild_settings(ctx.guild_id)
+        settings.starboard_threshold = stars
+        await self.bot.database.set_guild_settings(ctx.guild_id, settings)
+        await ctx.send(f'Messages now need **{stars}** stars to get on the starboard!')
+
+    @slash_command(
+        'starboard',
+        description='Starboard settings',
+        default_member_permissions=Permissions.MANAGE_GUILD,
+        dm_permission=False,
+        sub_cmd_name='emoji',
+        sub_cmd_description='Set the emoji that counts as a star',
+        options=[
+            SlashCommandOption(
+                'emoji',
+                type=OptionType.STRING,
+                description='The emoji (default ⭐)',
+            )
+        ],
+    )
+    async def emoji_command(self, ctx: InteractionContext):
+        emoji = parse_emoji(ctx.kwargs['emoji'])
+        if emoji is None:
+            return await ctx.send(
+                embeds=error_embed('That is not an emoji!'), ephemeral=True
+            )
+        settings = await self.bot.database.get_guild_settings(ctx.guild_id)
+        settings.starboard_emoji = str(emoji)
+        await self.bot.database.set_guild_settings(ctx.guild_id, settings)
+        await ctx.send(f'Stars are now counted with {emoji}!')
+
+    @slash_command(
+        'starboard',
+        description='Starboard settings',
+        default_member_permissions=Permissions.MANAGE_GUILD,
+        dm_permission=False,
+        sub_cmd_name='backfill',
+        sub_cmd_description='Post starred messages sent before the starboard was '
+        'set up',
+        options=[
+            SlashCommandOption(
+                'channel',
+                type=OptionType.CHANNEL,
+                description='The channel to scan',
+                channel_types=[ChannelType.GUILD_TEXT],
+            )
+        ],
+    )
+    async def backfill_command(self, ctx: InteractionContext):
+        channel: GuildText = ctx.kwargs['channel']
+        if await self.get_channel(ctx.guild_id) is None:
+            return await ctx.send(
+                embeds=error_embed('Please set a starboard channel first!'),
+                ephemeral=True,
+            )
+        key = ctx.guild_id, channel.id
+        if key in self.backfills:
+            return await ctx.send(
+                embeds=error_embed(f'{channel.mention} is already being scanned!'),
+                ephemeral=True,
+            )
+        backfill = await self.bot.database.start_starboard_backfill(*key)
+        self.start_backfill(backfill)
+        await ctx.send(
+            f'Scanning {channel.mention} for starred messages '
+            f'({backfill.scanned} scanned so far). '
+            'Use /starboard status to see the progress.'
+        )
+
+    @slash_command(
+        'starboard',
+        description='Starboard settings',
+        default_member_permissions=Permissions.MANAGE_GUILD,
+        dm_permission=False,
+        sub_cmd_name='status',
+        sub_cmd_description='Show the starboard settings and backfills',
+    )
+    async def status_command(self, ctx: InteractionContext):
+        settings = await self.bot.database.get_guild_settings(ctx.guild_id)
+        channel = (
+            f'<#{settings.starboard_channel}>'
+            if settings.starboard_channel
+            else '<No channel>'
+        )
+        lines = [
+            f'Starboard channel: {channel}',
+            f'Threshold: **{settings.starboard_threshold}** '
+            f'{settings.starboard_emoji}',
+        ]
+        for backfill in await self.bot.database.get_starboard_backfills(ctx.guild_id):
+            if backfill.done:
+                state = 'done'
+            elif (ctx.guild_id, backfill.channel_id) in self.backfills:
+                state = 'running'
+            else:
+                state = 'stopped'
+            lines.append(
+                f'Backfill of <#{backfill.channel_id}>: {state}, '
+                f'{backfill.scanned} scanned, {backfill.posted} posted'
+            )
+        await ctx.send('\n'.join(lines), ephemeral=True)
+
+    @listen()
+    async def on_startup(self):
+        for backfill in await self.bot.database.get_starboard_backfills():
+            if (backfill.guild_id, backfill.channel_id) not in self.backfills:
+                self.start_backfill(backfill)
+
+    def start_backfill(self, backfill: StarboardBackfill) -> None:
+        key = backfill.guild_id, backfill.channel_id
+        task = asyncio.create_task(self.run_backfill(backfill))
+        self.backfills[key] = task
+        task.add_done_callback(lambda _: self.backfills.pop(key, None))
+
+    async def stop_backfills(self) -> None:
+        tasks = list(self.backfills.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def run_backfill(self, backfill: StarboardBackfill) -> None:
+        """Scan a channel from its oldest message, a page at a time. Progress is
+        saved after every page, and when the scan is stopped halfway through
+        one, so an interrupted backfill resumes where it stopped."""
+        try:
+            channel = await self.bot.fetch_channel(backfill.channel_id)
+            if channel is None:
+                backfill.done = True
+                await self.bot.database.save_starboard_backfill(backfill, [])
+                return
+            channel = cast(GuildText, channel)
+            while not backfill.done:
+                # stop (and resume later) if the starboard channel was unset
+                starboard = await self.get_channel(backfill.guild_id)
+                if starboard is None:
+                    return
+                await self.limiter.acquire(backfill.guild_id)
+                messages = await channel.fetch_messages(
+                    limit=BACKFILL_PAGE, after=backfill.cursor
+                )
+                messages.sort(key=lambda m: m.id)
+                await self.backfill_page(
+                    backfill, starboard, messages, len(messages) < BACKFILL_PAGE
+                )
+        except Exception:
+            self.bot.logger.exception(
+                f'Starboard backfill of channel {backfill.channel_id} failed'
+            )
+
+    async def backfill_page(
+        self,
+        backfill: StarboardBackfill,
+        starboard: GuildText,
+        messages: List[Message],
+        last: bool,
+    ) -> None:
+        database = self.bot.database
+        guild_id = backfill.guild_id
+        posts: List[Tuple[int, int]] = []
+        try:
+            settings = await database.get_guild_settings(guild_id)
+            for message in messages:
+                count = count_stars(message, settings)
+                if count >= settings.starboard_threshold:
+                    async with self.posting(message.id):
+                        if self.get_star_message_id(guild_id, message.id) is None:
+                            await self.limiter.acquire(guild_id)
+                            send = await starboard.send(
+                                get_content(message, count, settings),
+                                embeds=await self.get_embed_from_message(message),
+                            )
+                            posts.append((message.id, send.id))
+                            self.unsaved[guild_id, message.id] = send.id
+                backfill.cursor = message.id
+                backfill.scanned += 1
+            backfill.done = last
+        finally:
+            backfill.posted += len(posts)
+            try:
+                await database.save_starboard_backfill(backfill, posts)
+            finally:
+                for message_id, _ in posts:
+                    self.unsaved.pop((guild_id, message_id), None)
 
 
 def setup(bot: CustomClient):
@@ -109,7 +109,7 @@ class TimeCommandExtension(Extension):
         time: Optional[str] = args.get('time')
         utc: bool = args.get('utc', False)
         if time is not None:
-            user = self.bot.database.get_user(ctx.user.id)
+            user = await self.bot.database.get_user(ctx.user.id)
             if utc:
                 tzoffset = 0
             else:
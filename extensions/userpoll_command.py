@@ -1,3 +1,6 @@
+import re
+from typing import Dict, List, Tuple
+
 from interactions import (
     ComponentContext,
     Embed,
@@ -15,6 +18,20 @@ from interactions import (
 from client import CustomClient
 from util import error_embed
 
+TOP = 20  # candidates shown in the results
+MENTION = re.compile(r'<@!?([0-9]+)>')
+
+
+def render(voters: int, candidates: int, top: List[Tuple[int, int]]) -> Embed:
+    lines = [f'<@{candidate_id}>: {votes}' for candidate_id, votes in top]
+    if candidates > len(top):
+        lines.append(f'...and {candidates - len(top)} more')
+    return Embed(
+        title='Poll results',
+        description='\n'.join(lines) or 'No results yet!',
+        footer=EmbedFooter(f'Voted: {voters}' if voters else 'Voted: N/A'),
+    )
+
 
 class UserpollCommandExtension(Extension):
     bot: CustomClient
@@ -57,12 +74,20 @@ class UserpollCommandExtension(Extension):
             max_values=max_values,
             custom_id='userpoll_select',
         )
-        embed = Embed(
-            title='Poll results',
-            description='No results yet!',
-            footer=EmbedFooter('Voted: N/A'),
-        )
-        await ctx.send(text, embeds=embed, components=select)
+        message = await ctx.send(text, embeds=render(0, 0, []), components=select)
+        await self.bot.database.add_userpoll(message.id)
+
+    async def add_legacy_userpoll(self, message_id: int, embed: Embed):
+        """Save a poll created before results were saved in the database, with
+        the results kept in its embed."""
+        footer = embed.footer.text if embed.footer else ''
+        voters = [int(id) for id in MENTION.findall(footer)]
+        votes: Dict[int, int] = {}
+        for line in (embed.description or '').splitlines():
+            match = MENTION.match(line)
+            if match and line.partition(': ')[2].isdigit():
+                votes[int(match.group(1))] = int(line.partition(': ')[2])
+        await self.bot.database.add_userpoll(message_id, voters, votes)
 
     @component_callback('userpoll_select')
     async def userpoll_select_callback(self, ctx: ComponentContext):
@@ -70,34 +95,20 @@ class UserpollCommandExtension(Extension):
         if message is None:
             await ctx.send(embeds=error_embed('Unknown error -17'), ephemeral=True)
             return
-        responder = ctx.user
-        embed = message.embeds[0]
-        desc = embed.description
-        if desc is None or desc == 'No results yet!':
-            desc = ''
-        footer = embed.footer
-        assert footer is not None
-        if responder.mention in footer.text:
+        database = self.bot.database
+        users: list[User] = ctx.values  # type: ignore
+        candidates = [user.id for user in users]
+        counted = await database.userpoll_vote(message.id, ctx.user.id, candidates)
+        if counted is None:
+            await self.add_legacy_userpoll(message.id, message.embeds[0])
+            counted = await database.userpoll_vote(
+                message.id, ctx.user.id, candidates
+            )
+        if not counted:
             await ctx.send('You have already responded to this poll!', ephemeral=True)
             return
-        if footer.text == 'Voted: N/A':
-            footer.text = f'Voted: {responder.mention}'
-        else:
-            footer.text += f', {responder.mention}'
-        embed.footer = footer
-        lines = desc.splitlines()
-        users: list[User] = ctx.values  # type: ignore
-        for user in users:
-            mention = user.mention
-            for i, line in enumerate(lines):
-                if line.startswith(f'{mention}: '):
-                    count = int(line.partition(': ')[2]) + 1
-                    lines[i] = f'{mention}: {count}'
-                    break
-            else:
-                lines.append(f'{mention}: 1')
-        embed.description = '\n'.join(lines)
-        await ctx.edit_origin(embeds=embed)
+        results = await database.get_userpoll_results(message.id, TOP)
+        await ctx.edit_origin(embeds=render(*results))
 
 
 def setup(bot: CustomClient):
@@ -49,7 +49,7 @@ class UserSettingsCommandExtension(Extension):
     @slash_command('usersettings', description='Edit settings for the user')
     async def usersettings_command(self, ctx: InteractionContext):
         user_id = ctx.user.id
-        user = self.bot.database.get_user(user_id)
+        user = await self.bot.database.get_user(user_id)
         embed, components = self.get_embed_and_components(user)
         await ctx.send(embeds=embed, components=components, ephemeral=True)
 
@@ -57,9 +57,9 @@ class UserSettingsCommandExtension(Extension):
     async def usersettings_timezone_callback(self, ctx: ComponentContext):
         tz = int(ctx.values[0])
         user_id = ctx.user.id
-        user = self.bot.database.get_user(user_id)
+        user = await self.bot.database.get_user(user_id)
         user.timezone = tz
-        self.bot.database.set_user(user_id, user)
+        await self.bot.database.set_user(user_id, user)
         embed, components = self.get_embed_and_components(user)
         await ctx.edit_origin(embeds=embed, components=components)
 
@@ -1,7 +1,11 @@
+import asyncio
 import json
+import os
 import random
 import re
-from typing import Optional
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set
 
 import aiohttp
 from interactions import (
@@ -16,21 +20,36 @@ from interactions import (
     SlashCommandOption,
     Timestamp,
     component_callback,
+    listen,
     slash_command,
 )
 
 from client import CustomClient
+from database import Database
 from util import error_embed
+from web import WebClient
+
+LATEST_TTL = 15 * 60
+CRAWL_DELAY = 1
+# the crawler waits up to this long after xkcd.com keeps failing
+CRAWL_MAX_DELAY = 15 * 60
+# comics kept in memory, the rest are read from the database
+CACHE_SIZE = int(os.getenv('XKCD_CACHE_SIZE', 256))
+
+
+TITLE = re.compile(r'XKCD #([0-9]+):')
 
 
 class XKCDError(RuntimeError):
-    def __init__(self, msg: str, *args: object) -> None:
+    def __init__(self, msg: str, *args: object, retry: bool = False) -> None:
         self.msg = msg
+        self.retry = retry
         super().__init__(*args)
 
 
 class XKCD:
     def __init__(self, data: dict):
+        self.data = data
         self.id = data['num']
         self.title = data['title']
         self.time = Timestamp(
@@ -41,24 +60,164 @@ class XKCD:
         self.link = f'https://xkcd.com/{self.id}/'
 
     @classmethod
-    async def fetch(cls, id: Optional[int] = None) -> 'XKCD':
+    async def fetch(cls, web: WebClient, id: Optional[int] = None) -> 'XKCD':
         path = f'https://xkcd.com/info.0.json'
         if id is not None:
             path = f'https://xkcd.com/{id}/info.0.json'
-        async with aiohttp.ClientSession() as session:
-            resp = await session.get(path)
-            if resp.status == 404:
-                raise XKCDError(f'XKCD {id} not found!')
-            if resp.status != 200:
-                raise XKCDError(f'HTTP error {resp.status}')
-            data = await resp.read()
+        try:
+            async with web.get(path) as resp:
+                if resp.status == 404:
+                    raise XKCDError(f'XKCD {id} not found!')
+                if resp.status != 200:
+                    raise XKCDError(
+                        f'HTTP error {resp.status}', retry=resp.status >= 500
+                    )
+                data = await resp.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            raise XKCDError(f'Cannot reach xkcd.com: {exc!r}', retry=True)
         info = json.loads(data)
         return cls(info)
 
 
+class XKCDStore:
+    """Comics that were already fetched, saved in the database.
+
+    Comics never change, so only the latest one expires; everything else is
+    fetched from xkcd.com at most once. The last ``size`` comics asked for are
+    also kept in memory. :meth:`crawl` fills in the comics that have never
+    been seen in the background.
+    """
+
+    def __init__(
+        self, web: WebClient, database: Database, size: int = CACHE_SIZE
+    ) -> None:
+        self.web = web
+        self.database = database
+        self.size = size
+        self._comics: 'OrderedDict[int, XKCD]' = OrderedDict()
+        self._latest: Optional[XKCD] = None
+        self._latest_time = 0.0
+        self._loading: Dict[int, asyncio.Future] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def latest(self) -> XKCD:
+        if self._latest is None or time.time() - self._latest_time > LATEST_TTL:
+            comic = await XKCD.fetch(self.web)
+            self._latest = comic
+            self._latest_time = time.time()
+            if comic.id not in self._comics:
+                self._remember(comic)
+                await self.database.add_xkcd(comic.id, comic.data)
+        return self._latest
+
+    async def get(self, id: Optional[int] = None) -> XKCD:
+        if id is None:
+            return await self.latest()
+        comic = self._comics.get(id)
+        if comic is not None:
+            self._comics.move_to_end(id)
+            return comic
+        # a prefetch of the same comic may be running already
+        loading = self._loading.get(id)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(id))
+            self._loading[id] = loading
+            loading.add_done_callback(lambda _: self._loading.pop(id, None))
+        return await asyncio.shield(loading)
+
+    async def _load(self, id: int) -> XKCD:
+        data = await self.database.get_xkcd(id)
+        if data is not None:
+            comic = XKCD(data)
+        else:
+            comic = await XKCD.fetch(self.web, id)
+            await self.database.add_xkcd(id, comic.data)
+        self._remember(comic)
+        return comic
+
+    def _remember(self, comic: XKCD) -> None:
+        self._comics[comic.id] = comic
+        self._comics.move_to_end(comic.id)
+        while len(self._comics) > self.size:
+            self._comics.popitem(last=False)
+
+    def prefetch(self, *ids: int) -> None:
+        """Fetch comics in the background, so they are ready when asked for."""
+        latest = self._latest.id if self._latest is not None else None
+        for id in ids:
+            if id < 1 or id in self._comics or (latest is not None and id > latest):
+                continue
+            task = asyncio.create_task(self._prefetch(id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _prefetch(self, id: int) -> None:
+        try:
+            await self.get(id)
+        except Exception:
+            pass  # it is fetched again when someone asks for it
+
+    async def close(self) -> None:
+        """Cancel the prefetches that are still running."""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def crawl(self) -> None:
+        """Save every comic that is not in the database yet. A comic that
+        cannot be fetched is skipped, and the crawler slows down while
+        xkcd.com keeps failing."""
+        latest = await self.latest()
+        known = await self.database.get_xkcd_ids()
+        delay = CRAWL_DELAY
+        for id in range(latest.id, 0, -1):
+            if id in known or id in self._comics:
+                continue
+            try:
+                # straight to the database, so the crawl does not flush the
+                # comics people are reading out of memory
+                comic = await XKCD.fetch(self.web, id)
+                await self.database.add_xkcd(id, comic.data)
+            except XKCDError as exc:
+                if exc.retry:
+                    delay = min(delay * 2, CRAWL_MAX_DELAY)
+            else:
+                delay = CRAWL_DELAY
+            await asyncio.sleep(delay)
+
+
 class XKCDCommandExtension(Extension):
     bot: CustomClient
 
+    def __init__(self, bot: CustomClient) -> None:
+        self.store = XKCDStore(bot.web, bot.database)
+        self._crawler: Optional[asyncio.Task] = None
+        bot.add_shutdown_hook(self.stop_tasks)
+
+    def drop(self) -> None:
+        self.bot.remove_shutdown_hook(self.stop_tasks)
+        super().drop()
+
+    @listen()
+    async def on_startup(self):
+        if self._crawler is None:
+            self._crawler = asyncio.create_task(self.crawl())
+
+    async def stop_tasks(self) -> None:
+        """Stop the crawler and the prefetches, which would otherwise go on
+        using the HTTP session after it is closed."""
+        if self._crawler is not None:
+            self._crawler.cancel()
+            await asyncio.gather(self._crawler, return_exceptions=True)
+        await self.store.close()
+
+    async def crawl(self):
+        try:
+            await self.store.crawl()
+        except Exception:
+            self.bot.logger.exception('Failed to crawl XKCD comics')
+
     @slash_command(
         name='xkcd',
         description='Fetch an XKCD comic',
@@ -81,14 +240,21 @@ class XKCDCommandExtension(Extension):
         args = ctx.kwargs
         id: Optional[int] = args.get('id')
         rand: bool = args.get('random', False)
-        if rand:
-            latest = await XKCD.fetch()
-            id = random.randint(1, latest.id)
         try:
-            comic = await XKCD.fetch(id)
+            if rand:
+                latest = await self.store.latest()
+                id = random.randint(1, latest.id)
+            comic = await self.store.get(id)
         except XKCDError as exc:
             await ctx.send(embeds=error_embed(exc.msg), ephemeral=True)
             return
+        embed, components = self.render(comic, ctx.user.id)
+        await ctx.send(embeds=embed, components=components)
+        self.store.prefetch(comic.id - 1, comic.id + 1)
+
+    def render(self, comic: XKCD, owner_id: int):
+        """Build the message for a comic. The comic ID and the user who may
+        page through it are kept in the custom IDs of the buttons."""
         embed = Embed(
             title=f'XKCD #{comic.id}: {comic.title}',
             images=[EmbedAttachment(comic.img)],
@@ -99,110 +265,91 @@ class XKCDCommandExtension(Extension):
             style=ButtonStyle.PRIMARY,
             label='Previous',
             emoji=':arrow_left:',
-            custom_id='xkcd_prev',
+            custom_id=f'xkcd_prev:{comic.id}:{owner_id}',
         )
         randc = Button(
             style=ButtonStyle.SECONDARY,
             label='Random',
             emoji=':game_die:',
-            custom_id='xkcd_rand',
+            custom_id=f'xkcd_rand:{comic.id}:{owner_id}',
         )
         next = Button(
             style=ButtonStyle.PRIMARY,
             label='Next',
             emoji=':arrow_right:',
-            custom_id='xkcd_next',
+            custom_id=f'xkcd_next:{comic.id}:{owner_id}',
         )
         show = Button(
-            style=ButtonStyle.SECONDARY, label='Show alt text', custom_id='xkcd_show'
+            style=ButtonStyle.SECONDARY,
+            label='Show alt text',
+            custom_id=f'xkcd_show:{comic.id}',
         )
-        await ctx.send(embeds=embed, components=[[prev, randc, next], [show]])
+        return embed, [[prev, randc, next], [show]]
 
-    @component_callback('xkcd_prev', 'xkcd_rand', 'xkcd_next')
+    @component_callback(re.compile(r'xkcd_(prev|rand|next):[0-9]+:[0-9]+$'))
     async def xkcd_page_callback(self, ctx: ComponentContext):
-        # print('defer')
-        # self.bot.logger.info('defer')
-        # await ctx.defer(edit_origin=True)
+        action, id_str, owner_str = ctx.custom_id.split(':')
+        await self.turn_page(ctx, action, int(id_str), int(owner_str))
+
+    @component_callback('xkcd_prev', 'xkcd_rand', 'xkcd_next', 'xkcd_show')
+    async def xkcd_legacy_callback(self, ctx: ComponentContext):
+        """Buttons of comics posted before their state was kept in the custom
+        IDs, which only have it in the embed title and the command message."""
         msg = ctx.message
         if msg is None:
             await ctx.send(embeds=error_embed('Unknown error -6'), ephemeral=True)
             return
-        if ctx.guild is not None:
-            member = ctx.member
-            if member is None:
-                await ctx.send(embeds=error_embed('Unknown error -7'), ephemeral=True)
-                return
-            interaction = msg.interaction
-            if interaction is None:
-                await ctx.send(embeds=error_embed('Unknown error -11'), ephemeral=True)
-                return
-            # interact_user = await interaction.user()
-            interact_user = self.bot.get_user(interaction._user_id)
-            if interact_user is None:
-                await ctx.send(embeds=error_embed('Unknown error -12'), ephemeral=True)
-                return
-            if interact_user.id != member.id:
-                await ctx.send(
-                    embeds=error_embed('Please do not click that! Not yours!'),
-                    ephemeral=True,
-                )
-                return
-        embeds = msg.embeds
-        if not embeds:
-            await ctx.send(embeds=error_embed('Unknown error -8'), ephemeral=True)
-            return
-        embed = embeds[0]
-        title = embed.title
-        if title is None:
-            await ctx.send(embeds=error_embed('Unknown error -9'), ephemeral=True)
-            return
-        match = re.match('XKCD #([0-9]+):', title)
+        title = msg.embeds[0].title if msg.embeds else None
+        match = TITLE.match(title or '')
         if match is None:
             await ctx.send(embeds=error_embed('Unknown error -10'), ephemeral=True)
             return
         id = int(match.group(1))
-        if ctx.custom_id == 'xkcd_prev':
-            id -= 1
-        elif ctx.custom_id == 'xkcd_next':
-            id += 1
-        else:
-            latest = await XKCD.fetch()
-            id = random.randint(1, latest.id)
+        if ctx.custom_id == 'xkcd_show':
+            await self.show_alt(ctx, id)
+            return
+        if msg.interaction is None:
+            await ctx.send(embeds=error_embed('Unknown error -11'), ephemeral=True)
+            return
+        # the new buttons have the state, so the message moves over to them
+        await self.turn_page(ctx, ctx.custom_id, id, int(msg.interaction._user_id))
+
+    async def turn_page(
+        self, ctx: ComponentContext, action: str, id: int, owner_id: int
+    ) -> None:
+        if ctx.guild is not None and ctx.user.id != owner_id:
+            await ctx.send(
+                embeds=error_embed('Please do not click that! Not yours!'),
+                ephemeral=True,
+            )
+            return
         try:
-            comic = await XKCD.fetch(id)
+            if action == 'xkcd_prev':
+                id -= 1
+            elif action == 'xkcd_next':
+                id += 1
+            else:
+                latest = await self.store.latest()
+                id = random.randint(1, latest.id)
+            comic = await self.store.get(id)
         except XKCDError as exc:
             await ctx.send(embeds=error_embed(exc.msg), ephemeral=True)
             return
-        embed = Embed(
-            title=f'XKCD #{comic.id}: {comic.title}',
-            images=[EmbedAttachment(comic.img)],
-            # description=comic.alt,
-            url=comic.link,
-        ).set_footer(f'{comic.time.year}-{comic.time.month:02}-{comic.time.day:02}')
-        await ctx.edit_origin(embeds=embed)
+        embed, components = self.render(comic, owner_id)
+        await ctx.edit_origin(embeds=embed, components=components)
+        self.store.prefetch(comic.id - 1, comic.id + 1)
 
-    @component_callback('xkcd_show')
+    @component_callback(re.compile(r'xkcd_show:[0-9]+$'))
     async def xkcd_show_callback(self, ctx: ComponentContext):
+        await self.show_alt(ctx, int(ctx.custom_id.partition(':')[2]))
+
+    async def show_alt(self, ctx: ComponentContext, id: int) -> None:
         msg = ctx.message
         if msg is None:
             await ctx.send(embeds=error_embed('Unknown error -6'), ephemeral=True)
             return
-        embeds = msg.embeds
-        if not embeds:
-            await ctx.send(embeds=error_embed('Unknown error -8'), ephemeral=True)
-            return
-        embed = embeds[0]
-        title = embed.title
-        if title is None:
-            await ctx.send(embeds=error_embed('Unknown error -9'), ephemeral=True)
-            return
-        match = re.match('XKCD #([0-9]+):', title)
-        if match is None:
-            await ctx.send(embeds=error_embed('Unknown error -10'), ephemeral=True)
-            return
-        id = int(match.group(1))
         try:
-            comic = await XKCD.fetch(id)
+            comic = await self.store.get(id)
         except XKCDError as exc:
             await ctx.send(embeds=error_embed(exc.msg), ephemeral=True)
             return
@@ -1,11 +1,9 @@
-import atexit
 import cgi
 import json
 import re
 from io import BytesIO
 from urllib.parse import parse_qs, urlparse
 
-from aiohttp import ClientSession
 from interactions import (
     ActionRow,
     Button,
@@ -28,22 +26,12 @@ from client import CustomClient
 BASE_URL = 'https://z-library.se'
 SEARCH_LIMIT = '5'
 
-SESSION = None
-
-
-async def _sess():
-    global SESSION
-    if SESSION is None:
-        SESSION = ClientSession()
-        atexit.register(SESSION.close)
-    return SESSION
-
 
 class ZlibCommandExtension(Extension):
     bot: CustomClient
 
-    def _user_zlib_auth(self, user_id: int):
-        user = self.bot.database.get_user(user_id)
+    async def _user_zlib_auth(self, user_id: int):
+        user = await self.bot.database.get_user(user_id)
         if user.zlib_query is None:
             return None
         parsed = parse_qs(user.zlib_query)
@@ -72,8 +60,7 @@ class ZlibCommandExtension(Extension):
         username = ctx.kwargs['username']
         password = ctx.kwargs['password']
         await ctx.defer(ephemeral=True)
-        sess = await _sess()
-        async with sess.post(
+        async with self.bot.web.post(
             f'{BASE_URL}/rpc.php',
             data={
                 'isModal': 'true',
@@ -111,9 +98,9 @@ class ZlibCommandExtension(Extension):
                 ),
                 ephemeral=True,
             )
-        user = self.bot.database.get_user(ctx.user.id)
+        user = await self.bot.database.get_user(ctx.user.id)
         user.zlib_query = urlparse(url).query
-        self.bot.database.set_user(ctx.user.id, user)
+        await self.bot.database.set_user(ctx.user.id, user)
         return await ctx.send(f'Welcome to Z-library, **{username}**!')
 
     @slash_command(
@@ -132,14 +119,13 @@ class ZlibCommandExtension(Extension):
     async def search_command(self, ctx: InteractionContext):
         keywords = ctx.kwargs['keywords']
         await ctx.defer()
-        sess = await _sess()
-        zlib_auth = self._user_zlib_auth(ctx.user.id)
+        zlib_auth = await self._user_zlib_auth(ctx.user.id)
         if zlib_auth is None:
             return await ctx.send(
                 'You have not logged in to Z-library yet. Use "/zlib auth" to begin!',
                 ephemeral=True,
             )
-        async with sess.post(
+        async with self.bot.web.post(
             f'{BASE_URL}/eapi/book/search',
             data={'message': keywords, 'limit': SEARCH_LIMIT},
             headers={'Cookie': zlib_auth},
@@ -197,15 +183,16 @@ class ZlibCommandExtension(Extension):
                 'You are not the user who searched. Please search again!',
                 ephemeral=True,
             )
-        zlib_auth = self._user_zlib_auth(ctx.user.id)
+        zlib_auth = await self._user_zlib_auth(ctx.user.id)
         if zlib_auth is None:
             return await ctx.send(
                 'You have not logged in to Z-library yet. Use "/zlib auth" to begin!',
                 ephemeral=True,
             )
         await ctx.defer(ephemeral=True)
-        sess = await _sess()
-        async with sess.get(f'{BASE_URL}{path}', headers={'Cookie': zlib_auth}) as r:
+        async with self.bot.web.get(
+            f'{BASE_URL}{path}', headers={'Cookie': zlib_auth}
+        ) as r:
             content_type = r.headers.get('Content-Type')
             header = r.headers.get('Content-Disposition')
             filename = 'book.bin'
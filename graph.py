@@ -1,10 +1,11 @@
 import asyncio
 import time
-from typing import List, Optional, TypedDict, Union
+from typing import List, TypedDict, Union
 
-import aiohttp
 import jwt
 
+from web import WebClient
+
 
 class LogInResponse(TypedDict):
     device_code: str
@@ -38,8 +39,9 @@ class TokensResponse(TypedDict):
 
 
 class Auth:
-    def __init__(self, client_id: str, tenant: str = 'common'):
+    def __init__(self, client_id: str, web: WebClient, tenant: str = 'common'):
         self.client_id = client_id
+        self.web = web
         self.tenant = tenant
         self.authority = f'https://login.microsoftonline.com/{tenant}'
 
@@ -47,39 +49,37 @@ class Auth:
         if any(x in scopes for x in ['offline_access', 'openid']):
             raise ValueError('Do not use offline_access, openid')
         scopes.extend(['offline_access', 'openid'])
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f'{self.authority}/oauth2/v2.0/devicecode',
-                data={'client_id': self.client_id, 'scope': ' '.join(scopes)},
-            ) as resp:
-                data = await resp.json()
-                if 'error' in data:
-                    return data
-                data['expires'] = int(time.time() + data['expires_in'])
+        async with self.web.post(
+            f'{self.authority}/oauth2/v2.0/devicecode',
+            data={'client_id': self.client_id, 'scope': ' '.join(scopes)},
+        ) as resp:
+            data = await resp.json()
+            if 'error' in data:
                 return data
+            data['expires'] = int(time.time() + data['expires_in'])
+            return data
 
     async def poll_log_in(self, data: PollData) -> Union[TokensResponse, ErrorResponse]:
         while True:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f'{self.authority}/oauth2/v2.0/token',
-                    data={
-                        'grant_type': 'urn:ietf:params:oauth:grant-type:device_code',
-                        'tenant': self.tenant,
-                        'client_id': self.client_id,
-                        'device_code': data['device_code'],
-                    },
-                ) as resp:
-                    resp = await resp.json()
-                    if resp.get('error') == 'authorization_pending':
-                        await asyncio.sleep(data['interval'])
-                        continue
-                    if resp.get('error') == 'bad_verification_code':
-                        raise ValueError(data['device_code'])
-                    if resp.get('error'):
-                        return resp
-                    resp['expires'] = int(time.time() + resp['expires_in'])
-                    return resp
+            async with self.web.post(
+                f'{self.authority}/oauth2/v2.0/token',
+                data={
+                    'grant_type': 'urn:ietf:params:oauth:grant-type:device_code',
+                    'tenant': self.tenant,
+                    'client_id': self.client_id,
+                    'device_code': data['device_code'],
+                },
+            ) as resp:
+                resp = await resp.json()
+            if resp.get('error') == 'authorization_pending':
+                await asyncio.sleep(data['interval'])
+                continue
+            if resp.get('error') == 'bad_verification_code':
+                raise ValueError(data['device_code'])
+            if resp.get('error'):
+                return resp
+            resp['expires'] = int(time.time() + resp['expires_in'])
+            return resp
 
     async def get_tokens(
         self, data: TokensResponse
@@ -88,21 +88,20 @@ class Auth:
         if time.time() + 10 < expires:
             return data
         refresh_token = data['refresh_token']
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f'{self.authority}/oauth2/v2.0/token',
-                data={
-                    'tenant': self.tenant,
-                    'client_id': self.client_id,
-                    'grant_type': 'refresh_token',
-                    'refresh_token': refresh_token,
-                },
-            ) as resp:
-                resp = await resp.json()
-                if 'error' in resp:
-                    return resp
-                resp['expires'] = int(time.time() + resp['expires_in'])
+        async with self.web.post(
+            f'{self.authority}/oauth2/v2.0/token',
+            data={
+                'tenant': self.tenant,
+                'client_id': self.client_id,
+                'grant_type': 'refresh_token',
+                'refresh_token': refresh_token,
+            },
+        ) as resp:
+            resp = await resp.json()
+            if 'error' in resp:
                 return resp
+            resp['expires'] = int(time.time() + resp['expires_in'])
+            return resp
 
     def parse_id_token(self, id_token: str) -> dict:
         return jwt.decode(
@@ -0,0 +1,146 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Dict, List, Optional
+
+from PIL import Image, ImageSequence, UnidentifiedImageError
+
+EMOJI_SIZE = 128
+EMOJI_MAX_SIZE = 256 * 1024
+# the largest upload /customreact accepts before normalizing it
+IMAGE_MAX_SIZE = int(os.getenv('IMAGE_MAX_SIZE', 8 * 1024 * 1024))
+# worker processes for resizing, the number of CPUs if 0
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 0))
+IMAGE_CACHE_SIZE = 64
+FORMATS = 'PNG', 'JPEG', 'GIF'
+
+
+class ImageError(Exception):
+    pass
+
+
+def _save(frames: List[Image.Image], durations: List[int], loop: int) -> bytes:
+    out = BytesIO()
+    frames[0].save(
+        out,
+        'GIF',
+        save_all=True,
+        append_images=frames[1:],
+        duration=durations,
+        loop=loop,
+        disposal=2,
+        optimize=True,
+    )
+    return out.getvalue()
+
+
+def _normalize_animated(image: Image.Image) -> bytes:
+    frames = []
+    durations = []
+    for frame in ImageSequence.Iterator(image):
+        frame = frame.convert('RGBA')
+        frame.thumbnail((EMOJI_SIZE, EMOJI_SIZE), Image.Resampling.LANCZOS)
+        frames.append(frame)
+        durations.append(frame.info.get('duration', 100))
+    loop = image.info.get('loop', 0)
+    data = _save(frames, durations, loop)
+    # too many frames for the size limit, drop every other one
+    while len(data) > EMOJI_MAX_SIZE and len(frames) > 1:
+        frames = frames[::2]
+        durations = [
+            sum(durations[i : i + 2]) for i in range(0, len(durations), 2)
+        ]
+        data = _save(frames, durations, loop)
+    return data
+
+
+def normalize_emoji(data: bytes) -> bytes:
+    """Downscale a PNG, JPEG or GIF image to the size of an emoji. Still images
+    are encoded as PNG, or JPEG if they were JPEG, and animated ones (APNG
+    too) as GIF, the only animated format Discord emojis play. Emojis are
+    uploaded as data URIs typed from the bytes, so there is no file name to
+    keep in line. Runs in a worker process."""
+    try:
+        with Image.open(BytesIO(data)) as image:
+            if image.format not in FORMATS:
+                raise ImageError(f'Unsupported image format: {image.format}')
+            if getattr(image, 'is_animated', False):
+                return _normalize_animated(image)
+            if image.format == 'JPEG':
+                # decode at a fraction of the size straight away
+                image.draft('RGB', (EMOJI_SIZE, EMOJI_SIZE))
+            format = 'JPEG' if image.format == 'JPEG' else 'PNG'
+            image = image.convert('RGB' if format == 'JPEG' else 'RGBA')
+            image.thumbnail((EMOJI_SIZE, EMOJI_SIZE), Image.Resampling.LANCZOS)
+            out = BytesIO()
+            image.save(out, format, optimize=True)
+            return out.getvalue()
+    except UnidentifiedImageError:
+        raise ImageError('The file is not an image!')
+    except (OSError, Image.DecompressionBombError) as exc:
+        raise ImageError(f'Cannot read the image: {exc}')
+
+
+class ImageProcessor:
+    """Emoji images normalized by hash of the original.
+
+    Images small enough to be emojis are left alone. Larger ones are resized
+    by :func:`normalize_emoji` in a pool of ``workers`` processes, so the
+    event loop never waits for Pillow and many images are resized at once.
+    The last ``size`` results are kept, and concurrent requests for the same
+    image share one job.
+    """
+
+    def __init__(
+        self, workers: int = IMAGE_WORKERS, size: int = IMAGE_CACHE_SIZE
+    ) -> None:
+        self.workers = workers or None
+        self.size = size
+        # started on first use, most images need no resizing
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._images: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+
+    async def emoji(self, data: bytes) -> bytes:
+        """Return ``data`` as an image Discord accepts for an emoji, raising
+        :class:`ImageError` if it is not a supported image."""
+        if len(data) <= EMOJI_MAX_SIZE:
+            return data
+        hash = hashlib.sha256(data).hexdigest()
+        image = self._images.get(hash)
+        if image is not None:
+            self._images.move_to_end(hash)
+        else:
+            loading = self._loading.get(hash)
+            if loading is None:
+                loading = asyncio.ensure_future(self._load(hash, data))
+                self._loading[hash] = loading
+                loading.add_done_callback(lambda _: self._loading.pop(hash, None))
+            image = await asyncio.shield(loading)
+        return image
+
+    async def _load(self, hash: str, data: bytes) -> bytes:
+        if self._executor is None:
+            # the bot already runs database threads, and forking a process with
+            # threads can deadlock the child on a lock another thread held
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context('forkserver')
+            )
+        loop = asyncio.get_running_loop()
+        image = await loop.run_in_executor(self._executor, normalize_emoji, data)
+        if len(image) > EMOJI_MAX_SIZE:
+            raise ImageError('The image is too large even after resizing')
+        self._images[hash] = image
+        while len(self._images) > self.size:
+            self._images.popitem(last=False)
+        return image
+
+    async def close(self) -> None:
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, executor.shutdown)
@@ -0,0 +1,262 @@
+import asyncio
+import os
+import re
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional, Set, Tuple
+
+from interactions import TYPE_MESSAGEABLE_CHANNEL, Guild, Message, Snowflake_Type
+from interactions.client.errors import HTTPException
+
+from database import Database
+
+LOCATOR_SIZE = int(os.getenv('MESSAGE_LOCATOR_SIZE', 65536))
+# channels probed at the same time when a message is not in the index
+LOCATOR_CONCURRENCY = int(os.getenv('MESSAGE_LOCATOR_CONCURRENCY', 8))
+# remember found messages in the database
+LOCATOR_PERSIST = os.getenv('MESSAGE_LOCATOR_PERSIST', 'true') in ['True', 'true', '1']
+# channels whose recent messages are kept for autocomplete
+RECENT_CHANNELS = int(os.getenv('MESSAGE_LOCATOR_CHANNELS', 1024))
+RECENT_SIZE = 25  # the most choices Discord shows
+
+JUMP_URL = re.compile(
+    r'https?://(?:(?:ptb|canary)\.)?discord(?:app)?\.com/channels/(\d+)/(\d+)/(\d+)/?'
+)
+# "Copy ID" on a message with shift held copies channel_id-message_id
+ID_PAIR = re.compile(r'(\d+)-(\d+)')
+
+# (message_id, author_id, label) of a recent message
+RecentMessage = Tuple[int, int, str]
+
+
+def parse_reference(
+    reference: str,
+) -> Optional[Tuple[Optional[int], Optional[int], int]]:
+    """Parse a message link, a ``channel-message`` ID pair or a message ID into
+    ``(guild_id, channel_id, message_id)``, with the parts it does not have as
+    None. Return None if it is none of them."""
+    reference = reference.strip()
+    if match := JUMP_URL.fullmatch(reference):
+        guild_id, channel_id, message_id = map(int, match.groups())
+        return guild_id, channel_id, message_id
+    if match := ID_PAIR.fullmatch(reference):
+        channel_id, message_id = map(int, match.groups())
+        return None, channel_id, message_id
+    if reference.isdigit():
+        return None, None, int(reference)
+
+
+def get_label(message: Message) -> str:
+    """A one-line description of a message for an autocomplete choice."""
+    text = message.content
+    if not text:
+        for embed in message.embeds:
+            text = embed.title or embed.description
+            if text:
+                break
+    if not text:
+        text = '[attachment]' if message.attachments else '[message]'
+    label = '%s: %s' % (message.author.display_name, ' '.join(text.split()))
+    return label if len(label) <= 100 else label[:99] + '…'
+
+
+class MessageLocator:
+    """Find a message of a guild from its ID alone.
+
+    Discord can only fetch a message from its channel, so the channels of
+    known messages are kept in an index: the messages the bot has seen being
+    sent, and those it has found or resolved before. The index is an LRU of
+    ``size`` messages, and if ``database`` is given found and resolved
+    messages are also saved there to be remembered across restarts. A message
+    that is not in the index is looked for in every channel of the guild,
+    ``concurrency`` at a time, and the other requests are cancelled once one
+    of them finds it.
+
+    The last messages of recently active channels are kept too, to be
+    suggested when a command asks for a message.
+    """
+
+    def __init__(
+        self,
+        database: Optional[Database] = None,
+        size: int = LOCATOR_SIZE,
+        concurrency: int = LOCATOR_CONCURRENCY,
+    ) -> None:
+        self.database = database
+        self.size = size
+        self.concurrency = concurrency
+        # message_id -> (guild_id, channel_id)
+        self._index: 'OrderedDict[int, Tuple[int, int]]' = OrderedDict()
+        # channel_id -> its last messages, oldest first
+        self._recent: 'OrderedDict[int, Deque[RecentMessage]]' = OrderedDict()
+        # channels whose history was fetched to fill self._recent
+        self._loaded: Set[int] = set()
+
+    def add(self, message: Message) -> None:
+        if message._guild_id is None:
+            return
+        channel_id = int(message._channel_id)
+        self._remember(int(message.id), int(message._guild_id), channel_id)
+        recent = self._recent.get(channel_id)
+        if recent is None:
+            recent = self._recent[channel_id] = deque(maxlen=RECENT_SIZE)
+            while len(self._recent) > RECENT_CHANNELS:
+                self._loaded.discard(self._recent.popitem(last=False)[0])
+        else:
+            self._recent.move_to_end(channel_id)
+        recent.append((int(message.id), int(message.author.id), get_label(message)))
+
+    def discard(self, message_id: Snowflake_Type) -> None:
+        message_id = int(message_id)
+        location = self._index.pop(message_id, None)
+        recent = location and self._recent.get(location[1])
+        if recent:
+            for item in recent:
+                if item[0] == message_id:
+                    recent.remove(item)
+                    break
+
+    def _remember(self, message_id: int, guild_id: int, channel_id: int) -> None:
+        self._index[message_id] = guild_id, channel_id
+        self._index.move_to_end(message_id)
+        while len(self._index) > self.size:
+            self._index.popitem(last=False)
+
+    async def _lookup(self, guild_id: int, message_id: int) -> Optional[int]:
+        location = self._index.get(message_id)
+        if location is not None:
+            self._index.move_to_end(message_id)
+        elif self.database is not None:
+            location = await self.database.get_message_location(message_id)
+            if location is not None:
+                self._remember(message_id, *location)
+        if location is not None and location[0] == guild_id:
+            return location[1]
+
+    async def resolve(self, guild: Guild, reference: str) -> Optional[Message]:
+        """Return the message of ``guild`` a link, ``channel-message`` ID pair
+        or message ID refers to. Only a bare ID needs the channels searched."""
+        parsed = parse_reference(reference)
+        if parsed is None:
+            return None
+        guild_id, channel_id, message_id = parsed
+        if guild_id is not None and guild_id != guild.id:
+            return None
+        if channel_id is None:
+            return await self.find(guild, message_id)
+        message = await self._fetch(channel_id, message_id, guild)
+        # the pair may point to a channel of another guild the bot is in
+        if message is None or message._guild_id != guild.id:
+            return None
+        await self._found(message_id, int(guild.id), channel_id)
+        return message
+
+    async def find(self, guild: Guild, message_id: Snowflake_Type) -> Optional[Message]:
+        """Return the message of ``guild`` with the ID, or None if it does not
+        exist or is in a channel the bot cannot read."""
+        try:
+            message_id = int(message_id)
+        except ValueError:
+            return None
+        channel_id = await self._lookup(int(guild.id), message_id)
+        if channel_id is not None:
+            message = await self._fetch(channel_id, message_id, guild)
+            if message is not None:
+                return message
+            self.discard(message_id)
+        message = await self._probe(guild, message_id)
+        if message is not None:
+            await self._found(message_id, int(guild.id), int(message._channel_id))
+        return message
+
+    async def _found(self, message_id: int, guild_id: int, channel_id: int) -> None:
+        self._remember(message_id, guild_id, channel_id)
+        if self.database is not None:
+            await self.database.set_message_location(message_id, guild_id, channel_id)
+
+    async def _fetch(
+        self, channel_id: int, message_id: int, guild: Guild
+    ) -> Optional[Message]:
+        try:
+            return await guild._client.cache.fetch_message(channel_id, message_id)
+        except HTTPException:
+            # not found, or the channel is gone or hidden from the bot
+            return None
+
+    async def _probe(self, guild: Guild, message_id: int) -> Optional[Message]:
+        channels = [
+            channel
+            for channel in guild.channels
+            if isinstance(channel, TYPE_MESSAGEABLE_CHANNEL)
+        ]
+        for channel in channels:
+            message = channel.get_message(message_id)
+            if message is not None:
+                return message
+        cached = {channel.id for channel in channels}
+        # IDs are snowflakes, so a channel created after the message cannot have
+        # it, and channels with a newer last message are more likely to
+        fetched = [
+            channel
+            for channel in await guild.fetch_channels()
+            if isinstance(channel, TYPE_MESSAGEABLE_CHANNEL)
+            and channel.id <= message_id
+        ]
+        fetched.sort(key=lambda c: (c.last_message_id or 0) < message_id)
+        for channel in fetched:
+            if channel.id not in cached:
+                message = channel.get_message(message_id)
+                if message is not None:
+                    return message
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def probe(channel_id: int) -> Optional[Message]:
+            async with semaphore:
+                return await self._fetch(channel_id, message_id, guild)
+
+        tasks = [asyncio.create_task(probe(channel.id)) for channel in fetched]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                message = await next_done
+                if message is not None:
+                    return message
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def suggest(
+        self,
+        channel: TYPE_MESSAGEABLE_CHANNEL,
+        text: str,
+        author_id: Optional[int] = None,
+    ) -> List[dict]:
+        """Return autocomplete choices for the recent messages of ``channel``
+        whose ID or label contains ``text``, newest first. The choices resolve
+        without a search. The history of a channel is fetched once if the bot
+        has not seen enough of its messages."""
+        channel_id = int(channel.id)
+        recent = self._recent.get(channel_id)
+        if (recent is None or len(recent) < RECENT_SIZE) and (
+            channel_id not in self._loaded
+        ):
+            self._loaded.add(channel_id)
+            try:
+                messages = await channel.fetch_messages(limit=RECENT_SIZE)
+            except HTTPException:
+                messages = []
+            seen = {item[0] for item in recent or ()}
+            for message in sorted(messages, key=lambda m: m.id):
+                if message.id not in seen:
+                    self.add(message)
+            recent = self._recent.get(channel_id)
+            if recent:
+                self._recent[channel_id] = deque(sorted(recent), maxlen=RECENT_SIZE)
+                recent = self._recent[channel_id]
+        text = text.strip().lower()
+        choices = []
+        for message_id, author, label in reversed(recent or ()):
+            if author_id is not None and author != author_id:
+                continue
+            if text in str(message_id) or text in label.lower():
+                choices.append({'name': label, 'value': f'{channel_id}-{message_id}'})
+        return choices
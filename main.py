@@ -15,27 +15,35 @@ if 1001 not in client_const.RECOVERABLE_WEBSOCKET_CLOSE_CODES:
         1001,
     )
 
-dotenv.load_dotenv()
-init_logging()
 
-DEBUG = os.getenv('DEBUG') in ['True', 'true', '1']
+def main():
+    dotenv.load_dotenv()
+    init_logging()
 
-kwargs = dict(
-    activity='/quote | /chat',
-    total_shards=int(os.getenv('SHARDS', 1)),
-    shard_id=int(os.getenv('SHARD_ID', 0)),
-    intents=Intents.DEFAULT | Intents.MESSAGE_CONTENT | Intents.GUILD_MEMBERS,
-)
+    debug = os.getenv('DEBUG') in ['True', 'true', '1']
 
-if DEBUG:
-    debug_guild_id = os.getenv('DEBUG_GUILD')
-    if debug_guild_id is None:
-        raise ValueError('DEBUG_GUILD should be set to the server ID to debug in')
-    kwargs.update(debug_scope=int(debug_guild_id))
-    print(f'using debug_scope={debug_guild_id}')
+    kwargs = dict(
+        activity='/quote | /chat',
+        total_shards=int(os.getenv('SHARDS', 1)),
+        shard_id=int(os.getenv('SHARD_ID', 0)),
+        intents=Intents.DEFAULT | Intents.MESSAGE_CONTENT | Intents.GUILD_MEMBERS,
+    )
+
+    if debug:
+        debug_guild_id = os.getenv('DEBUG_GUILD')
+        if debug_guild_id is None:
+            raise ValueError(
+                'DEBUG_GUILD should be set to the server ID to debug in'
+            )
+        kwargs.update(debug_scope=int(debug_guild_id))
+        print(f'using debug_scope={debug_guild_id}')
+
+    bot = CustomClient(**kwargs)
+
+    load_extensions(bot)
 
-bot = CustomClient(**kwargs)
+    bot.start(os.getenv('DISCORD_TOKEN'))
 
-load_extensions(bot)
 
-bot.start(os.getenv('DISCORD_TOKEN'))
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import asyncio
+import time
+from typing import Dict, Optional, Tuple
+
+from database import Database
+from util import tomorrow
+
+LIMITS = {'chat': 10000, 'images': 5}
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, kind: str, limit: int, *args):
+        self.kind = kind
+        self.limit = limit
+        super().__init__(*args)
+
+
+class Reservation:
+    __slots__ = 'user_id', 'kind', 'amount', 'reset', 'done'
+
+    def __init__(self, user_id: int, kind: str, amount: int, reset: float) -> None:
+        self.user_id = user_id
+        self.kind = kind
+        self.amount = amount
+        self.reset = reset
+        self.done = False
+
+
+class _Counter:
+    __slots__ = 'used', 'reserved'
+
+    def __init__(self, used: int) -> None:
+        self.used = used
+        self.reserved = 0
+
+
+class QuotaManager:
+    """Daily per-user quotas of ``chat`` tokens and ``images``.
+
+    Usage is reserved before calling the API, then either committed with the
+    real amount or refunded. Counters for the current day are kept in memory,
+    so checking and reserving is a dictionary lookup, and since nothing is
+    awaited between the check and the reservation, parallel requests cannot
+    overshoot the limit together.
+    """
+
+    def __init__(
+        self, database: Database, limits: Optional[Dict[str, int]] = None
+    ) -> None:
+        self.database = database
+        self.limits = dict(LIMITS if limits is None else limits)
+        self._reset = 0.0
+        self._counters: Dict[Tuple[int, str, float], _Counter] = {}
+        self._loading: Dict[int, asyncio.Future] = {}
+
+    @property
+    def reset(self) -> float:
+        """The time the current quota day ends."""
+        if time.time() > self._reset:
+            self._reset = tomorrow().timestamp()
+            self._counters.clear()
+        return self._reset
+
+    async def _counter(self, user_id: int, kind: str) -> _Counter:
+        reset = self.reset
+        counter = self._counters.get((user_id, kind, reset))
+        if counter is not None:
+            return counter
+        loading = self._loading.get(user_id)
+        if loading is None:
+            loading = asyncio.ensure_future(self.database.get_user(user_id))
+            self._loading[user_id] = loading
+            loading.add_done_callback(lambda _: self._loading.pop(user_id, None))
+        user = await asyncio.shield(loading)
+        reset = self.reset
+        for name in self.limits:
+            key = (user_id, name, reset)
+            if key not in self._counters:
+                stale = time.time() > getattr(user, f'{name}_reset')
+                used = 0 if stale else getattr(user, f'{name}_used')
+                self._counters[key] = _Counter(used)
+        return self._counters[(user_id, kind, reset)]
+
+    async def usage(self, user_id: int, kind: str) -> int:
+        """Return how much of the quota the user has used today."""
+        return (await self._counter(user_id, kind)).used
+
+    async def reserve(
+        self, user_id: int, kind: str, amount: int = 1, partial: bool = False
+    ) -> Reservation:
+        """Reserve part of the quota, raising :class:`QuotaExceeded` if it
+        would go over the limit. With ``partial``, whatever is left of
+        ``amount`` is reserved instead, and only an exhausted quota raises;
+        for usage that is only estimated up front and committed as it
+        turns out."""
+        counter = await self._counter(user_id, kind)
+        limit = self.limits[kind]
+        remaining = limit - counter.used - counter.reserved
+        if partial and remaining > 0:
+            amount = min(amount, remaining)
+        if amount > remaining:
+            raise QuotaExceeded(kind, limit)
+        counter.reserved += amount
+        return Reservation(user_id, kind, amount, self.reset)
+
+    def refund(self, reservation: Reservation) -> None:
+        """Release a reservation without using it. Does nothing if it was
+        already committed or refunded."""
+        if reservation.done:
+            return
+        reservation.done = True
+        key = (reservation.user_id, reservation.kind, reservation.reset)
+        counter = self._counters.get(key)
+        if counter is not None:
+            counter.reserved -= reservation.amount
+
+    async def commit(
+        self, reservation: Reservation, amount: Optional[int] = None
+    ) -> None:
+        """Turn a reservation into usage of ``amount`` (by default the amount
+        reserved) and save it."""
+        if reservation.done:
+            raise ValueError('Reservation already committed or refunded')
+        if amount is None:
+            amount = reservation.amount
+        self.refund(reservation)
+        key = (reservation.user_id, reservation.kind, reservation.reset)
+        counter = self._counters.get(key)
+        if counter is not None:
+            counter.used += amount
+        await self.database.add_usage(
+            reservation.user_id, reservation.kind, amount, reservation.reset
+        )
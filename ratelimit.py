@@ -0,0 +1,136 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Hashable, Optional
+
+
+class QueueFull(Exception):
+    pass
+
+
+class RateLimiter:
+    """Token bucket for outgoing requests to a rate limited service.
+
+    Up to ``burst`` requests go through at once, after that ``rate`` requests
+    per second. Callers that have to wait are queued by key (e.g. the guild
+    they come from) and served round-robin, so one busy guild cannot starve
+    the others. At most ``max_queue`` callers wait at a time, the rest fail
+    with :class:`QueueFull` instead of piling up.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, max_queue: int = 100) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._queues: 'OrderedDict[Hashable, Deque[asyncio.Future]]' = OrderedDict()
+        self._queued = 0
+        self._task: Optional[asyncio.Task] = None
+        # metrics
+        self.served = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def queued(self) -> int:
+        """The number of callers waiting for a token."""
+        return self._queued
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'queued': self._queued,
+            'served': self.served,
+            'rejected': self.rejected,
+            'average_wait': self.total_wait / self.served if self.served else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+    def _refill(self) -> float:
+        now = time.monotonic()
+        if now > self._paused_until:
+            start = max(self._updated, self._paused_until)
+            self._tokens = min(self.burst, self._tokens + (now - start) * self.rate)
+        self._updated = now
+        return now
+
+    def _delay(self) -> float:
+        """Seconds until the next token is available."""
+        now = self._refill()
+        if now < self._paused_until:
+            return self._paused_until - now + 1 / self.rate
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self, key: Hashable = None) -> None:
+        """Wait for a token, queued behind the other callers with ``key``."""
+        if not self._queues and self._delay() <= 0:
+            self._tokens -= 1
+            self.served += 1
+            return
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            raise QueueFull()
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+        queue.append(future)
+        self._queued += 1
+        if self._task is None:
+            self._task = asyncio.create_task(self._dispatch())
+        start = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if not future.done() or future.cancelled():
+                self._remove(key, future)
+            else:
+                # the token was handed over as we were cancelled, give it back
+                self._tokens += 1
+                self.served -= 1
+            raise
+        waited = time.monotonic() - start
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def _remove(self, key: Hashable, future: asyncio.Future) -> None:
+        queue = self._queues.get(key)
+        if queue is None or future not in queue:
+            return
+        queue.remove(future)
+        self._queued -= 1
+        if not queue:
+            del self._queues[key]
+
+    async def _dispatch(self) -> None:
+        try:
+            while self._queues:
+                delay = self._delay()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                key, queue = next(iter(self._queues.items()))
+                future = queue.popleft()
+                self._queued -= 1
+                if queue:
+                    self._queues.move_to_end(key)
+                else:
+                    del self._queues[key]
+                if future.done():
+                    continue
+                self._tokens -= 1
+                self.served += 1
+                future.set_result(None)
+        finally:
+            self._task = None
+
+    def backoff(self, delay: float) -> None:
+        """Stop handing out tokens for ``delay`` seconds, e.g. after the service
+        answered with 429 Too Many Requests."""
+        self._refill()
+        self._tokens = 0.0
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
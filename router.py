@@ -0,0 +1,120 @@
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from interactions import ComponentContext
+
+Handler = Callable[[ComponentContext, str], Awaitable[None]]
+
+
+class Route:
+    """A handler of custom IDs starting with ``prefix``, with counters of how
+    long it takes."""
+
+    __slots__ = 'prefix', 'handler', 'calls', 'errors', 'total_time', 'max_time'
+
+    prefix: str
+    handler: Handler
+    calls: int
+    errors: int
+    total_time: float
+    max_time: float
+
+    def __init__(self, prefix: str, handler: Handler) -> None:
+        self.prefix = prefix
+        self.handler = handler
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'average_time': self.total_time / self.calls if self.calls else 0.0,
+            'max_time': self.max_time,
+        }
+
+
+class _Node:
+    __slots__ = 'children', 'route'
+
+    def __init__(self) -> None:
+        self.children: Dict[str, _Node] = {}
+        self.route: Optional[Route] = None
+
+
+class ComponentRouter:
+    """Send component interactions to handlers by the prefix of their custom
+    ID.
+
+    The prefixes are kept in a trie, so finding the handler of a custom ID
+    takes one step per character of its prefix, however many routes there
+    are. If several prefixes match, the longest one wins. The handler is
+    called with the context and the rest of the custom ID after the prefix.
+    """
+
+    def __init__(self) -> None:
+        self._root = _Node()
+        self._routes: Dict[str, Route] = {}
+
+    def add(self, prefix: str, handler: Handler) -> None:
+        """Route custom IDs starting with ``prefix`` to ``handler``, replacing
+        the handler the prefix had (e.g. when an extension is reloaded)."""
+        if not prefix:
+            raise ValueError('The prefix must not be empty')
+        node = self._root
+        for char in prefix:
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = _Node()
+            node = child
+        node.route = self._routes[prefix] = Route(prefix, handler)
+
+    def remove(self, prefix: str) -> None:
+        route = self._routes.pop(prefix, None)
+        if route is None:
+            return
+        path = [self._root]
+        for char in prefix:
+            path.append(path[-1].children[char])
+        path[-1].route = None
+        # prune the nodes that lead to no route anymore
+        for i in range(len(prefix), 0, -1):
+            node = path[i]
+            if node.route is not None or node.children:
+                break
+            del path[i - 1].children[prefix[i - 1]]
+
+    def match(self, custom_id: str) -> Optional[Route]:
+        node = self._root
+        route = None
+        for char in custom_id:
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.route is not None:
+                route = node.route
+        return route
+
+    async def dispatch(self, ctx: ComponentContext) -> bool:
+        """Call the handler of the custom ID of ``ctx``. Return False if it has
+        none."""
+        route = self.match(ctx.custom_id)
+        if route is None:
+            return False
+        start = time.perf_counter()
+        try:
+            await route.handler(ctx, ctx.custom_id[len(route.prefix) :])
+        except BaseException:
+            route.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            route.calls += 1
+            route.total_time += elapsed
+            route.max_time = max(route.max_time, elapsed)
+        return True
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {prefix: route.stats() for prefix, route in self._routes.items()}
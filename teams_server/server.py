@@ -6,7 +6,6 @@ from datetime import datetime, timedelta
 from html import escape as html_escape
 from typing import TYPE_CHECKING, cast
 
-from aiohttp import ClientSession
 from aiohttp.web import (
     Application,
     AppRunner,
@@ -44,10 +43,7 @@ client_state = os.getenv('GRAPH_CLIENT_STATE', 'this_is_really_secreeet')
 external_url = os.getenv('TEAMS_EXTERNAL_URL')
 if external_url is None:
     raise ValueError('TEAMS_EXTERNAL_URL environment variable not found')
-
-
-auth = Auth(client_id, os.getenv('GRAPH_TENANT', 'common'))
-sub = GraphSubscriptions(client_state, auth)
+tenant = os.getenv('GRAPH_TENANT', 'common')
 
 routes = RouteTableDef()
 
@@ -108,6 +104,8 @@ async def lifecycle_notification(request: Request):
 
 async def chat_message_parse(value: dict, app: Application):
     bot: 'CustomClient' = app['DISCORD_BOT']
+    auth: Auth = app['GRAPH_AUTH']
+    sub: GraphSubscriptions = app['GRAPH_SUBSCRIPTIONS']
     odata_id = value['resourceData']['@odata.id']
     client_state_dict = json.loads(value['clientState'])
     subscription_id = value['subscriptionId']
@@ -115,7 +113,7 @@ async def chat_message_parse(value: dict, app: Application):
     chat_id = client_state_dict.get('c')
     if guild_id is None or chat_id is None:
         return
-    settings = bot.database.get_guild_settings(guild_id)
+    settings = await bot.database.get_guild_settings(guild_id)
     if settings.teams_auth is None:
         return
     tokens = await auth.get_tokens(settings.teams_auth)
@@ -123,17 +121,17 @@ async def chat_message_parse(value: dict, app: Application):
         return app.logger.warning(f'Error in CM parse refresh: {tokens}')
     if tokens != settings.teams_auth:
         settings.teams_auth = tokens
-        bot.database.set_guild_settings(guild_id, settings)
+        await bot.database.set_guild_settings(guild_id, settings)
     if settings.teams_chat_id != chat_id:
         return await sub.remove_subscription(tokens, subscription_id)
     if settings.teams_channel is None:
         return
-    async with ClientSession(
-        headers={'Authorization': 'Bearer ' + tokens['access_token']}
-    ) as session:
-        async with session.get(f'https://graph.microsoft.com/v1.0/{odata_id}') as resp:
-            status = resp.status
-            data = await resp.json()
+    async with bot.web.get(
+        f'https://graph.microsoft.com/v1.0/{odata_id}',
+        headers={'Authorization': 'Bearer ' + tokens['access_token']},
+    ) as resp:
+        status = resp.status
+        data = await resp.json()
     if status != 200:
         return app.logger.warning(
             f'HTTP status {status} fetching message {odata_id}: {data}'
@@ -161,18 +159,20 @@ async def chat_message_parse(value: dict, app: Application):
     channel = await guild.fetch_channel(settings.teams_channel)
     if not isinstance(channel, TYPE_MESSAGEABLE_CHANNEL):
         settings.teams_channel = None
-        return bot.database.set_guild_settings(guild_id, settings)
+        return await bot.database.set_guild_settings(guild_id, settings)
     await channel.send(f'**{user_name}** _from Teams_\n{message}')
 
 
 async def lifecycle_parse(value: dict, app: Application):
     bot: 'CustomClient' = app['DISCORD_BOT']
+    auth: Auth = app['GRAPH_AUTH']
+    sub: GraphSubscriptions = app['GRAPH_SUBSCRIPTIONS']
     client_state_dict = json.loads(value['clientState'])
     guild_id = client_state_dict.get('g')
     if guild_id is None:
         return app.logger.error(f'Guild id missing: {value}')
     subscription_id = value['subscriptionId']
-    settings = bot.database.get_guild_settings(guild_id)
+    settings = await bot.database.get_guild_settings(guild_id)
     if settings.teams_auth is None or settings.teams_chat_id is None:
         return
     tokens = await auth.get_tokens(settings.teams_auth)
@@ -180,7 +180,7 @@ async def lifecycle_parse(value: dict, app: Application):
         return app.logger.error(f'Error in refresh for {guild_id}: {tokens}')
     if tokens != settings.teams_auth:
         settings.teams_auth = tokens
-        bot.database.set_guild_settings(guild_id, settings)
+        await bot.database.set_guild_settings(guild_id, settings)
     sub_chat_id = client_state_dict.get('c')
     if settings.teams_chat_id != sub_chat_id:
         return await sub.remove_subscription(tokens, subscription_id)
@@ -221,6 +221,9 @@ def build_app(bot: 'CustomClient') -> Application:
     app = Application(logger=logger)
     app.add_routes(routes)
     app['DISCORD_BOT'] = bot
+    # share the bot's HTTP session, which the bot closes on shutdown
+    app['GRAPH_AUTH'] = auth = Auth(client_id, bot.web, tenant)
+    app['GRAPH_SUBSCRIPTIONS'] = GraphSubscriptions(client_state, auth)
     app['CM_QUEUE'] = cm_queue = Queue()
     app['LF_QUEUE'] = lf_queue = Queue()
     cm_coro = chat_message_background(cm_queue, app)
@@ -1,8 +1,6 @@
 from datetime import datetime
 from typing import Optional, TypedDict
 
-from aiohttp.client import request
-
 from graph import Auth, TokensResponse
 
 
@@ -59,7 +57,7 @@ class GraphSubscriptions:
     async def get_subscription(
         self, auth: TokensResponse, id: str
     ) -> GraphSubscription:
-        async with request(
+        async with self.auth.web.request(
             'GET',
             f'https://graph.microsoft.com/v1.0/subscriptions/{id}',
             headers={'Authorization': await self._get_token(auth)},
@@ -67,7 +65,7 @@ class GraphSubscriptions:
             return await resp.json()
 
     async def remove_subscription(self, auth: TokensResponse, id: str) -> bool:
-        async with request(
+        async with self.auth.web.request(
             'DELETE',
             f'https://graph.microsoft.com/v1.0/subscriptions/{id}',
             headers={'Authorization': await self._get_token(auth)},
@@ -93,7 +91,7 @@ class GraphSubscriptions:
         }
         if lifecycle_notification_url is not None:
             data.update(lifecycleNotificationUrl=lifecycle_notification_url)
-        async with request(
+        async with self.auth.web.request(
             'POST',
             f'https://graph.microsoft.com/v1.0/subscriptions',
             headers={'Authorization': await self._get_token(auth)},
@@ -104,7 +102,7 @@ class GraphSubscriptions:
     async def renew_subscription(
         self, auth: TokensResponse, id: str, expiration: datetime
     ) -> GraphSubscription:
-        async with request(
+        async with self.auth.web.request(
             'PATCH',
             f'https://graph.microsoft.com/v1.0/subscriptions/{id}',
             headers={'Authorization': await self._get_token(auth)},
@@ -0,0 +1,123 @@
+import asyncio
+import os
+from typing import Optional
+
+import aiohttp
+
+POOL_LIMIT = int(os.getenv('HTTP_POOL_LIMIT', 100))
+POOL_LIMIT_PER_HOST = int(os.getenv('HTTP_POOL_LIMIT_PER_HOST', 10))
+DNS_CACHE_TTL = int(os.getenv('HTTP_DNS_CACHE_TTL', 300))
+KEEPALIVE_TIMEOUT = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', 30))
+TIMEOUT = float(os.getenv('HTTP_TIMEOUT', 60))
+DOWNLOAD_TIMEOUT = float(os.getenv('HTTP_DOWNLOAD_TIMEOUT', 30))
+DOWNLOAD_RETRIES = 3
+CHUNK_SIZE = 64 * 1024
+
+
+class DownloadError(Exception):
+    def __init__(self, msg: str, *args, retry: bool = False):
+        self.msg = msg
+        self.retry = retry
+        super().__init__(msg, *args)
+
+
+class DownloadTooLarge(DownloadError):
+    pass
+
+
+class WebClient:
+    """HTTP client shared by everything in the bot that talks to the web.
+
+    All requests go through one :class:`aiohttp.ClientSession`, so connections
+    are kept alive and reused per host and DNS lookups are cached, instead of
+    paying a TCP and TLS handshake for every request. Cookies are never stored,
+    since the session is shared between users.
+    """
+
+    def __init__(
+        self,
+        limit: int = POOL_LIMIT,
+        limit_per_host: int = POOL_LIMIT_PER_HOST,
+        dns_cache_ttl: int = DNS_CACHE_TTL,
+        keepalive_timeout: float = KEEPALIVE_TIMEOUT,
+        timeout: float = TIMEOUT,
+    ) -> None:
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                cookie_jar=aiohttp.DummyCookieJar(),
+            )
+        return self._session
+
+    def request(self, method: str, url: str, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.session.post(url, **kwargs)
+
+    async def download(
+        self,
+        url: str,
+        max_size: Optional[int] = None,
+        timeout: float = DOWNLOAD_TIMEOUT,
+        retries: int = DOWNLOAD_RETRIES,
+    ) -> bytes:
+        """Download a file into memory.
+
+        The body is streamed, and the download is aborted as soon as it grows
+        past ``max_size`` bytes. Connection errors, timeouts and server errors
+        are retried up to ``retries`` times with exponential backoff.
+        """
+        for attempt in range(retries + 1):
+            if attempt:
+                await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+            try:
+                return await self._download(url, max_size, timeout)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                error = DownloadError(f'Failed to download file: {exc!r}', retry=True)
+            except DownloadError as exc:
+                error = exc
+            if not error.retry:
+                break
+        raise error
+
+    async def _download(
+        self, url: str, max_size: Optional[int], timeout: float
+    ) -> bytes:
+        async with self.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+            if resp.status != 200:
+                raise DownloadError(
+                    f'HTTP error {resp.status}', retry=resp.status >= 500
+                )
+            if max_size is not None and (resp.content_length or 0) > max_size:
+                raise DownloadTooLarge(f'File is larger than {max_size} bytes')
+            buf = bytearray()
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                buf += chunk
+                if max_size is not None and len(buf) > max_size:
+                    raise DownloadTooLarge(f'File is larger than {max_size} bytes')
+            return bytes(buf)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None